@@ -0,0 +1,476 @@
+#!/usr/bin/env python
+# corpus.py
+# Conversion benchmark over the example VGM corpus
+# By Simon Morris (https://github.com/simondotm/)
+# See https://github.com/simondotm/vgm-packer
+#
+# Copyright (c) 2019 Simon Morris. All rights reserved.
+#
+# "MIT License":
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+import glob
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import vgm2electron
+from vgm2electron import VgmElectron
+from modules.vgmparser import VgmStream
+from modules.vgmsynth import VgmSynth
+
+
+#--------------------------------------------------------------------------------------------------------------
+# Converts every VGM in the corpus with each settings profile, and records the conversion time (best of
+# REPEATS runs), the peak traced Python heap (from one more run with tracemalloc, so that the tracing
+# doesn't skew the timings) and the size of each output file. Conversions run in this process, one at a
+# time, so the timings don't include Python startup or compete for CPUs.
+#
+# Results can be saved as a baseline and compared against on later runs. A time or peak memory more than
+# THRESHOLD above the baseline, or any output file getting bigger, is flagged as a regression. Timings
+# depend on the machine, so they are only compared with a baseline saved on the same host, and the
+# baseline in the repository has none.
+#
+# The scaling mode makes tunes SCALES times longer than an input by repeating its commands, or synthesises
+# tunes of SCALES times a given length with VgmSynth, to show how the conversion time and memory grow with
+# the length of the tune.
+#--------------------------------------------------------------------------------------------------------------
+
+class CorpusBenchmark:
+
+	# conversion settings for each profile, using the vgm2electron --server setting names
+	PROFILES = {
+		'default': {},
+		'technique1': { 'technique': 1 },
+		'encoders': { 'compress': True, 'rle': True, 'patterns': True },
+		'trim_loop': { 'trim': True, 'loop': True },
+	}
+
+	REPEATS = 3			# conversion timing is the best of this many runs
+	THRESHOLD = 0.2		# fractional increase over the baseline flagged as a regression
+	MIN_TIME = 0.01		# seconds, time differences smaller than this are noise
+	SCALES = [ 1, 10, 100 ]
+
+	VERBOSE = False
+
+
+	def __init__(self, profiles = None, repeats = REPEATS, memory = True):
+
+		if profiles is None:
+			profiles = list(self.PROFILES.keys())
+		for name in profiles:
+			if name not in self.PROFILES:
+				raise ValueError("Unknown profile '" + name + "', must be one of " + ", ".join(self.PROFILES.keys()))
+
+		self.profiles = profiles
+		self.repeats = repeats
+		self.memory = memory
+		self.output_dir = tempfile.mkdtemp(prefix = "vgmbench")
+
+
+	def close(self):
+		shutil.rmtree(self.output_dir, ignore_errors = True)
+
+
+	# returns the corpus VGM files, leaving out converted outputs
+	def get_corpus(self, dirs = [ "examples", os.path.join("examples", "convert") ]):
+
+		filenames = []
+		for d in dirs:
+			for filename in sorted(glob.glob(os.path.join(d, "*.vgm"))):
+				if not filename.endswith(".electron.vgm"):
+					filenames.append(filename)
+		return filenames
+
+
+	# convert a VGM once with the current VgmElectron settings, with the log thrown away
+	# returns the conversion time in seconds
+	def convert(self, filename, dst_filename):
+
+		log = sys.stdout
+		sys.stdout = open(os.devnull, 'w')
+		try:
+			packer = VgmElectron()
+			packer.VERBOSE = False
+			start_time = time.perf_counter()
+			packer.process(filename, dst_filename)
+			return time.perf_counter() - start_time
+		finally:
+			sys.stdout.close()
+			sys.stdout = log
+
+
+	# returns the number of frames in a ULA data file
+	# there is a byte per frame, plus a 3 byte [0x01][lo][hi] end of stream marker
+	# (0x01 is never output as a ULA value)
+	def count_frames(self, ula_filename):
+
+		ula_file = open(ula_filename, 'rb')
+		ula_data = ula_file.read()
+		ula_file.close()
+		if len(ula_data) >= 3 and ula_data[-3] == VgmElectron.ULA_LOOP_MARKER:
+			return len(ula_data) - 3
+		return len(ula_data)
+
+
+	# benchmark one VGM with one settings profile
+	# returns a result dict
+	def run_file(self, filename, profile, name = None):
+
+		# the path names the file, as the corpus has tunes with the same name in different directories
+		if name is None:
+			name = os.path.normpath(filename).replace(os.sep, "/")
+
+		# every profile starts from the default options, as in a --server request
+		args = vgm2electron.get_parser().parse_args([])
+		for k, v in self.PROFILES[profile].items():
+			setattr(args, k, v)
+		log = sys.stdout
+		sys.stdout = open(os.devnull, 'w')
+		try:
+			vgm2electron.apply_args(args)
+		finally:
+			sys.stdout.close()
+			sys.stdout = log
+		VgmElectron.KEEP_ULA_DATA = False
+
+		dst_filename = os.path.join(self.output_dir, os.path.splitext(os.path.basename(filename))[0] + ".electron.vgm")
+
+		convert_time = None
+		for r in range(self.repeats):
+			t = self.convert(filename, dst_filename)
+			if convert_time is None or t < convert_time:
+				convert_time = t
+
+		peak_memory = None
+		if self.memory:
+			tracemalloc.start()
+			self.convert(filename, dst_filename)
+			peak_memory = tracemalloc.get_traced_memory()[1]
+			tracemalloc.stop()
+
+		frames = self.count_frames(dst_filename + ".ula.bin")
+
+		# output sizes, by extension (eg. '.ula.bin') and tidy up for the next run
+		sizes = {}
+		for output in sorted(glob.glob(dst_filename + "*")):
+			sizes[output[len(dst_filename):] or ".electron.vgm"] = os.path.getsize(output)
+			os.remove(output)
+
+		if self.VERBOSE: print(name + " " + profile + " " + "%.3f" % convert_time + "s")
+
+		return {
+			'file': name,
+			'profile': profile,
+			'frames': frames,
+			'time': round(convert_time, 6),
+			'fps': round(frames / convert_time, 1) if convert_time > 0 else 0.0,
+			'peak_memory': peak_memory,
+			'sizes': sizes,
+		}
+
+
+	# benchmark every VGM with every profile
+	# returns list of result dicts, in file then profile order
+	def run(self, filenames):
+
+		results = []
+		for filename in filenames:
+			for profile in self.profiles:
+				results.append(self.run_file(filename, profile))
+		return results
+
+
+	#----------------------------------------------------------
+	# Scaling
+	#----------------------------------------------------------
+
+	# write a VGM that plays the commands of filename scale times over, without a loop
+	# returns the new filename
+	def make_scaled(self, filename, scale):
+
+		log = sys.stdout
+		sys.stdout = open(os.devnull, 'w')
+		try:
+			vgm = VgmStream(filename)
+
+			# the commands, as (bytes, samples) chunks for VgmStream.write_vgm_chunks(), less the end of data command
+			commands = []
+			samples = 0
+			for q in vgm.command_list:
+				command = q['command'][0]
+				if command == 0x66:
+					break
+				data = q['command'] + (q['data'] or b'')
+				wait = 0
+				if command == 0x61:
+					wait = q['data'][0] + q['data'][1] * 256
+				elif command == 0x62:
+					wait = 735
+				elif command == 0x63:
+					wait = 882
+				elif 0x70 <= command <= 0x7f:
+					wait = (command & 15) + 1
+				commands.append( (data, wait) )
+				samples += wait
+
+			def chunks():
+				for n in range(scale):
+					for chunk in commands:
+						yield chunk
+				yield (b'\x66', 0)
+
+			scaled_filename = os.path.join(self.output_dir, os.path.splitext(os.path.basename(filename))[0] + "-x" + str(scale) + ".vgm")
+			vgm.write_vgm_chunks(chunks(), scaled_filename, samples * scale)
+		finally:
+			sys.stdout.close()
+			sys.stdout = log
+
+		return scaled_filename
+
+
+	# benchmark a VGM made scales times longer, with the first profile
+	# returns list of result dicts, in scale order
+	def run_scaling(self, filename, scales = SCALES):
+
+		results = []
+		for scale in scales:
+			scaled_filename = self.make_scaled(filename, scale)
+			results.append(self.run_file(scaled_filename, self.profiles[0], os.path.normpath(filename).replace(os.sep, "/") + " x" + str(scale)))
+			os.remove(scaled_filename)
+
+		self.add_growth(results, scales)
+		return results
+
+
+	# benchmark synthetic VGMs of scales times duration seconds, with the first profile and the current VgmSynth settings
+	# returns list of result dicts, in scale order
+	def run_synthetic(self, duration, scales = SCALES):
+
+		results = []
+		for scale in scales:
+			synth_filename = os.path.join(self.output_dir, "synth.vgm")
+			log = sys.stdout
+			sys.stdout = open(os.devnull, 'w')
+			synth_duration = VgmSynth.DURATION
+			try:
+				VgmSynth.DURATION = duration * scale
+				VgmSynth().write(synth_filename)
+			finally:
+				VgmSynth.DURATION = synth_duration
+				sys.stdout.close()
+				sys.stdout = log
+			results.append(self.run_file(synth_filename, self.profiles[0], "synth " + str(duration) + "s x" + str(scale)))
+			os.remove(synth_filename)
+
+		self.add_growth(results, scales)
+		return results
+
+
+	# add the time and memory growth relative to the shortest tune to scaling results,
+	# which should be about the same as the scale for a linear conversion
+	def add_growth(self, results, scales):
+
+		base = results[0]
+		for scale, result in zip(scales, results):
+			result['scale'] = scale
+			result['time_growth'] = round(result['time'] / base['time'], 2) if base['time'] > 0 else 0.0
+			if self.memory:
+				result['memory_growth'] = round(float(result['peak_memory']) / base['peak_memory'], 2) if base['peak_memory'] else 0.0
+
+
+	#----------------------------------------------------------
+	# Baseline comparison
+	#----------------------------------------------------------
+
+	# returns a description of this machine, saved with the baseline so that timings are only compared on
+	# the machine they were recorded on
+	def get_host(self):
+		return platform.node() + " " + platform.machine() + " Python " + platform.python_version()
+
+
+	# compare results with a baseline, matching them by file and profile
+	# times are only compared if compare_times is set, and the baseline has them
+	# returns a list of (result, message) for each regression
+	def compare(self, results, baseline, threshold = THRESHOLD, compare_times = True):
+
+		baseline = { (b['file'], b['profile']) : b for b in baseline }
+		regressions = []
+		for r in results:
+			b = baseline.get( (r['file'], r['profile']) )
+			if b is None:
+				continue
+
+			if compare_times and 'time' in b and r['time'] > b['time'] * (1.0 + threshold) and r['time'] - b['time'] > self.MIN_TIME:
+				regressions.append( (r, "time " + "%.3f" % b['time'] + "s -> " + "%.3f" % r['time'] + "s (+" + "%.0f" % (100.0 * (r['time'] / b['time'] - 1.0)) + "%)") )
+
+			if r['peak_memory'] is not None and b['peak_memory'] is not None and r['peak_memory'] > b['peak_memory'] * (1.0 + threshold):
+				regressions.append( (r, "peak memory " + str(b['peak_memory']) + " -> " + str(r['peak_memory']) + " bytes (+" + "%.0f" % (100.0 * (float(r['peak_memory']) / b['peak_memory'] - 1.0)) + "%)") )
+
+			# the conversion is deterministic, so any growth in an output is a real change
+			for extension, size in r['sizes'].items():
+				if size > b['sizes'].get(extension, size):
+					regressions.append( (r, extension + " size " + str(b['sizes'][extension]) + " -> " + str(size) + " bytes") )
+
+		return regressions
+
+
+	# returns (host, results) where host is the machine the baseline was saved on, or None if not known
+	def load_baseline(self, filename):
+
+		baseline_file = open(filename, 'r')
+		baseline = json.load(baseline_file)
+		baseline_file.close()
+		return baseline.get('host'), baseline['results'] + baseline.get('scaling', [])
+
+
+	def write_json(self, results, scaling, filename):
+
+		output = {
+			'host': self.get_host(),
+			'profiles': { name : self.PROFILES[name] for name in self.profiles },
+			'repeats': self.repeats,
+			'results': results,
+			'scaling': scaling,
+		}
+		json_file = open(filename, 'w')
+		json.dump(output, json_file, indent = 1, sort_keys = True)
+		json_file.close()
+
+
+	def markdown(self, results, scaling, regressions = []):
+
+		kb = lambda size: "%.1f" % (size / 1024.0) if size is not None else "-"
+
+		lines = []
+		if len(results):
+			lines.append("| File | Profile | Frames | Time ms | Frames/s | Peak KB | ULA bytes | VGM bytes |")
+			lines.append("|---|---|---:|---:|---:|---:|---:|---:|")
+			for r in results:
+				lines.append("| " + " | ".join([
+					r['file'], r['profile'], str(r['frames']), "%.1f" % (r['time'] * 1000.0), "%.0f" % r['fps'],
+					kb(r['peak_memory']), str(r['sizes'].get(".ula.bin", 0)), str(r['sizes'].get(".electron.vgm", 0)) ]) + " |")
+			lines.append("")
+
+		if len(scaling):
+			lines.append("| File | Scale | Frames | Time ms | Frames/s | Time growth | Peak KB | Memory growth |")
+			lines.append("|---|---:|---:|---:|---:|---:|---:|---:|")
+			for r in scaling:
+				lines.append("| " + " | ".join([
+					r['file'], "x" + str(r['scale']), str(r['frames']), "%.1f" % (r['time'] * 1000.0), "%.0f" % r['fps'],
+					"x" + str(r['time_growth']), kb(r['peak_memory']), "x" + str(r['memory_growth']) if 'memory_growth' in r else "-" ]) + " |")
+			lines.append("")
+
+		if len(regressions):
+			lines.append("| File | Profile | Regression |")
+			lines.append("|---|---|---|")
+			for r, message in regressions:
+				lines.append("| " + r['file'] + " | " + r['profile'] + " | " + message + " |")
+			lines.append("")
+
+		return "\n".join(lines)
+
+
+#------------------------------------------------------------------------
+# Main()
+#------------------------------------------------------------------------
+
+import argparse
+
+# Determine if running as a script
+if __name__ == '__main__':
+
+	BASELINE = os.path.join("benchmarks", "baseline.json")
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument("input", nargs="*", help="VGM files to benchmark (default is 'examples/*.vgm' and 'examples/convert/*.vgm')")
+	parser.add_argument("-p", "--profiles", default=",".join(CorpusBenchmark.PROFILES.keys()), metavar="<names>", help="Comma separated list of settings profiles to run, default: " + ",".join(CorpusBenchmark.PROFILES.keys()))
+	parser.add_argument("-n", "--repeats", type=int, default=CorpusBenchmark.REPEATS, metavar="<n>", help="Time the best of <n> conversions")
+	parser.add_argument("--no-memory", help="Don't measure peak memory, which takes an extra, much slower, traced conversion", action="store_true")
+	parser.add_argument("--scale", metavar="<file>", help="Also benchmark <file> made 10 and 100 times longer (see --scales), with the first profile")
+	parser.add_argument("--synth", type=float, metavar="<s>", help="Also benchmark synthetic tunes of <s> seconds made 10 and 100 times longer (see --scales), with the first profile")
+	parser.add_argument("--scales", default=",".join([ str(s) for s in CorpusBenchmark.SCALES ]), metavar="<n,n>", help="Comma separated lengths to scale to, default: " + ",".join([ str(s) for s in CorpusBenchmark.SCALES ]))
+	parser.add_argument("--scale-only", help="Only run the scaling benchmarks, not the corpus", action="store_true")
+	parser.add_argument("--baseline", default=BASELINE, metavar="<file>", help="Compare with baseline JSON <file>, default: " + BASELINE)
+	parser.add_argument("--save-baseline", help="Save the results as the new baseline instead of comparing with it", action="store_true")
+	parser.add_argument("-t", "--threshold", type=float, default=CorpusBenchmark.THRESHOLD, metavar="<f>", help="Flag times or peak memory this fraction over the baseline, default: " + str(CorpusBenchmark.THRESHOLD))
+	parser.add_argument("--json", metavar="<file>", help="Write results to a JSON file")
+	parser.add_argument("--md", metavar="<file>", help="Write results to a Markdown file")
+	parser.add_argument("-v", "--verbose", help="Enable verbose mode", action="store_true")
+	args = parser.parse_args()
+
+	filenames = args.input
+	if len(filenames) == 0 and not args.scale_only:
+		filenames = CorpusBenchmark().get_corpus()
+		if len(filenames) == 0:
+			print("ERROR: No VGM files to benchmark")
+			sys.exit(1)
+	if args.scale_only:
+		filenames = []
+		if args.scale == None and args.synth == None:
+			print("ERROR: --scale-only needs a file to scale with --scale, or --synth")
+			sys.exit(1)
+
+	try:
+		benchmark = CorpusBenchmark(args.profiles.split(","), args.repeats, not args.no_memory)
+	except ValueError as e:
+		print("ERROR: " + str(e))
+		sys.exit(1)
+	benchmark.VERBOSE = args.verbose
+
+	try:
+		results = benchmark.run(filenames)
+		scaling = []
+		if args.scale != None:
+			scaling += benchmark.run_scaling(args.scale, [ int(s) for s in args.scales.split(",") ])
+		if args.synth != None:
+			scaling += benchmark.run_synthetic(args.synth, [ int(s) for s in args.scales.split(",") ])
+	finally:
+		benchmark.close()
+
+	regressions = []
+	if args.save_baseline:
+		benchmark.write_json(results, scaling, args.baseline)
+		print("Saved baseline '" + args.baseline + "'")
+	elif os.path.isfile(args.baseline):
+		host, baseline = benchmark.load_baseline(args.baseline)
+		compare_times = host == benchmark.get_host()
+		if not compare_times:
+			print("Baseline '" + args.baseline + "' was not saved on this machine, only comparing peak memory and output sizes")
+		regressions = benchmark.compare(results + scaling, baseline, args.threshold, compare_times)
+
+	table = benchmark.markdown(results, scaling, regressions)
+	print(table)
+
+	if args.json != None:
+		benchmark.write_json(results, scaling, args.json)
+	if args.md != None:
+		md_file = open(args.md, 'w')
+		md_file.write(table)
+		md_file.close()
+
+	if len(regressions):
+		print("ERROR: " + str(len(regressions)) + " regressions against baseline '" + args.baseline + "'")
+		sys.exit(1)
@@ -0,0 +1,574 @@
+#!/usr/bin/env python
+# cpu6502.py
+# Minimal cycle counting 6502 simulator and assembler, for measuring player routines
+# By Simon Morris (https://github.com/simondotm/)
+# See https://github.com/simondotm/vgm-packer
+#
+# Copyright (c) 2019 Simon Morris. All rights reserved.
+#
+# "MIT License":
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+import re
+
+
+#--------------------------------------------------------------------------------------------------------------
+# Instruction set
+# All 151 documented NMOS 6502 opcodes as mnemonic : [ (addressing mode, opcode, base cycles), ... ]
+# Reads using absolute,X / absolute,Y / (indirect),Y take one more cycle if the index crosses a page,
+# and taken branches take one more cycle, plus another if they branch to a different page.
+#--------------------------------------------------------------------------------------------------------------
+
+OPCODES = {
+	'ADC' : [ ('imm',0x69,2), ('zp',0x65,3), ('zpx',0x75,4), ('abs',0x6d,4), ('absx',0x7d,4), ('absy',0x79,4), ('indx',0x61,6), ('indy',0x71,5) ],
+	'AND' : [ ('imm',0x29,2), ('zp',0x25,3), ('zpx',0x35,4), ('abs',0x2d,4), ('absx',0x3d,4), ('absy',0x39,4), ('indx',0x21,6), ('indy',0x31,5) ],
+	'ASL' : [ ('acc',0x0a,2), ('zp',0x06,5), ('zpx',0x16,6), ('abs',0x0e,6), ('absx',0x1e,7) ],
+	'BCC' : [ ('rel',0x90,2) ],
+	'BCS' : [ ('rel',0xb0,2) ],
+	'BEQ' : [ ('rel',0xf0,2) ],
+	'BIT' : [ ('zp',0x24,3), ('abs',0x2c,4) ],
+	'BMI' : [ ('rel',0x30,2) ],
+	'BNE' : [ ('rel',0xd0,2) ],
+	'BPL' : [ ('rel',0x10,2) ],
+	'BRK' : [ ('imp',0x00,7) ],
+	'BVC' : [ ('rel',0x50,2) ],
+	'BVS' : [ ('rel',0x70,2) ],
+	'CLC' : [ ('imp',0x18,2) ],
+	'CLD' : [ ('imp',0xd8,2) ],
+	'CLI' : [ ('imp',0x58,2) ],
+	'CLV' : [ ('imp',0xb8,2) ],
+	'CMP' : [ ('imm',0xc9,2), ('zp',0xc5,3), ('zpx',0xd5,4), ('abs',0xcd,4), ('absx',0xdd,4), ('absy',0xd9,4), ('indx',0xc1,6), ('indy',0xd1,5) ],
+	'CPX' : [ ('imm',0xe0,2), ('zp',0xe4,3), ('abs',0xec,4) ],
+	'CPY' : [ ('imm',0xc0,2), ('zp',0xc4,3), ('abs',0xcc,4) ],
+	'DEC' : [ ('zp',0xc6,5), ('zpx',0xd6,6), ('abs',0xce,6), ('absx',0xde,7) ],
+	'DEX' : [ ('imp',0xca,2) ],
+	'DEY' : [ ('imp',0x88,2) ],
+	'EOR' : [ ('imm',0x49,2), ('zp',0x45,3), ('zpx',0x55,4), ('abs',0x4d,4), ('absx',0x5d,4), ('absy',0x59,4), ('indx',0x41,6), ('indy',0x51,5) ],
+	'INC' : [ ('zp',0xe6,5), ('zpx',0xf6,6), ('abs',0xee,6), ('absx',0xfe,7) ],
+	'INX' : [ ('imp',0xe8,2) ],
+	'INY' : [ ('imp',0xc8,2) ],
+	'JMP' : [ ('abs',0x4c,3), ('ind',0x6c,5) ],
+	'JSR' : [ ('abs',0x20,6) ],
+	'LDA' : [ ('imm',0xa9,2), ('zp',0xa5,3), ('zpx',0xb5,4), ('abs',0xad,4), ('absx',0xbd,4), ('absy',0xb9,4), ('indx',0xa1,6), ('indy',0xb1,5) ],
+	'LDX' : [ ('imm',0xa2,2), ('zp',0xa6,3), ('zpy',0xb6,4), ('abs',0xae,4), ('absy',0xbe,4) ],
+	'LDY' : [ ('imm',0xa0,2), ('zp',0xa4,3), ('zpx',0xb4,4), ('abs',0xac,4), ('absx',0xbc,4) ],
+	'LSR' : [ ('acc',0x4a,2), ('zp',0x46,5), ('zpx',0x56,6), ('abs',0x4e,6), ('absx',0x5e,7) ],
+	'NOP' : [ ('imp',0xea,2) ],
+	'ORA' : [ ('imm',0x09,2), ('zp',0x05,3), ('zpx',0x15,4), ('abs',0x0d,4), ('absx',0x1d,4), ('absy',0x19,4), ('indx',0x01,6), ('indy',0x11,5) ],
+	'PHA' : [ ('imp',0x48,3) ],
+	'PHP' : [ ('imp',0x08,3) ],
+	'PLA' : [ ('imp',0x68,4) ],
+	'PLP' : [ ('imp',0x28,4) ],
+	'ROL' : [ ('acc',0x2a,2), ('zp',0x26,5), ('zpx',0x36,6), ('abs',0x2e,6), ('absx',0x3e,7) ],
+	'ROR' : [ ('acc',0x6a,2), ('zp',0x66,5), ('zpx',0x76,6), ('abs',0x6e,6), ('absx',0x7e,7) ],
+	'RTI' : [ ('imp',0x40,6) ],
+	'RTS' : [ ('imp',0x60,6) ],
+	'SBC' : [ ('imm',0xe9,2), ('zp',0xe5,3), ('zpx',0xf5,4), ('abs',0xed,4), ('absx',0xfd,4), ('absy',0xf9,4), ('indx',0xe1,6), ('indy',0xf1,5) ],
+	'SEC' : [ ('imp',0x38,2) ],
+	'SED' : [ ('imp',0xf8,2) ],
+	'SEI' : [ ('imp',0x78,2) ],
+	'STA' : [ ('zp',0x85,3), ('zpx',0x95,4), ('abs',0x8d,4), ('absx',0x9d,5), ('absy',0x99,5), ('indx',0x81,6), ('indy',0x91,6) ],
+	'STX' : [ ('zp',0x86,3), ('zpy',0x96,4), ('abs',0x8e,4) ],
+	'STY' : [ ('zp',0x84,3), ('zpx',0x94,4), ('abs',0x8c,4) ],
+	'TAX' : [ ('imp',0xaa,2) ],
+	'TAY' : [ ('imp',0xa8,2) ],
+	'TSX' : [ ('imp',0xba,2) ],
+	'TXA' : [ ('imp',0x8a,2) ],
+	'TXS' : [ ('imp',0x9a,2) ],
+	'TYA' : [ ('imp',0x98,2) ],
+}
+
+# instructions that take the extra page crossing cycle
+PAGE_PENALTY = set([ 'ADC', 'AND', 'CMP', 'EOR', 'LDA', 'LDX', 'LDY', 'ORA', 'SBC' ])
+
+# operand size in bytes for each addressing mode
+OPERAND_SIZE = { 'imp':0, 'acc':0, 'imm':1, 'zp':1, 'zpx':1, 'zpy':1, 'rel':1, 'abs':2, 'absx':2, 'absy':2, 'ind':2, 'indx':1, 'indy':1 }
+
+
+#--------------------------------------------------------------------------------------------------------------
+# CPU
+# Executes one instruction per step() and keeps a running total of cycles. Memory is a flat 64K, and
+# writes to the SHEILA page (&FE00-&FEFF) are passed to io_write() so that a harness can record them.
+# Decimal mode is not supported since none of the players need it.
+#--------------------------------------------------------------------------------------------------------------
+
+class Cpu6502:
+
+	IO_PAGE = 0xfe
+
+	def __init__(self):
+
+		self.memory = bytearray(65536)
+		self.a = 0
+		self.x = 0
+		self.y = 0
+		self.sp = 0xff
+		self.pc = 0
+		self.c = 0
+		self.z = 0
+		self.i = 1
+		self.d = 0
+		self.v = 0
+		self.n = 0
+		self.cycles = 0
+		self.io_writes = []		# list of (cycle, address, value)
+
+		# decode table, opcode : (handler, mode, base cycles, page penalty)
+		self.decode = {}
+		for mnemonic, modes in OPCODES.items():
+			handler = getattr(self, '_' + mnemonic.lower())
+			for mode, opcode, cycles in modes:
+				self.decode[opcode] = (handler, mode, cycles, mnemonic in PAGE_PENALTY)
+
+
+	def load(self, address, data):
+		self.memory[address:address+len(data)] = data
+
+
+	def write(self, address, value):
+		if (address >> 8) == self.IO_PAGE:
+			self.io_write(address, value)
+		self.memory[address] = value
+
+
+	def io_write(self, address, value):
+		self.io_writes.append((self.cycles, address, value))
+
+
+	def push(self, value):
+		self.memory[0x100 + self.sp] = value
+		self.sp = (self.sp - 1) & 255
+
+
+	def pull(self):
+		self.sp = (self.sp + 1) & 255
+		return self.memory[0x100 + self.sp]
+
+
+	def get_status(self):
+		return (self.n << 7) | (self.v << 6) | 0x20 | 0x10 | (self.d << 3) | (self.i << 2) | (self.z << 1) | self.c
+
+
+	def set_status(self, p):
+		self.n = (p >> 7) & 1
+		self.v = (p >> 6) & 1
+		self.d = (p >> 3) & 1
+		self.i = (p >> 2) & 1
+		self.z = (p >> 1) & 1
+		self.c = p & 1
+
+
+	# call a subroutine the same way JSR would and run until it returns
+	# returns the number of cycles taken, including the JSR and the RTS
+	def call(self, address, max_cycles = 1000000):
+
+		start = self.cycles
+		sp = self.sp
+		return_address = 0xfffe		# never executed, the RTS back to it ends the call
+		self.push((return_address - 1) >> 8)
+		self.push((return_address - 1) & 255)
+		self.pc = address
+		self.cycles += 6
+		while not (self.pc == return_address and self.sp == sp):
+			self.step()
+			if self.cycles - start > max_cycles:
+				raise RuntimeError("Subroutine at &" + format(address, '04X') + " did not return within " + str(max_cycles) + " cycles")
+		return self.cycles - start
+
+
+	def step(self):
+
+		memory = self.memory
+		pc = self.pc
+		opcode = memory[pc]
+		if opcode not in self.decode:
+			raise RuntimeError("Illegal opcode &" + format(opcode, '02X') + " at &" + format(pc, '04X'))
+		handler, mode, cycles, penalty = self.decode[opcode]
+
+		# resolve the operand address
+		address = None
+		if mode == 'imp' or mode == 'acc':
+			pc += 1
+		elif mode == 'imm':
+			address = pc + 1
+			pc += 2
+		elif mode == 'zp':
+			address = memory[pc + 1]
+			pc += 2
+		elif mode == 'zpx':
+			address = (memory[pc + 1] + self.x) & 255
+			pc += 2
+		elif mode == 'zpy':
+			address = (memory[pc + 1] + self.y) & 255
+			pc += 2
+		elif mode == 'abs':
+			address = memory[pc + 1] | (memory[pc + 2] << 8)
+			pc += 3
+		elif mode == 'absx' or mode == 'absy':
+			base = memory[pc + 1] | (memory[pc + 2] << 8)
+			address = (base + (self.x if mode == 'absx' else self.y)) & 0xffff
+			if penalty and (base & 0xff00) != (address & 0xff00):
+				cycles += 1
+			pc += 3
+		elif mode == 'ind':
+			pointer = memory[pc + 1] | (memory[pc + 2] << 8)
+			# NMOS 6502 does not carry into the high byte when fetching the vector
+			address = memory[pointer] | (memory[(pointer & 0xff00) | ((pointer + 1) & 255)] << 8)
+			pc += 3
+		elif mode == 'indx':
+			pointer = (memory[pc + 1] + self.x) & 255
+			address = memory[pointer] | (memory[(pointer + 1) & 255] << 8)
+			pc += 2
+		elif mode == 'indy':
+			pointer = memory[pc + 1]
+			base = memory[pointer] | (memory[(pointer + 1) & 255] << 8)
+			address = (base + self.y) & 0xffff
+			if penalty and (base & 0xff00) != (address & 0xff00):
+				cycles += 1
+			pc += 2
+		elif mode == 'rel':
+			offset = memory[pc + 1]
+			pc += 2
+			address = (pc + offset - (256 if offset & 0x80 else 0)) & 0xffff
+
+		self.pc = pc & 0xffff
+		self.cycles += cycles
+		handler(address)
+
+
+	#----------------------------------------------------------
+	# Instruction handlers
+	#----------------------------------------------------------
+
+	def _nz(self, value):
+		self.z = 1 if value == 0 else 0
+		self.n = value >> 7
+
+	def _branch(self, condition, address):
+		if condition:
+			self.cycles += 1 if (address & 0xff00) == (self.pc & 0xff00) else 2
+			self.pc = address
+
+	def _compare(self, register, address):
+		result = register - self.memory[address]
+		self.c = 1 if result >= 0 else 0
+		self._nz(result & 255)
+
+	def _shift(self, address, function):
+		if address is None:
+			self.a = function(self.a)
+			self._nz(self.a)
+		else:
+			value = function(self.memory[address])
+			self.write(address, value)
+			self._nz(value)
+
+	def _asl_value(self, value):
+		self.c = value >> 7
+		return (value << 1) & 255
+
+	def _lsr_value(self, value):
+		self.c = value & 1
+		return value >> 1
+
+	def _rol_value(self, value):
+		result = ((value << 1) | self.c) & 255
+		self.c = value >> 7
+		return result
+
+	def _ror_value(self, value):
+		result = (value >> 1) | (self.c << 7)
+		self.c = value & 1
+		return result
+
+	def _add(self, value):
+		if self.d:
+			raise RuntimeError("Decimal mode is not supported")
+		result = self.a + value + self.c
+		self.v = 1 if (~(self.a ^ value) & (self.a ^ result) & 0x80) else 0
+		self.c = result >> 8
+		self.a = result & 255
+		self._nz(self.a)
+
+	def _adc(self, address): self._add(self.memory[address])
+	def _sbc(self, address): self._add(self.memory[address] ^ 255)
+	def _and(self, address): self.a &= self.memory[address]; self._nz(self.a)
+	def _ora(self, address): self.a |= self.memory[address]; self._nz(self.a)
+	def _eor(self, address): self.a ^= self.memory[address]; self._nz(self.a)
+	def _asl(self, address): self._shift(address, self._asl_value)
+	def _lsr(self, address): self._shift(address, self._lsr_value)
+	def _rol(self, address): self._shift(address, self._rol_value)
+	def _ror(self, address): self._shift(address, self._ror_value)
+
+	def _bit(self, address):
+		value = self.memory[address]
+		self.z = 1 if (self.a & value) == 0 else 0
+		self.n = value >> 7
+		self.v = (value >> 6) & 1
+
+	def _bcc(self, address): self._branch(self.c == 0, address)
+	def _bcs(self, address): self._branch(self.c == 1, address)
+	def _bne(self, address): self._branch(self.z == 0, address)
+	def _beq(self, address): self._branch(self.z == 1, address)
+	def _bpl(self, address): self._branch(self.n == 0, address)
+	def _bmi(self, address): self._branch(self.n == 1, address)
+	def _bvc(self, address): self._branch(self.v == 0, address)
+	def _bvs(self, address): self._branch(self.v == 1, address)
+
+	def _brk(self, address):
+		raise RuntimeError("BRK at &" + format((self.pc - 1) & 0xffff, '04X'))
+
+	def _clc(self, address): self.c = 0
+	def _cld(self, address): self.d = 0
+	def _cli(self, address): self.i = 0
+	def _clv(self, address): self.v = 0
+	def _sec(self, address): self.c = 1
+	def _sed(self, address): self.d = 1
+	def _sei(self, address): self.i = 1
+
+	def _cmp(self, address): self._compare(self.a, address)
+	def _cpx(self, address): self._compare(self.x, address)
+	def _cpy(self, address): self._compare(self.y, address)
+
+	def _dec(self, address):
+		value = (self.memory[address] - 1) & 255
+		self.write(address, value)
+		self._nz(value)
+
+	def _inc(self, address):
+		value = (self.memory[address] + 1) & 255
+		self.write(address, value)
+		self._nz(value)
+
+	def _dex(self, address): self.x = (self.x - 1) & 255; self._nz(self.x)
+	def _dey(self, address): self.y = (self.y - 1) & 255; self._nz(self.y)
+	def _inx(self, address): self.x = (self.x + 1) & 255; self._nz(self.x)
+	def _iny(self, address): self.y = (self.y + 1) & 255; self._nz(self.y)
+
+	def _jmp(self, address): self.pc = address
+
+	def _jsr(self, address):
+		return_address = (self.pc - 1) & 0xffff
+		self.push(return_address >> 8)
+		self.push(return_address & 255)
+		self.pc = address
+
+	def _rts(self, address):
+		lo = self.pull()
+		hi = self.pull()
+		self.pc = (((hi << 8) | lo) + 1) & 0xffff
+
+	def _rti(self, address):
+		self.set_status(self.pull())
+		lo = self.pull()
+		hi = self.pull()
+		self.pc = (hi << 8) | lo
+
+	def _lda(self, address): self.a = self.memory[address]; self._nz(self.a)
+	def _ldx(self, address): self.x = self.memory[address]; self._nz(self.x)
+	def _ldy(self, address): self.y = self.memory[address]; self._nz(self.y)
+	def _sta(self, address): self.write(address, self.a)
+	def _stx(self, address): self.write(address, self.x)
+	def _sty(self, address): self.write(address, self.y)
+
+	def _nop(self, address): pass
+	def _pha(self, address): self.push(self.a)
+	def _php(self, address): self.push(self.get_status())
+	def _pla(self, address): self.a = self.pull(); self._nz(self.a)
+	def _plp(self, address): self.set_status(self.pull())
+
+	def _tax(self, address): self.x = self.a; self._nz(self.x)
+	def _tay(self, address): self.y = self.a; self._nz(self.y)
+	def _tsx(self, address): self.x = self.sp; self._nz(self.x)
+	def _txa(self, address): self.a = self.x; self._nz(self.a)
+	def _txs(self, address): self.sp = self.x
+	def _tya(self, address): self.a = self.y; self._nz(self.a)
+
+
+#--------------------------------------------------------------------------------------------------------------
+# Assembler
+# A small two pass assembler for BeebAsm style source, enough to write the reference players in.
+#  .label					- define a label at the current address
+#  NAME = expr				- define a constant
+#  LDA #&10 : STA &FE06		- statements can be separated with ':', comments start with ';' or '\'
+#  EQUB expr, ...			- emit bytes
+# Expressions are sums and differences of numbers (&hex, $hex or decimal) and symbols, optionally prefixed
+# with '<' or '>' to take the low or high byte. Operands that resolve to zero page addresses on the first
+# pass use the zero page addressing modes.
+#--------------------------------------------------------------------------------------------------------------
+
+class Assembler6502:
+
+	def __init__(self, origin, symbols = None):
+
+		self.origin = origin
+		self.symbols = dict(symbols) if symbols is not None else {}
+
+
+	def _evaluate(self, expr, strict):
+
+		expr = expr.strip()
+		part = None
+		if expr[:1] in ('<', '>'):
+			part = expr[0]
+			expr = expr[1:]
+
+		value = 0
+		for sign, term in re.findall(r'([+-]?)\s*([^+\-\s]+)', expr):
+			term = term.strip()
+			if term[0] in '&$':
+				v = int(term[1:], 16)
+			elif term.isdigit():
+				v = int(term)
+			elif term in self.symbols:
+				v = self.symbols[term]
+			elif strict:
+				raise ValueError("Undefined symbol '" + term + "'")
+			else:
+				return None
+			value = value - v if sign == '-' else value + v
+
+		if part == '<':
+			value &= 255
+		elif part == '>':
+			value = (value >> 8) & 255
+		return value
+
+
+	# returns (mode, expression) for an instruction operand
+	def _parse_operand(self, operand):
+
+		operand = operand.strip()
+		upper = operand.upper().replace(' ', '')
+		if operand == '':
+			return 'imp', None
+		if upper == 'A':
+			return 'acc', None
+		if operand[0] == '#':
+			return 'imm', operand[1:]
+		if upper.endswith('),Y') and operand[0] == '(':
+			return 'indy', operand[1:operand.rfind(')')]
+		if upper.endswith(',X)') and operand[0] == '(':
+			return 'indx', operand[1:operand.rfind(',')]
+		if operand[0] == '(' and operand[-1] == ')':
+			return 'ind', operand[1:-1]
+		if upper.endswith(',X'):
+			return 'absx', operand[:operand.rfind(',')]
+		if upper.endswith(',Y'):
+			return 'absy', operand[:operand.rfind(',')]
+		return 'abs', operand
+
+
+	def _statements(self, source):
+
+		statements = []
+		for number, line in enumerate(source.split('\n')):
+			line = re.split(r'[;\\]', line)[0]
+			for statement in line.split(':'):
+				statement = statement.strip()
+				if len(statement):
+					statements.append((number + 1, statement))
+		return statements
+
+
+	# assemble source code
+	# returns (bytearray of code, dict of symbols)
+	def assemble(self, source):
+
+		statements = self._statements(source)
+		modes = {}
+
+		for final in (False, True):
+			address = self.origin
+			output = bytearray()
+			for index, (number, statement) in enumerate(statements):
+				try:
+					# label
+					if statement[0] == '.':
+						label = statement[1:].split()[0]
+						if not final and label in self.symbols:
+							raise ValueError("Label '" + label + "' defined twice")
+						self.symbols[label] = address
+						statement = statement[1 + len(label):].strip()
+						if statement == '':
+							continue
+
+					# constant
+					if '=' in statement:
+						name, expr = statement.split('=', 1)
+						self.symbols[name.strip()] = self._evaluate(expr, True)
+						continue
+
+					parts = statement.split(None, 1)
+					mnemonic = parts[0].upper()
+					operand = parts[1] if len(parts) > 1 else ''
+
+					if mnemonic == 'EQUB':
+						for expr in operand.split(','):
+							output.append(self._evaluate(expr, final) & 255 if final else 0)
+							address += 1
+						continue
+
+					if mnemonic not in OPCODES:
+						raise ValueError("Unknown instruction '" + mnemonic + "'")
+					available = dict([ (m, (o, c)) for m, o, c in OPCODES[mnemonic] ])
+
+					mode, expr = self._parse_operand(operand)
+					if 'rel' in available and mode == 'abs':
+						mode = 'rel'
+					if mode == 'imp' and 'acc' in available:
+						mode = 'acc'
+
+					# zero page modes are chosen on the first pass and kept, so that addresses don't move
+					if not final:
+						if mode in ('abs', 'absx', 'absy'):
+							value = self._evaluate(expr, False)
+							zp_mode = { 'abs':'zp', 'absx':'zpx', 'absy':'zpy' }[mode]
+							if value is not None and value < 256 and zp_mode in available:
+								mode = zp_mode
+						modes[index] = mode
+					mode = modes[index]
+
+					if mode not in available:
+						raise ValueError("Addressing mode '" + mode + "' not available for " + mnemonic)
+
+					opcode = available[mode][0]
+					size = OPERAND_SIZE[mode]
+					output.append(opcode)
+					if final and size:
+						value = self._evaluate(expr, True)
+						if mode == 'rel':
+							value = value - (address + 2)
+							if value < -128 or value > 127:
+								raise ValueError("Branch out of range")
+							value &= 255
+						elif value < 0 or value >= (256 if size == 1 else 65536):
+							raise ValueError("Operand out of range")
+						output.append(value & 255)
+						if size == 2:
+							output.append(value >> 8)
+					else:
+						output.extend(bytearray(size))
+					address += 1 + size
+
+				except ValueError as e:
+					raise ValueError("Line " + str(number) + ": '" + statement + "' - " + str(e))
+
+		return output, self.symbols
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# loopdetect.py
+# Find the repeating tail of a tune from its per frame register data
+# By Simon Morris (https://github.com/simondotm/)
+# See https://github.com/simondotm/vgm-packer
+#
+# Copyright (c) 2019 Simon Morris. All rights reserved.
+#
+# "MIT License":
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+#--------------------------------------------------------------------------------------------------------------
+# Loop detection
+# Many VGM rips have no loop metadata but play the tune through twice (or one and a bit times). Given the
+# tune as a list of frame rows (one row of register values per frame), this finds a period p and the longest
+# tail of the tune where every frame is a copy of the frame p earlier. The tune can then be cut to one
+# iteration, looping back p frames from its new end.
+#
+# Rows are numbered so that equal rows get equal ids, then a rolling hash over the ids of the last WINDOW
+# frames is matched against every earlier window to find candidate periods. Each candidate is verified by
+# comparing ids back from the end of the tune, so the whole search is roughly linear in the tune length.
+#--------------------------------------------------------------------------------------------------------------
+
+class LoopDetector:
+
+	WINDOW = 16				# frames at the end of the tune that must repeat exactly to suggest a period
+	MIN_LOOP = 50			# shortest loop body in frames (1 second at 50Hz)
+	PERIOD_STEP = 1			# loop periods must be a multiple of this many frames
+	MAX_CANDIDATES = 64		# periods to verify, shortest first
+	MIN_REPEAT = 0.5		# fraction of the loop body that must be heard again at the end of the tune
+	TOLERANCE = 0			# number of mismatching frames allowed in the repeated tail
+
+	HASH_BASE = 1000003
+	HASH_MOD = (1 << 61) - 1
+
+	VERBOSE = False
+
+
+	# returns list of row ids, equal rows have equal ids
+	def row_ids(self, rows):
+
+		ids = {}
+		return [ ids.setdefault(bytes(row), len(ids)) for row in rows ]
+
+
+	# returns the length of the tail where frame i matches frame i-period
+	def tail_length(self, ids, period):
+
+		n = len(ids)
+		mismatches = 0
+		length = 0
+		i = n - 1
+		while i - period >= 0:
+			if ids[i] != ids[i - period]:
+				mismatches += 1
+				if mismatches > self.TOLERANCE:
+					break
+			else:
+				length = n - i
+			i -= 1
+		return length
+
+
+	# returns list of candidate periods, shortest first
+	def candidate_periods(self, ids):
+
+		n = len(ids)
+		w = self.WINDOW
+		if n < w * 2:
+			return []
+
+		top = pow(self.HASH_BASE, w - 1, self.HASH_MOD)
+		h = 0
+		hashes = []
+		for i in range(n):
+			if i >= w:
+				h = (h - (ids[i - w] + 1) * top) % self.HASH_MOD
+			h = (h * self.HASH_BASE + ids[i] + 1) % self.HASH_MOD
+			hashes.append(h)
+
+		target = hashes[n - 1]
+		periods = []
+		for j in range(n - 2, w - 2, -1):
+			if hashes[j] == target and n - 1 - j >= self.MIN_LOOP and (n - 1 - j) % self.PERIOD_STEP == 0:
+				periods.append(n - 1 - j)
+				if len(periods) >= self.MAX_CANDIDATES:
+					break
+		return periods
+
+
+	# find the loop in a list of frame rows
+	# returns (end, loop_start) where the tune can be cut to rows[:end] looping back to loop_start,
+	# or None if there is no loop
+	def detect(self, rows):
+
+		ids = self.row_ids(rows)
+		loop = self._detect(ids)
+		if loop is None:
+			# rips often end with silence after the repeat, so try again without it
+			n = len(ids)
+			while n > 0 and ids[n - 1] == ids[-1]:
+				n -= 1
+			if n < len(ids):
+				loop = self._detect(ids[:n])
+		return loop
+
+
+	def _detect(self, ids):
+
+		n = len(ids)
+
+		best_length = 0
+		best_period = 0
+		for period in self.candidate_periods(ids):
+			length = self.tail_length(ids, period)
+			# most of the loop body must be heard twice, and not just be a held note or silence
+			if length < period * self.MIN_REPEAT or len(set(ids[n - period:])) < 2:
+				continue
+			if length > best_length:
+				best_length = length
+				best_period = period
+			if self.VERBOSE: print("   Loop period " + str(period) + " frames, repeated tail " + str(length) + " frames")
+
+		if best_length == 0:
+			return None
+
+		end = n - best_length
+		return end, end - best_period
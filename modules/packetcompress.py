@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# packetcompress.py
+# Sliding window packet dictionary compressor for raw SN76489 packet streams
+# By Simon Morris (https://github.com/simondotm/)
+# See https://github.com/simondotm/vgm-packer
+#
+# Copyright (c) 2019 Simon Morris. All rights reserved.
+#
+# "MIT License":
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import struct
+import sys
+
+from modules.vgmparser import VgmStream
+
+
+#--------------------------------------------------------------------------------------------------------------
+# Input format is the packet stream emitted by VgmStream.as_binary(rawheader = False)
+#  [byte] - number of data writes within the next packet (0 for an empty/wait packet)
+#  [dd] ... - data
+#  ...
+#  [0xff] - eof
+#
+# Output format
+#  %0nnnnnnn [dd]*n	- literal packet of n bytes (n = 0-127).
+#					  If MIN_MATCH <= n <= MAX_MATCH the packet is also copied into the window at the write pointer.
+#					  If the packet would run off the end of the window, the write pointer resets to 0 first.
+#  %1llllooo oooooooo	- dictionary packet of (llll + MIN_MATCH) bytes, copied from window offset ooooooooooo
+#  0xff				- eof (llll=15 is never emitted, so 0xff cannot start a dictionary token)
+#
+# The decoder only needs the window buffer (zero initialised) and a 16-bit write pointer.
+# Dictionary packets are never added to the window, they are by definition already in it.
+#
+# Run from the repository root as a module, eg. python -m modules.packetcompress <input.vgm>
+#--------------------------------------------------------------------------------------------------------------
+
+class PacketCompressor:
+
+	MIN_MATCH = 3			# packets shorter than this are cheaper as literals than as a 2 byte token
+	MAX_MATCH = 3 + 14		# 4-bit length field, but llll=15 is reserved so 0xff stays unique as EOF
+	MAX_LITERAL = 127
+	MAX_WINDOW_SIZE = 2048	# 11-bit window offset
+	WINDOW_SIZE = 2048		# must be power of 2, 2Kb seems to be the sweet spot
+
+	VERBOSE = False
+
+	def __init__(self, window_size = WINDOW_SIZE):
+
+		if window_size > self.MAX_WINDOW_SIZE or window_size < self.MAX_MATCH or (window_size & (window_size-1)) != 0:
+			raise ValueError("Window size must be a power of 2 between " + str(self.MAX_MATCH) + " and " + str(self.MAX_WINDOW_SIZE))
+
+		self.window_size = window_size
+
+
+	# split an as_binary style packet stream into a list of packets
+	# returns list of bytearrays, empty packets included
+	def split_packets(self, data_block):
+
+		packets = []
+		n = 0
+		while True:
+			packet_size = data_block[n]
+			n += 1
+			if packet_size == 255:
+				break
+			packets.append(data_block[n:n+packet_size])
+			n += packet_size
+
+		return packets
+
+
+	#----------------------------------------------------------
+	# Window index
+	# Every substring of the window between MIN_MATCH and MAX_MATCH bytes long is held in a hash table
+	# keyed by its contents, so finding a packet in the window is a single lookup rather than a scan.
+	# Only the substrings that overlap a newly written packet need to be updated.
+	#----------------------------------------------------------
+
+	def _index_range(self, start, end, add):
+
+		window = self.window
+		index = self.index
+		first = max(0, start - self.MAX_MATCH + 1)
+		for s in range(first, end):
+			for l in range(self.MIN_MATCH, self.MAX_MATCH + 1):
+				e = s + l
+				if e > self.window_size:
+					break
+				if e <= start:
+					continue
+				key = bytes(window[s:e])
+				if add:
+					positions = index.get(key)
+					if positions is None:
+						index[key] = { s : None }
+					else:
+						positions[s] = None
+				else:
+					positions = index.get(key)
+					if positions is not None:
+						positions.pop(s, None)
+						if len(positions) == 0:
+							del index[key]
+
+
+	def _add_to_window(self, packet):
+
+		packet_size = len(packet)
+		if self.window_ptr + packet_size > self.window_size:
+			self.window_ptr = 0
+
+		start = self.window_ptr
+		end = start + packet_size
+
+		self._index_range(start, end, False)
+		self.window[start:end] = packet
+		self._index_range(start, end, True)
+
+		if self.VERBOSE: print("New packet added to window index " + str(start))
+		self.window_ptr = end
+
+
+	# compress an as_binary style packet stream (without header)
+	# returns bytearray of compressed data
+	def compress(self, data_block):
+
+		self.window = bytearray(self.window_size)
+		self.window_ptr = 0
+		self.index = {}
+
+		packets = self.split_packets(data_block)
+
+		output_stream = bytearray()
+		dictionary_packets = 0
+
+		for packet in packets:
+
+			packet_size = len(packet)
+			if packet_size > self.MAX_LITERAL:
+				raise ValueError("Packet of " + str(packet_size) + " bytes is too large to compress")
+
+			packet_index = -1
+			if packet_size >= self.MIN_MATCH and packet_size <= self.MAX_MATCH:
+				positions = self.index.get(bytes(packet))
+				if positions is not None:
+					packet_index = next(iter(positions))
+				else:
+					self._add_to_window(packet)
+
+			if packet_index < 0:
+				# not found, emit the packet
+				output_stream.append(packet_size)
+				output_stream.extend(packet)
+			else:
+				if self.VERBOSE: print("Found packet at index " + str(packet_index))
+				token = 0x8000 | ((packet_size - self.MIN_MATCH) << 11) | packet_index
+				output_stream.extend(struct.pack('>H', token))
+				dictionary_packets += 1
+
+		output_stream.append(0xff)
+
+		print("   Packet compression : " + str(len(packets)) + " packets, " + str(dictionary_packets) + " found in " + str(self.window_size) + " byte window")
+		print("   Packet compression : " + str(len(data_block)) + " bytes compressed to " + str(len(output_stream)) + " bytes")
+
+		return output_stream
+
+
+	# reference decoder, mirrors what the 6502 decoder does
+	# returns bytearray of the original as_binary style packet stream
+	def decompress(self, data):
+
+		window = bytearray(self.window_size)
+		window_ptr = 0
+		output_block = bytearray()
+
+		n = 0
+		while True:
+			token = data[n]
+			n += 1
+			if token == 0xff:
+				break
+
+			if token & 0x80:
+				packet_size = ((token >> 3) & 15) + self.MIN_MATCH
+				offset = ((token & 7) << 8) | data[n]
+				n += 1
+				packet = window[offset:offset+packet_size]
+			else:
+				packet_size = token
+				packet = data[n:n+packet_size]
+				n += packet_size
+				if packet_size >= self.MIN_MATCH and packet_size <= self.MAX_MATCH:
+					if window_ptr + packet_size > self.window_size:
+						window_ptr = 0
+					window[window_ptr:window_ptr+packet_size] = packet
+					window_ptr += packet_size
+
+			output_block.append(packet_size)
+			output_block.extend(packet)
+
+		output_block.append(0xff)
+		return output_block
+
+
+#------------------------------------------------------------------------
+# Main()
+#------------------------------------------------------------------------
+
+import argparse
+import os
+
+# Determine if running as a script
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument("input", help="VGM source file (must be single SN76489 PSG format) [input]")
+	parser.add_argument("-o", "--output", metavar="<output>", help="write compressed packets to <output> (default is '[input].pkt.bin')")
+	parser.add_argument("-w", "--window", default=PacketCompressor.WINDOW_SIZE, type=int, metavar="<n>", help="Set the dictionary window size in bytes, must be a power of 2 up to 2048")
+	args = parser.parse_args()
+
+	dst = args.output
+	if dst == None:
+		dst = os.path.splitext(args.input)[0] + ".pkt.bin"
+
+	vgm = VgmStream(args.input)
+	data_block = vgm.as_binary(False)
+
+	compressor = PacketCompressor(args.window)
+	output_stream = compressor.compress(data_block)
+
+	if compressor.decompress(output_stream) != data_block:
+		print("ERROR: Packet compression verify failed")
+		sys.exit(1)
+
+	bin_file = open(dst, 'wb')
+	bin_file.write(output_stream)
+	bin_file.close()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# ulabench.py
+# Benchmark harness for the Acorn Electron ULA stream encodings
+# By Simon Morris (https://github.com/simondotm/)
+# See https://github.com/simondotm/vgm-packer
+#
+# Copyright (c) 2019 Simon Morris. All rights reserved.
+#
+# "MIT License":
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+import concurrent.futures
+import glob
+import json
+import os
+import sys
+import time
+
+from modules.ulacodecs import CODECS
+
+
+#--------------------------------------------------------------------------------------------------------------
+# Runs every ULA encoder over a corpus of .ula.bin files and reports encoded size, encode time and the
+# modelled 6502 decode cost per frame. Files are benchmarked in parallel, one per worker process, and
+# results are always reported in input order so that runs can be diffed against each other.
+# An encoder that can't encode a file (eg. raw mode of a stream that uses the end marker value) is
+# reported as failed for that file, and the others carry on.
+#--------------------------------------------------------------------------------------------------------------
+
+class UlaBenchmark:
+
+	REPEATS = 3			# encode timing is the best of this many runs
+
+	def __init__(self, codecs = None, repeats = REPEATS):
+
+		if codecs is None:
+			codecs = list(CODECS.keys())
+		for name in codecs:
+			if name not in CODECS:
+				raise ValueError("Unknown ULA encoder '" + name + "', must be one of " + ", ".join(CODECS.keys()))
+
+		self.codecs = codecs
+		self.repeats = repeats
+
+
+	# benchmark every encoder on one ULA stream
+	# returns list of result dicts, one per encoder, with the error message of an encoder that failed
+	def run_file(self, filename):
+
+		ula_file = open(filename, 'rb')
+		ula_data = CODECS['raw']().split_marker(ula_file.read())[0]
+		ula_file.close()
+
+		results = []
+		for name in self.codecs:
+			codec = CODECS[name]()
+
+			encode_time = None
+			try:
+				for r in range(self.repeats):
+					t = time.perf_counter()
+					encoded = codec.compress(ula_data)
+					t = time.perf_counter() - t
+					if encode_time is None or t < encode_time:
+						encode_time = t
+			except ValueError as e:
+				print("WARNING: " + name + " failed to encode '" + filename + "' (" + str(e) + ")")
+				results.append({
+					'file': os.path.basename(filename),
+					'codec': name,
+					'size': len(ula_data),
+					'verified': False,
+					'error': str(e),
+				})
+				continue
+
+			decoded, frame_costs, frame_cycles = codec.decode_frames(encoded)
+
+			results.append({
+				'file': os.path.basename(filename),
+				'codec': name,
+				'size': len(ula_data),
+				'encoded_size': len(encoded),
+				'ratio': round(float(len(encoded)) / float(len(ula_data)), 4) if len(ula_data) else 0.0,
+				'encode_time': round(encode_time, 6),
+				'worst_case_bytes_per_frame': max(frame_costs) if len(frame_costs) else 0,
+				'worst_case_cycles_per_frame': max(frame_cycles) if len(frame_cycles) else 0,
+				'average_cycles_per_frame': round(float(sum(frame_cycles)) / len(frame_cycles), 2) if len(frame_cycles) else 0.0,
+				'verified': decoded == ula_data,
+				'error': None,
+			})
+
+		return results
+
+
+	# benchmark a list of files across a pool of worker processes
+	# returns list of result dicts in file order
+	def run(self, filenames, jobs = None):
+
+		results = []
+		if jobs == 1:
+			for filename in filenames:
+				results.extend(self.run_file(filename))
+		else:
+			with concurrent.futures.ProcessPoolExecutor(max_workers = jobs) as pool:
+				for file_results in pool.map(self.run_file, filenames):
+					results.extend(file_results)
+
+		return results
+
+
+	# per-encoder totals across the files each encoder could encode
+	def totals(self, results):
+
+		totals = []
+		for name in self.codecs:
+			rows = [ r for r in results if r['codec'] == name and r['error'] is None ]
+			size = sum([ r['size'] for r in rows ])
+			encoded_size = sum([ r['encoded_size'] for r in rows ])
+			totals.append({
+				'codec': name,
+				'size': size,
+				'encoded_size': encoded_size,
+				'ratio': round(float(encoded_size) / float(size), 4) if size else 0.0,
+				'encode_time': round(sum([ r['encode_time'] for r in rows ]), 6),
+				'worst_case_bytes_per_frame': max([ r['worst_case_bytes_per_frame'] for r in rows ] + [0]),
+				'worst_case_cycles_per_frame': max([ r['worst_case_cycles_per_frame'] for r in rows ] + [0]),
+				'failed': len([ r for r in results if r['codec'] == name and r['error'] is not None ]),
+				'verified': all([ r['verified'] for r in results if r['codec'] == name ]),
+			})
+		return totals
+
+
+	def write_json(self, results, filename):
+
+		output = {
+			'codecs': self.codecs,
+			'cycle_models': { name : CODECS[name].CYCLES for name in self.codecs },
+			'results': results,
+			'totals': self.totals(results),
+		}
+		json_file = open(filename, 'w')
+		json.dump(output, json_file, indent = 1, sort_keys = True)
+		json_file.close()
+
+
+	def markdown(self, results):
+
+		lines = []
+		lines.append("| File | Encoder | Size | Encoded | Ratio | Encode ms | Worst bytes/frame | Worst cycles/frame | Avg cycles/frame | OK |")
+		lines.append("|---|---|---:|---:|---:|---:|---:|---:|---:|---|")
+		for r in results:
+			if r['error'] is not None:
+				lines.append("| " + " | ".join([ r['file'], r['codec'], str(r['size']) ] + [ "-" ] * 6 + [ "failed: " + r['error'] ]) + " |")
+				continue
+			lines.append("| " + " | ".join([
+				r['file'], r['codec'], str(r['size']), str(r['encoded_size']), "%.3f" % r['ratio'],
+				"%.1f" % (r['encode_time'] * 1000.0), str(r['worst_case_bytes_per_frame']),
+				str(r['worst_case_cycles_per_frame']), "%.1f" % r['average_cycles_per_frame'],
+				"yes" if r['verified'] else "NO" ]) + " |")
+
+		lines.append("")
+		lines.append("| Encoder | Size | Encoded | Ratio | Encode ms | Worst bytes/frame | Worst cycles/frame | Failed | OK |")
+		lines.append("|---|---:|---:|---:|---:|---:|---:|---:|---|")
+		for t in self.totals(results):
+			lines.append("| " + " | ".join([
+				t['codec'], str(t['size']), str(t['encoded_size']), "%.3f" % t['ratio'],
+				"%.1f" % (t['encode_time'] * 1000.0), str(t['worst_case_bytes_per_frame']),
+				str(t['worst_case_cycles_per_frame']), str(t['failed']), "yes" if t['verified'] else "NO" ]) + " |")
+
+		return "\n".join(lines) + "\n"
+
+
+#------------------------------------------------------------------------
+# Main()
+#------------------------------------------------------------------------
+
+import argparse
+
+# Determine if running as a script
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument("input", nargs="*", help="ULA data files to benchmark (default is 'examples/*.ula.bin')")
+	parser.add_argument("-c", "--codecs", default=",".join(CODECS.keys()), metavar="<names>", help="Comma separated list of encoders to run, default: " + ",".join(CODECS.keys()))
+	parser.add_argument("-j", "--jobs", type=int, default=None, metavar="<n>", help="Number of worker processes, default is one per CPU")
+	parser.add_argument("-n", "--repeats", type=int, default=UlaBenchmark.REPEATS, metavar="<n>", help="Time the best of <n> encodes")
+	parser.add_argument("--json", metavar="<file>", help="Write results to a JSON file")
+	parser.add_argument("--md", metavar="<file>", help="Write results to a Markdown file")
+	args = parser.parse_args()
+
+	filenames = args.input
+	if len(filenames) == 0:
+		filenames = sorted(glob.glob(os.path.join("examples", "*.ula.bin")))
+	if len(filenames) == 0:
+		print("ERROR: No ULA data files to benchmark")
+		sys.exit(1)
+
+	benchmark = UlaBenchmark(args.codecs.split(","), args.repeats)
+	results = benchmark.run(filenames, args.jobs)
+
+	table = benchmark.markdown(results)
+	print(table)
+
+	if args.json != None:
+		benchmark.write_json(results, args.json)
+	if args.md != None:
+		md_file = open(args.md, 'w')
+		md_file.write(table)
+		md_file.close()
+
+	if not all([ r['verified'] for r in results ]):
+		print("ERROR: Some encoders failed to encode or round trip")
+		sys.exit(1)
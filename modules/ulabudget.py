@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# ulabudget.py
+# Pick the ULA stream encoding that fits a RAM and per frame cycle budget
+# By Simon Morris (https://github.com/simondotm/)
+# See https://github.com/simondotm/vgm-packer
+#
+# Copyright (c) 2019 Simon Morris. All rights reserved.
+#
+# "MIT License":
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+import hashlib
+import json
+import os
+
+from modules.ulacodecs import CODECS
+from modules.ulaplayers import PLAYER_WORKSPACE, UlaPlayerSimulator
+
+
+#--------------------------------------------------------------------------------------------------------------
+# Budget selection
+# Every candidate encoding (an encoder plus parameter overrides for its class settings) is trial encoded and
+# costed as
+#  ram		- encoded data + reference player code + player workspace (the LZ history page)
+#  cycles	- worst case 6502 cycles in any one frame, measured by running the reference player on the
+#			  simulated 6502, or from the encoder's static cycle model if EXACT_CYCLES is False
+# The smallest candidate that fits both budgets wins. If none fit, the nearest miss is the candidate
+# that overshoots its worst budget by the smallest proportion.
+# With EXACT_CYCLES, a candidate too big to simulate only has modelled cycles, which are not comparable
+# with the measured ones, so it can't meet a cycle budget. A candidate that can't encode the tune at all
+# is left out.
+# Trial results are cached by a hash of the ULA data, and the cache can be saved to a JSON file so
+# that repeat conversions of a tune don't have to encode it again.
+#--------------------------------------------------------------------------------------------------------------
+
+class UlaBudgetSelector:
+
+	# (encoder name, parameter overrides) for each candidate
+	# the palette modes with wider tokens are bigger but quicker to play, and the LZ player always keeps a full
+	# page of history, but a smaller window or longer minimum match changes which matches are taken, and with
+	# them the worst frame, which can be the one that fits a cycle budget
+	CANDIDATES = [
+		('raw', {}),
+		('rle', {}),
+		('rle', { 'MODE' : 'wide' }),
+		('rle', { 'MODE' : 'raw' }),
+		('lz', { 'WINDOW_SIZE' : 128 }),
+		('lz', { 'WINDOW_SIZE' : 256 }),
+		('lz', { 'MIN_MATCH' : 4 }),
+		('pat', { 'MIN_PATTERN' : 4 }),
+		('pat', { 'MIN_PATTERN' : 6 }),
+		('pat', { 'MIN_PATTERN' : 8 }),
+		('pat', { 'MIN_PATTERN' : 12 }),
+		('pat', { 'MIN_PATTERN' : 16 }),
+	]
+
+	EXACT_CYCLES = True
+	CACHE_VERSION = 4	# bump when the costing changes, so saved trial results are not reused
+
+	VERBOSE = False
+
+
+	def __init__(self, cache_filename = None):
+
+		self.simulator = UlaPlayerSimulator()
+		self.cache = {}
+		self.cache_filename = cache_filename
+		if cache_filename is not None and os.path.isfile(cache_filename):
+			cache_file = open(cache_filename, 'r')
+			self.cache = json.load(cache_file)
+			cache_file.close()
+
+
+	def save_cache(self):
+
+		if self.cache_filename is not None:
+			cache_file = open(self.cache_filename, 'w')
+			json.dump(self.cache, cache_file, indent = 1, sort_keys = True)
+			cache_file.close()
+
+
+	# returns a short description of a candidate, eg. "lz WINDOW_SIZE=128"
+	def describe(self, name, params):
+		return " ".join([ name ] + [ k + "=" + str(params[k]) for k in sorted(params.keys()) ])
+
+
+	# returns an encoder instance with the candidate parameters applied
+	def get_codec(self, name, params):
+
+		codec = CODECS[name]()
+		for k, v in params.items():
+			setattr(codec, k, v)
+		return codec
+
+
+	def encode(self, name, params, ula_data):
+		return self.get_codec(name, params).compress(ula_data)
+
+
+	# trial encode one candidate, or fetch it from the cache
+	# returns dict of costs, or None if the candidate can't encode the ULA data
+	def trial(self, name, params, ula_data, digest = None):
+
+		if digest is None:
+			digest = hashlib.sha1(bytes(ula_data)).hexdigest()
+		key = digest + ":" + self.describe(name, params) + (":exact" if self.EXACT_CYCLES else ":model") + ":v" + str(self.CACHE_VERSION)
+		if key in self.cache:
+			return self.cache[key]
+
+		codec = self.get_codec(name, params)
+		try:
+			data = codec.compress(ula_data)
+		except ValueError as e:
+			print("   ULA budget : skipping " + self.describe(name, params) + " (" + str(e) + ")")
+			return None
+		decoded, frame_costs, frame_cycles = codec.decode_frames(data)
+		if decoded != ula_data:
+			raise RuntimeError("Candidate " + self.describe(name, params) + " failed to round trip")
+
+		player_size = len(self.simulator.assemble(name)[0])
+		workspace = PLAYER_WORKSPACE[name]
+
+		exact = False
+		if self.EXACT_CYCLES:
+			try:
+				played, frame_cycles, init_cycles = self.simulator.run(name, data)
+				exact = True
+			except ValueError:
+				# too big to simulate, so only the static model is available
+				pass
+
+		result = {
+			'codec': name,
+			'params': params,
+			'description': self.describe(name, params),
+			'encoded_size': len(data),
+			'ram': len(data) + player_size + workspace,
+			'cycles': max(frame_cycles) if len(frame_cycles) else 0,
+			'exact_cycles': exact,
+		}
+		self.cache[key] = result
+		return result
+
+
+	# choose the smallest candidate within the budgets, a budget of None is unlimited
+	# returns (result, fits, all results)
+	def select(self, ula_data, ram_budget = None, cycle_budget = None):
+
+		digest = hashlib.sha1(bytes(ula_data)).hexdigest()
+		results = [ self.trial(name, params, ula_data, digest) for name, params in self.CANDIDATES ]
+		results = [ r for r in results if r is not None ]
+
+		def overshoot(result):
+			over = 0.0
+			if ram_budget is not None:
+				over = max(over, float(result['ram']) / ram_budget)
+			if cycle_budget is not None:
+				if self.EXACT_CYCLES and not result['exact_cycles']:
+					return float('inf')
+				over = max(over, float(result['cycles']) / cycle_budget)
+			return over
+
+		fitting = [ r for r in results if overshoot(r) <= 1.0 ]
+		if len(fitting):
+			best = min(fitting, key = lambda r: (r['ram'], r['cycles']))
+			return best, True, results
+
+		best = min(results, key = lambda r: (overshoot(r), r['ram']))
+		return best, False, results
+
+
+	# print the selection report and return the encoded data for the chosen candidate
+	def report(self, ula_data, ram_budget = None, cycle_budget = None):
+
+		best, fits, results = self.select(ula_data, ram_budget, cycle_budget)
+		self.save_cache()
+
+		if self.VERBOSE:
+			for r in results:
+				print("   ULA budget : " + r['description'].ljust(20) + " " + str(r['ram']).rjust(6) + " bytes RAM, " + str(r['cycles']).rjust(4) + " cycles per frame" + ("" if r['exact_cycles'] or not self.EXACT_CYCLES else " (modelled)"))
+
+		budget = ("RAM " + (str(ram_budget) + " bytes" if ram_budget is not None else "unlimited")) + ", " + (str(cycle_budget) + " cycles per frame" if cycle_budget is not None else "unlimited cycles")
+		if fits:
+			print("   ULA budget : " + budget + " - chose " + best['description'] + " (" + str(best['ram']) + " bytes RAM, " + str(best['cycles']) + " cycles per frame)")
+		else:
+			print("   ULA budget : " + budget + " - WARNING no encoding fits, nearest miss is " + best['description'] + " (" + str(best['ram']) + " bytes RAM, " + str(best['cycles']) + " cycles per frame)")
+
+		return best, fits, self.encode(best['codec'], best['params'], ula_data)
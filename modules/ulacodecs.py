@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# ulacodecs.py
+# Registry of the available Acorn Electron ULA stream encodings
+# By Simon Morris (https://github.com/simondotm/)
+# See https://github.com/simondotm/vgm-packer
+#
+# Copyright (c) 2019 Simon Morris. All rights reserved.
+#
+# "MIT License":
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+from modules.ulacompress import UlaCompressor
+from modules.ulapalette import UlaPaletteCompressor
+from modules.ulapatterns import UlaPatternCompressor
+
+
+#--------------------------------------------------------------------------------------------------------------
+# Every ULA encoder has the same interface
+#  NAME, EXTENSION			- short name and output file extension
+#  CYCLES					- static 6502 cycle model for its reference player
+#  compress(ula_data)		- returns bytearray of encoded data
+#  decompress(data)		- returns bytearray of ULA data
+#  decode_frames(data)		- returns (ula_data, frame_costs, frame_cycles), see the encoders for details
+#  report(ula_data, data)	- prints and returns a dict of statistics
+#--------------------------------------------------------------------------------------------------------------
+
+# The uncompressed .ula.bin stream, one byte per frame, so that the other encoders have a baseline
+class UlaRawCodec:
+
+	NAME = "raw"
+	EXTENSION = ".ula.bin"
+
+	END_MARKER = 0x01		# vgm2electron ends .ula.bin files with [0x01][lo][hi], the frame to loop back to
+	NO_LOOP = 0xffff		# loop frame of tunes that don't loop
+
+	# static 6502 cycle model for the reference player, calibrated against modules/ulaplayers.py
+	CYCLES = {
+		'frame': 68,		# fetch the next byte, store it to &FE06 and advance the 16-bit pointer
+	}
+
+	# split the end of stream marker off the contents of a .ula.bin file
+	# files without one (from older versions of vgm2electron) are all ULA data
+	# returns (ula_data, loop_frame) where loop_frame is None if the tune doesn't loop
+	def split_marker(self, data):
+
+		if len(data) < 3 or data[-3] != self.END_MARKER:
+			return bytearray(data), None
+		loop_frame = data[-2] | (data[-1] << 8)
+		return bytearray(data[:-3]), loop_frame if loop_frame != self.NO_LOOP else None
+
+	def compress(self, ula_data):
+		return bytearray(ula_data)
+
+	def decode_frames(self, data):
+		return bytearray(data), [1] * len(data), [self.CYCLES['frame']] * len(data)
+
+	def decompress(self, data):
+		return self.decode_frames(data)[0]
+
+	def report(self, ula_data, data):
+
+		print("   ULA raw : " + str(len(data)) + " bytes")
+
+		return {
+			'size': len(ula_data),
+			'compressed_size': len(data),
+			'ratio': 1.0 if len(ula_data) else 0.0,
+			'worst_case_bytes_per_frame': 1 if len(data) else 0,
+			'worst_case_cycles_per_frame': self.CYCLES['frame'] if len(data) else 0,
+		}
+
+
+# all available encoders, by name
+CODECS = {
+	UlaRawCodec.NAME : UlaRawCodec,
+	UlaCompressor.NAME : UlaCompressor,
+	UlaPaletteCompressor.NAME : UlaPaletteCompressor,
+	UlaPatternCompressor.NAME : UlaPatternCompressor,
+}
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# ulacompress.py
+# LZ compressor for Acorn Electron ULA byte streams
+# By Simon Morris (https://github.com/simondotm/)
+# See https://github.com/simondotm/vgm-packer
+#
+# Copyright (c) 2019 Simon Morris. All rights reserved.
+#
+# "MIT License":
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import sys
+
+
+#--------------------------------------------------------------------------------------------------------------
+# .ula.lz format
+# An LZ4-like byte oriented format, simplified so that a 6502 player can decode exactly one ULA byte per frame
+# with a 256 byte page aligned history buffer and a bounded amount of work per frame.
+#
+#  [token]			- %LLLLMMMM
+#					  LLLL = literal count 0-14, or 15 meaning 15 + the next byte (max 270)
+#					  MMMM = match length 0 (no match) or 3-14, or 15 meaning 15 + the next byte (max 270)
+#  [ext]			- literal count extension byte, only if LLLL = 15
+#  [dd] ...			- literal ULA bytes
+#  [offset]			- only if MMMM != 0, match distance back into the history buffer (1-255)
+#  [ext]			- match length extension byte, only if MMMM = 15
+#  ...
+#  [0x00]			- eof (a token with no literals and no match)
+#
+# Matches may overlap the bytes they produce (offset < length), so long runs of one ULA value
+# encode as a single literal followed by an offset 1 match.
+#--------------------------------------------------------------------------------------------------------------
+
+class UlaCompressor:
+
+	MIN_MATCH = 3			# a match costs at least one offset byte, so anything shorter is better as literals
+	MAX_LENGTH = 15 + 255	# literal or match length limit with a single extension byte
+	WINDOW_SIZE = 256		# history buffer is a single 6502 page
+	MAX_CHAIN = 64			# max hash chain entries to test for each match
+
+	NAME = "lz"
+	EXTENSION = ".ula.lz"
+
+	# static 6502 cycle model for the reference player, per frame and per token element
+	# worst case figures (including the JSR to the player and page crossings), calibrated against
+	# modules/ulaplayers.py on the simulated 6502 so that the model is a close upper bound
+	CYCLES = {
+		'frame': 75,		# sequence state tests, history write and the store to &FE06
+		'token': 77,		# fetch and split the token nibbles
+		'extension': 42,	# add a length extension byte
+		'literal': 18,		# fetch a literal byte
+		'offset': 56,		# fetch the match offset and set up the history index
+		'match': 14,		# fetch a byte from the history page
+	}
+
+	VERBOSE = False
+
+
+	#----------------------------------------------------------
+	# Match finder
+	# Classic hash chain - head maps each MIN_MATCH byte prefix to its most recent position and
+	# prev links every position to the previous occurrence of the same prefix.
+	#----------------------------------------------------------
+
+	def _find_match(self, data, i, head, prev):
+
+		best_length = 0
+		best_offset = 0
+
+		end = min(len(data), i + self.MAX_LENGTH)
+		if end - i < self.MIN_MATCH:
+			return best_length, best_offset
+
+		p = head.get(bytes(data[i:i+self.MIN_MATCH]), -1)
+		chain = self.MAX_CHAIN
+		while p >= 0 and chain > 0:
+			offset = i - p
+			if offset >= self.WINDOW_SIZE:
+				break
+			l = 0
+			while i + l < end and data[p + l] == data[i + l]:
+				l += 1
+			if l > best_length:
+				best_length = l
+				best_offset = offset
+				if i + l == end:
+					break
+			p = prev[p]
+			chain -= 1
+
+		if best_length < self.MIN_MATCH:
+			best_length = 0
+		return best_length, best_offset
+
+
+	def _insert(self, data, i, head, prev):
+
+		if i + self.MIN_MATCH <= len(data):
+			key = bytes(data[i:i+self.MIN_MATCH])
+			prev[i] = head.get(key, -1)
+			head[key] = i
+
+
+	def _emit_sequence(self, output, literals, match_length, match_offset):
+
+		literal_count = len(literals)
+		token_l = min(literal_count, 15)
+		token_m = min(match_length, 15)
+		output.append((token_l << 4) | token_m)
+		if token_l == 15:
+			output.append(literal_count - 15)
+		output.extend(literals)
+		if match_length:
+			output.append(match_offset)
+			if token_m == 15:
+				output.append(match_length - 15)
+
+
+	# compress a ULA byte stream
+	# returns bytearray of compressed data
+	def compress(self, ula_data):
+
+		head = {}
+		prev = [-1] * len(ula_data)
+
+		output = bytearray()
+		literals = bytearray()
+
+		i = 0
+		while i < len(ula_data):
+			match_length, match_offset = self._find_match(ula_data, i, head, prev)
+
+			if match_length == 0:
+				literals.append(ula_data[i])
+				self._insert(ula_data, i, head, prev)
+				i += 1
+				# literal runs are split where a single extension byte can no longer describe them
+				if len(literals) == self.MAX_LENGTH:
+					self._emit_sequence(output, literals, 0, 0)
+					literals = bytearray()
+				continue
+
+			if self.VERBOSE: print("Match at " + str(i) + " length " + str(match_length) + " offset " + str(match_offset))
+			self._emit_sequence(output, literals, match_length, match_offset)
+			literals = bytearray()
+			for j in range(i, i + match_length):
+				self._insert(ula_data, j, head, prev)
+			i += match_length
+
+		if len(literals):
+			self._emit_sequence(output, literals, 0, 0)
+
+		# eof
+		output.append(0x00)
+		return output
+
+
+	#----------------------------------------------------------
+	# Reference streaming decoder
+	# Mirrors the 6502 player, producing one ULA byte per frame and counting the compressed
+	# bytes it had to read to do so.
+	# returns (ula_data, frame_costs, frame_cycles) where frame_costs[i] is the number of bytes read
+	# in frame i and frame_cycles[i] the modelled 6502 cycles spent decoding it
+	#----------------------------------------------------------
+
+	def decode_frames(self, data):
+
+		cycle_model = self.CYCLES
+		history = bytearray(self.WINDOW_SIZE)
+		history_ptr = 0
+
+		ula_data = bytearray()
+		frame_costs = []
+		frame_cycles = []
+
+		n = 0
+		literal_count = 0
+		match_length = 0
+		match_offset = 0
+		pending_match = 0	# match length of the current sequence, to start once its literals are done
+
+		while True:
+			reads = 0
+			cycles = cycle_model['frame']
+
+			# start a new sequence if the last one is used up
+			if literal_count == 0 and match_length == 0 and pending_match == 0:
+				token = data[n]
+				n += 1
+				reads += 1
+				cycles += cycle_model['token']
+				if token == 0x00:
+					break
+				literal_count = token >> 4
+				pending_match = token & 15
+				if literal_count == 15:
+					literal_count += data[n]
+					n += 1
+					reads += 1
+					cycles += cycle_model['extension']
+
+			if literal_count == 0 and pending_match:
+				match_length = pending_match
+				pending_match = 0
+				match_offset = data[n]
+				n += 1
+				reads += 1
+				cycles += cycle_model['offset']
+				if match_length == 15:
+					match_length += data[n]
+					n += 1
+					reads += 1
+					cycles += cycle_model['extension']
+
+			if literal_count:
+				b = data[n]
+				n += 1
+				reads += 1
+				cycles += cycle_model['literal']
+				literal_count -= 1
+			else:
+				b = history[(history_ptr - match_offset) & (self.WINDOW_SIZE-1)]
+				cycles += cycle_model['match']
+				match_length -= 1
+
+			history[history_ptr] = b
+			history_ptr = (history_ptr + 1) & (self.WINDOW_SIZE-1)
+			ula_data.append(b)
+			frame_costs.append(reads)
+			frame_cycles.append(cycles)
+
+		return ula_data, frame_costs, frame_cycles
+
+
+	def decompress(self, data):
+		return self.decode_frames(data)[0]
+
+
+	# print the compression report for a stream and return it as a dict
+	def report(self, ula_data, compressed):
+
+		ula, frame_costs, frame_cycles = self.decode_frames(compressed)
+		worst_case = max(frame_costs) if len(frame_costs) else 0
+		worst_case_cycles = max(frame_cycles) if len(frame_cycles) else 0
+		ratio = float(len(compressed)) / float(len(ula_data)) if len(ula_data) else 0.0
+
+		print("   ULA compression : " + str(len(ula_data)) + " bytes compressed to " + str(len(compressed)) + " bytes (ratio " + "%.3f" % ratio + ")")
+		print("   ULA compression : worst case " + str(worst_case) + " bytes decoded per frame")
+		print("   ULA compression : worst case " + str(worst_case_cycles) + " cycles per frame (modelled)")
+
+		return {
+			'size': len(ula_data),
+			'compressed_size': len(compressed),
+			'ratio': ratio,
+			'worst_case_bytes_per_frame': worst_case,
+			'worst_case_cycles_per_frame': worst_case_cycles,
+		}
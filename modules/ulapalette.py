@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# ulapalette.py
+# Palette + run length encoder for Acorn Electron ULA byte streams
+# By Simon Morris (https://github.com/simondotm/)
+# See https://github.com/simondotm/vgm-packer
+#
+# Copyright (c) 2019 Simon Morris. All rights reserved.
+#
+# "MIT License":
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import sys
+
+
+#--------------------------------------------------------------------------------------------------------------
+# .ula.rle format
+# A tune only uses a few dozen distinct ULA values and holds each one for many frames, so the stream
+# is stored as runs of palette indexes. No general purpose decompressor is needed - the player just
+# counts down the current run and looks up the next ULA value in the palette.
+#
+#  [n]				- palette size (0-255)
+#  [dd] * n			- palette of ULA values
+#
+# If n <= 15, runs are packed with the index in the high nibble (nibble mode)
+#  %iiiirrrr		- run of rrrr (1-15) frames of palette[iiii]
+#  %iiii0000 [rr]	- run of rr (1-255, 0=256) frames of palette[iiii]
+#  0xf0				- eof
+#
+# If n <= 127, single frames take one byte (byte mode)
+#  %0iiiiiii		- one frame of palette[iiiiiii]
+#  %1iiiiiii [rr]	- run of rr (2-255, 0=256) frames of palette[iiiiiii]
+#  0xff				- eof
+#
+# If n <= 254, indexes take a whole byte (wide mode)
+#  [ii]				- one frame of palette[ii] (ii = 0-253)
+#  0xfe [rr]		- repeat the previous ULA value for rr (1-255) more frames
+#  0xff				- eof
+#
+# Runs longer than 256 frames are split into several runs of the same index.
+#
+# A tune that uses more than 254 distinct values, or that the palette encoding would make bigger, is
+# stored in raw mode instead, which is never more than 2 bytes bigger than the ULA data
+#  [0xff]			- raw mode, in place of the palette size
+#  [dd]				- one frame of ULA value dd
+#  0x01				- eof (0x01 is never output as a ULA value)
+#--------------------------------------------------------------------------------------------------------------
+
+class UlaPaletteCompressor:
+
+	MAX_NIBBLE_PALETTE = 15		# index 15 is reserved for eof in nibble mode
+	MAX_BYTE_PALETTE = 127		# index 127 is reserved for eof in byte mode
+	MAX_PALETTE = 254			# index 254 is reserved for repeat and 255 for eof in wide mode
+	MAX_RUN = 256
+	RAW_MODE = 0xff				# palette size byte that selects raw mode
+	RAW_EOF = 0x01
+	MODE = None					# force 'nibble', 'byte', 'wide' or 'raw' mode, eg. to trade size for player cycles
+
+	NAME = "rle"
+	EXTENSION = ".ula.rle"
+
+	# static 6502 cycle model for the reference player, per frame and per token element
+	# worst case figures (including the JSR to the player and page crossings), calibrated against
+	# modules/ulaplayers.py on the simulated 6502 so that the model is a close upper bound
+	CYCLES = {
+		'frame': 34,		# count down the run and store the current value to &FE06
+		'token': 73,		# fetch a token and split out the palette index
+		'run': 26,			# fetch a run length byte
+		'palette': 8,		# look up the palette entry
+		'raw': 44,			# fetch a raw mode byte
+	}
+
+	VERBOSE = False
+
+
+	# returns the sorted list of distinct ULA values used by the stream
+	def build_palette(self, ula_data):
+		return sorted(set(ula_data))
+
+
+	# returns the token packing used for a palette of the given size
+	def get_mode(self, palette_size):
+
+		if palette_size <= self.MAX_NIBBLE_PALETTE:
+			return 'nibble'
+		if palette_size <= self.MAX_BYTE_PALETTE:
+			return 'byte'
+		if palette_size <= self.MAX_PALETTE:
+			return 'wide'
+		return 'raw'
+
+
+	# returns the palette padded with unused values to the smallest size that selects the given mode
+	def pad_palette(self, palette, mode):
+
+		sizes = { 'nibble': (0, self.MAX_NIBBLE_PALETTE), 'byte': (self.MAX_NIBBLE_PALETTE + 1, self.MAX_BYTE_PALETTE), 'wide': (self.MAX_BYTE_PALETTE + 1, self.MAX_PALETTE) }
+		if mode not in sizes:
+			raise ValueError("Unknown palette mode '" + str(mode) + "'")
+		smallest, largest = sizes[mode]
+		if len(palette) > largest:
+			raise ValueError("ULA stream uses " + str(len(palette)) + " distinct values, too many for " + mode + " mode")
+		unused = [ v for v in range(256) if v not in palette and v != self.RAW_EOF ]
+		return sorted(palette + unused[:max(0, smallest - len(palette))])
+
+
+	# compress a ULA byte stream, in raw mode if that is smaller, or in MODE if it is set
+	# returns bytearray of encoded data
+	def compress(self, ula_data):
+
+		palette = self.build_palette(ula_data)
+		if self.MODE is not None and self.MODE != 'raw':
+			return self.compress_palette(ula_data, self.pad_palette(palette, self.MODE))
+		if self.MODE is None and len(palette) <= self.MAX_PALETTE:
+			output = self.compress_palette(ula_data, palette)
+			if len(output) <= len(ula_data) + 2:
+				return output
+
+		if self.RAW_EOF in palette:
+			raise ValueError("ULA stream can't be stored in raw mode, it uses the end marker value " + str(self.RAW_EOF))
+		if self.VERBOSE: print("Raw mode, " + str(len(palette)) + " distinct values")
+
+		output = bytearray()
+		output.append(self.RAW_MODE)
+		output.extend(ula_data)
+		output.append(self.RAW_EOF)
+		return output
+
+
+	# returns bytearray of the stream encoded with a palette
+	def compress_palette(self, ula_data, palette):
+
+		lookup = { v : i for i, v in enumerate(palette) }
+		mode = self.get_mode(len(palette))
+
+		output = bytearray()
+		output.append(len(palette))
+		output.extend(palette)
+
+		i = 0
+		while i < len(ula_data):
+			v = ula_data[i]
+			run = 1
+			while i + run < len(ula_data) and ula_data[i + run] == v and run < self.MAX_RUN:
+				run += 1
+
+			index = lookup[v]
+			if mode == 'nibble':
+				if run < 16:
+					output.append((index << 4) | run)
+				else:
+					output.append(index << 4)
+					output.append(run & 255)
+			elif mode == 'byte':
+				if run == 1:
+					output.append(index)
+				else:
+					output.append(0x80 | index)
+					output.append(run & 255)
+			else:
+				output.append(index)
+				if run > 1:
+					output.append(0xfe)
+					output.append(run - 1)
+
+			i += run
+
+		# eof
+		if mode == 'nibble':
+			output.append(0xf0)
+		else:
+			output.append(0xff)
+
+		if self.VERBOSE: print("Palette " + str(palette))
+		return output
+
+
+	#----------------------------------------------------------
+	# Reference streaming decoder
+	# Mirrors the 6502 player, producing one ULA byte per frame and counting the encoded
+	# bytes it had to read to do so.
+	# returns (ula_data, frame_costs, frame_cycles) where frame_costs[i] is the number of bytes read
+	# in frame i and frame_cycles[i] the modelled 6502 cycles spent decoding it
+	#----------------------------------------------------------
+
+	def decode_frames(self, data):
+
+		cycle_model = self.CYCLES
+
+		palette_size = data[0]
+		mode = self.get_mode(palette_size)
+
+		ula_data = bytearray()
+		frame_costs = []
+		frame_cycles = []
+
+		if mode == 'raw':
+			n = 1
+			while data[n] != self.RAW_EOF:
+				ula_data.append(data[n])
+				n += 1
+			frame_costs = [1] * len(ula_data)
+			frame_cycles = [cycle_model['frame'] + cycle_model['raw']] * len(ula_data)
+			return ula_data, frame_costs, frame_cycles
+
+		palette = data[1:1+palette_size]
+
+		n = 1 + palette_size
+		while True:
+			reads = 1
+			token = data[n]
+			n += 1
+			if mode == 'nibble':
+				if token == 0xf0:
+					break
+				index = token >> 4
+				run = token & 15
+				if run == 0:
+					run = data[n]
+					n += 1
+					reads += 1
+			elif mode == 'byte':
+				if token == 0xff:
+					break
+				index = token & 0x7f
+				run = 1
+				if token & 0x80:
+					run = data[n]
+					n += 1
+					reads += 1
+			else:
+				if token == 0xff:
+					break
+				index = token
+				run = 1
+				if token == 0xfe:
+					run = data[n]
+					n += 1
+					reads += 1
+
+			if run == 0:
+				run = 256
+
+			if index == 0xfe:
+				v = ula_data[-1]
+			else:
+				v = palette[index]
+
+			ula_data.extend(bytes([v]) * run)
+			frame_costs.append(reads)
+			frame_costs.extend([0] * (run - 1))
+			frame_cycles.append(cycle_model['frame'] + cycle_model['token'] + (reads - 1) * cycle_model['run'] + cycle_model['palette'])
+			frame_cycles.extend([cycle_model['frame']] * (run - 1))
+
+		return ula_data, frame_costs, frame_cycles
+
+
+	def decompress(self, data):
+		return self.decode_frames(data)[0]
+
+
+	# print the encoding report for a stream and return it as a dict
+	def report(self, ula_data, encoded):
+
+		ula, frame_costs, frame_cycles = self.decode_frames(encoded)
+		worst_case = max(frame_costs) if len(frame_costs) else 0
+		worst_case_cycles = max(frame_cycles) if len(frame_cycles) else 0
+		ratio = float(len(encoded)) / float(len(ula_data)) if len(ula_data) else 0.0
+
+		if self.get_mode(encoded[0]) == 'raw':
+			print("   ULA palette RLE : raw mode, the palette encoding would be no smaller than the ULA data")
+		else:
+			print("   ULA palette RLE : " + str(encoded[0]) + " palette entries, " + self.get_mode(encoded[0]) + " mode")
+		print("   ULA palette RLE : " + str(len(ula_data)) + " bytes encoded to " + str(len(encoded)) + " bytes (ratio " + "%.3f" % ratio + ")")
+		print("   ULA palette RLE : worst case " + str(worst_case) + " bytes decoded per frame")
+		print("   ULA palette RLE : worst case " + str(worst_case_cycles) + " cycles per frame (modelled)")
+
+		return {
+			'size': len(ula_data),
+			'compressed_size': len(encoded),
+			'ratio': ratio,
+			'worst_case_bytes_per_frame': worst_case,
+			'worst_case_cycles_per_frame': worst_case_cycles,
+		}
@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+# ulapatterns.py
+# Pattern + order list extraction for Acorn Electron ULA byte streams
+# By Simon Morris (https://github.com/simondotm/)
+# See https://github.com/simondotm/vgm-packer
+#
+# Copyright (c) 2019 Simon Morris. All rights reserved.
+#
+# "MIT License":
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import heapq
+import struct
+import sys
+
+
+#--------------------------------------------------------------------------------------------------------------
+# .ula.pat format
+# Chiptunes repeat whole bars, so the stream is cut into patterns and stored as a pattern table plus
+# an order list, the same way a tracker stores a song. The player walks the order list and plays
+# each pattern one ULA byte per frame. Material that never repeats is stored inline in the order
+# list rather than as a pattern, and patterns are numbered most used first, so nearly every order
+# list entry is a single byte.
+#
+#  [nn nn]			- number of patterns (0-509, little endian)
+#  [lo] * nn		- pattern offsets, low bytes
+#  [hi] * nn		- pattern offsets, high bytes (offsets are from the start of the file)
+#  [order] ...		- order list, where each entry is one of
+#					  [ii]				- play pattern ii (0-252)
+#					  0xfd [ii]			- play pattern 253+ii
+#					  0xfe [ll] [dd]*ll	- play ll (1-255) literal ULA bytes
+#					  0xff				- end of order list
+#  [patterns] ...	- each pattern is [length 1-255] followed by length ULA bytes
+#
+# .ula.bank + .ula.ord format
+# Several tunes can share one pattern bank, with each tune reduced to its own order list.
+# The bank is the same as above without the order list (offsets are from the start of the bank)
+# and each .ula.ord file is just the order list including its end marker.
+#--------------------------------------------------------------------------------------------------------------
+
+class UlaPatternCompressor:
+
+	MIN_PATTERN = 6			# shortest repeated segment worth turning into a pattern
+	MAX_PATTERN = 255		# pattern and literal lengths are a single byte
+	MAX_SHORT_INDEX = 253	# order list entries 0xfd-0xff are reserved
+	MAX_PATTERNS = 253 + 256
+	PATTERN_COST = 3		# length byte plus two offset table bytes per pattern
+	OCCURRENCE_COST = 2		# order list entry, plus part of the literal header needed to restart the run it interrupts
+
+	NAME = "pat"
+	EXTENSION = ".ula.pat"
+
+	# static 6502 cycle model for the reference player, per frame and per order list element
+	# worst case figures (including the JSR to the player and page crossings), calibrated against
+	# modules/ulaplayers.py on the simulated 6502 so that the model is a close upper bound
+	CYCLES = {
+		'frame': 50,		# count down the pattern, fetch the next byte and store it to &FE06
+		'order': 80,		# fetch the next order list entry
+		'pattern': 13,		# look up the pattern offsets and fetch its length
+		'extended': 60,		# extra index byte and 16-bit table index for patterns 253+
+		'literal': 25,		# fetch an inline literal run length
+	}
+
+	VERBOSE = False
+
+
+	#----------------------------------------------------------
+	# Suffix array
+	# Prefix doubling - each pass sorts suffixes by their first 2k symbols using the ranks of the
+	# first k, and stops as soon as every rank is unique.
+	# Works on any list of ints, so several streams can be joined with unique separator symbols.
+	#----------------------------------------------------------
+
+	def suffix_array(self, s):
+
+		n = len(s)
+		if n == 0:
+			return [], []
+
+		symbols = { v : r for r, v in enumerate(sorted(set(s))) }
+		rank = [ symbols[v] for v in s ]
+		sa = list(range(n))
+		k = 1
+		while True:
+			key = [ (rank[i] + 1) * (n + 2) + (rank[i + k] + 1 if i + k < n else 0) for i in range(n) ]
+			sa.sort(key = key.__getitem__)
+			new_rank = [0] * n
+			r = 0
+			for j in range(1, n):
+				if key[sa[j]] != key[sa[j-1]]:
+					r += 1
+				new_rank[sa[j]] = r
+			rank = new_rank
+			if r == n - 1 or k >= n:
+				break
+			k *= 2
+
+		# Kasai - lcp[i] is the longest common prefix of suffixes sa[i-1] and sa[i]
+		lcp = [0] * n
+		h = 0
+		for i in range(n):
+			if rank[i] > 0:
+				j = sa[rank[i] - 1]
+				while i + h < n and j + h < n and s[i + h] == s[j + h]:
+					h += 1
+				lcp[rank[i]] = h
+				if h > 0:
+					h -= 1
+			else:
+				h = 0
+
+		return sa, lcp
+
+
+	# enumerate every lcp interval of the suffix array
+	# returns list of (length, positions) for each set of suffixes sharing a prefix of MIN_PATTERN or more
+	def repeat_candidates(self, sa, lcp):
+
+		candidates = []
+		n = len(sa)
+		stack = [ (0, 0) ]
+		for i in range(1, n + 1):
+			l = min(lcp[i], self.MAX_PATTERN) if i < n else 0
+			lb = i - 1
+			while l < stack[-1][0]:
+				top_l, top_lb = stack.pop()
+				if top_l >= self.MIN_PATTERN:
+					candidates.append( (top_l, sa[top_lb:i]) )
+				lb = top_lb
+			if l > stack[-1][0]:
+				stack.append( (l, lb) )
+
+		return candidates
+
+
+	# pick non-overlapping occurrences of a candidate that are not yet covered by another pattern
+	def _occurrences(self, length, positions, covered):
+
+		occurrences = []
+		last_end = -1
+		for p in sorted(positions):
+			if p >= last_end and covered.find(1, p, p + length) < 0:
+				occurrences.append(p)
+				last_end = p + length
+		return occurrences
+
+
+	def _savings(self, length, occurrences):
+		return len(occurrences) * (length - self.OCCURRENCE_COST) - length - self.PATTERN_COST
+
+
+	#----------------------------------------------------------
+	# Segmentation
+	# Lazy greedy selection - candidates are held in a heap by their estimated saving and the best one
+	# is re-scored against what is already covered before it is accepted.
+	# Whatever is left uncovered becomes literal runs in the order list.
+	#----------------------------------------------------------
+
+	# segment one or more ULA streams into a shared set of patterns
+	# returns (patterns, orders) where patterns is a list of bytes and orders a list of order lists, one per stream
+	# order list entries are either a pattern index or a bytes object of literal ULA data
+	def segment(self, streams):
+
+		# join the streams with unique separators so that no repeat can span two streams
+		s = []
+		starts = []
+		for k, stream in enumerate(streams):
+			starts.append(len(s))
+			s.extend(stream)
+			s.append(256 + k)
+
+		sa, lcp = self.suffix_array(s)
+		candidates = self.repeat_candidates(sa, lcp)
+		covered = bytearray(len(s))
+		for k in range(len(streams)):
+			covered[starts[k] + len(streams[k])] = 1
+
+		heap = []
+		for c, (length, positions) in enumerate(candidates):
+			saving = self._savings(length, self._occurrences(length, positions, covered))
+			if saving > 0:
+				heap.append( (-saving, c) )
+		heapq.heapify(heap)
+
+		patterns = []
+		uses = []
+		segments = {}	# start position -> pattern index
+		while len(heap) and len(patterns) < self.MAX_PATTERNS:
+			estimate, c = heapq.heappop(heap)
+			length, positions = candidates[c]
+			occurrences = self._occurrences(length, positions, covered)
+			saving = self._savings(length, occurrences)
+			if saving <= 0:
+				continue
+			if len(heap) and saving < -heap[0][0]:
+				heapq.heappush(heap, (-saving, c))
+				continue
+
+			if self.VERBOSE: print("Pattern of " + str(length) + " frames used " + str(len(occurrences)) + " times")
+			index = len(patterns)
+			patterns.append(bytes(s[occurrences[0]:occurrences[0]+length]))
+			uses.append(len(occurrences))
+			for p in occurrences:
+				covered[p:p+length] = b'\x01' * length
+				segments[p] = index
+
+		# walk each stream, cutting the uncovered gaps into literal runs
+		orders = []
+		for k, stream in enumerate(streams):
+			order = []
+			p = starts[k]
+			end = p + len(stream)
+			while p < end:
+				index = segments.get(p)
+				if index is not None:
+					order.append(index)
+					p += len(patterns[index])
+					continue
+				gap_end = covered.find(1, p, end)
+				if gap_end < 0:
+					gap_end = end
+				while p < gap_end:
+					length = min(gap_end - p, self.MAX_PATTERN)
+					order.append(bytes(s[p:p+length]))
+					p += length
+			orders.append(order)
+
+		# literal runs that turn up more than once (typically where whole sections repeat between
+		# patterns that were picked first) are promoted to patterns too
+		literal_uses = {}
+		for order in orders:
+			for entry in order:
+				if not isinstance(entry, int):
+					literal_uses[entry] = literal_uses.get(entry, 0) + 1
+		promoted = {}
+		for literal, count in sorted(literal_uses.items(), key = lambda x: -x[1] * len(x[0])):
+			if len(patterns) >= self.MAX_PATTERNS:
+				break
+			# each use saves the literal bytes and the 0xfe header, less a one byte index
+			if count > 1 and count * (len(literal) + 1) > len(literal) + self.PATTERN_COST:
+				promoted[literal] = len(patterns)
+				patterns.append(literal)
+				uses.append(count)
+		orders = [ [ promoted.get(entry, entry) if not isinstance(entry, int) else entry for entry in order ] for order in orders ]
+
+		# renumber so that the most used patterns get single byte indexes
+		ranking = sorted(range(len(patterns)), key = lambda i: -uses[i])
+		patterns = [ patterns[i] for i in ranking ]
+		renumber = { old : new for new, old in enumerate(ranking) }
+		orders = [ [ renumber[entry] if isinstance(entry, int) else entry for entry in order ] for order in orders ]
+
+		return patterns, orders
+
+
+	#----------------------------------------------------------
+	# Serialisation
+	#----------------------------------------------------------
+
+	# serialise the pattern table, with an optional order list between the offset tables and the patterns
+	def _pack(self, patterns, order_data):
+
+		count = len(patterns)
+
+		output = bytearray()
+		output.extend(struct.pack('<H', count))
+
+		offsets = []
+		offset = 2 + count * 2 + len(order_data)
+		for pattern in patterns:
+			offsets.append(offset)
+			offset += 1 + len(pattern)
+		output.extend([ o & 255 for o in offsets ])
+		output.extend([ o >> 8 for o in offsets ])
+
+		if offset > 65535:
+			raise ValueError("Pattern data is too large (" + str(offset) + " bytes)")
+
+		output.extend(order_data)
+
+		for pattern in patterns:
+			output.append(len(pattern))
+			output.extend(pattern)
+
+		return output
+
+
+	# serialise an order list including its end marker
+	def pack_order(self, order):
+
+		output = bytearray()
+		for entry in order:
+			if isinstance(entry, int):
+				if entry >= self.MAX_SHORT_INDEX:
+					output.append(0xfd)
+					output.append(entry - self.MAX_SHORT_INDEX)
+				else:
+					output.append(entry)
+			else:
+				output.append(0xfe)
+				output.append(len(entry))
+				output.extend(entry)
+		output.append(0xff)
+		return output
+
+
+	def pack(self, patterns, order):
+		return self._pack(patterns, self.pack_order(order))
+
+
+	def pack_bank(self, patterns):
+		return self._pack(patterns, b'')
+
+
+	# compress a ULA byte stream
+	# returns bytearray of pattern data
+	def compress(self, ula_data):
+
+		patterns, orders = self.segment([ ula_data ])
+		return self.pack(patterns, orders[0])
+
+
+	# compress several ULA byte streams into one shared pattern bank
+	# returns (bank, orders) where orders is a list of packed order lists, one per stream
+	def compress_shared(self, streams):
+
+		patterns, orders = self.segment(streams)
+		return self.pack_bank(patterns), [ self.pack_order(order) for order in orders ]
+
+
+	#----------------------------------------------------------
+	# Reference streaming decoder
+	# Mirrors the 6502 player, producing one ULA byte per frame and counting the bytes it had to
+	# read to do so.
+	# returns (ula_data, frame_costs, frame_cycles) where frame_costs[i] is the number of bytes read
+	# in frame i and frame_cycles[i] the modelled 6502 cycles spent decoding it
+	#----------------------------------------------------------
+
+	def decode_frames(self, data, order_data = None):
+
+		cycle_model = self.CYCLES
+
+		count = data[0] | (data[1] << 8)
+		lo = 2
+		hi = 2 + count
+
+		# single tune files carry their order list after the offset tables
+		order_ptr = 0
+		if order_data is None:
+			order_data = data
+			order_ptr = 2 + count * 2
+
+		ula_data = bytearray()
+		frame_costs = []
+		frame_cycles = []
+
+		while True:
+			index = order_data[order_ptr]
+			order_ptr += 1
+			if index == 0xff:
+				break
+
+			if index == 0xfe:
+				length = order_data[order_ptr]
+				ula_data.extend(order_data[order_ptr + 1:order_ptr + 1 + length])
+				order_ptr += 1 + length
+				frame_costs.append(3)
+				frame_cycles.append(cycle_model['frame'] + cycle_model['order'] + cycle_model['literal'])
+			else:
+				reads = 1 + 2 + 1 + 1
+				cycles = cycle_model['frame'] + cycle_model['order'] + cycle_model['pattern']
+				if index == 0xfd:
+					index = self.MAX_SHORT_INDEX + order_data[order_ptr]
+					order_ptr += 1
+					reads += 1
+					cycles += cycle_model['extended']
+				offset = data[lo + index] | (data[hi + index] << 8)
+				length = data[offset]
+				ula_data.extend(data[offset + 1:offset + 1 + length])
+				frame_costs.append(reads)
+				frame_cycles.append(cycles)
+			frame_costs.extend([1] * (length - 1))
+			frame_cycles.extend([cycle_model['frame']] * (length - 1))
+
+		return ula_data, frame_costs, frame_cycles
+
+
+	def decompress(self, data):
+		return self.decode_frames(data)[0]
+
+
+	# print the pattern report for a stream and return it as a dict
+	def report(self, ula_data, encoded):
+
+		ula, frame_costs, frame_cycles = self.decode_frames(encoded)
+		worst_case = max(frame_costs) if len(frame_costs) else 0
+		worst_case_cycles = max(frame_cycles) if len(frame_cycles) else 0
+		ratio = float(len(encoded)) / float(len(ula_data)) if len(ula_data) else 0.0
+		print("   ULA patterns : " + str(encoded[0] | (encoded[1] << 8)) + " patterns")
+		print("   ULA patterns : " + str(len(ula_data)) + " bytes encoded to " + str(len(encoded)) + " bytes (ratio " + "%.3f" % ratio + ")")
+		print("   ULA patterns : worst case " + str(worst_case) + " bytes decoded per frame")
+		print("   ULA patterns : worst case " + str(worst_case_cycles) + " cycles per frame (modelled)")
+
+		return {
+			'size': len(ula_data),
+			'compressed_size': len(encoded),
+			'ratio': ratio,
+			'worst_case_bytes_per_frame': worst_case,
+			'worst_case_cycles_per_frame': worst_case_cycles,
+		}
@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+# ulaplayers.py
+# Reference 6502 players for the ULA stream encodings, run on a simulated 6502
+# By Simon Morris (https://github.com/simondotm/)
+# See https://github.com/simondotm/vgm-packer
+#
+# Copyright (c) 2019 Simon Morris. All rights reserved.
+#
+# "MIT License":
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+import glob
+import os
+import sys
+
+from modules.cpu6502 import Cpu6502, Assembler6502
+from modules.ulacodecs import CODECS
+
+
+#--------------------------------------------------------------------------------------------------------------
+# Reference players
+# Each player starts with a jump table, 'JMP init' then 'JMP play'. The harness sets the zero page
+# pointer 'ptr' to the encoded data (and 'end' to the end of it for raw streams) and calls init once,
+# then calls play once per 50Hz frame. play writes one ULA byte to &FE06 and returns with carry clear,
+# or returns with carry set and no write at the end of the stream.
+# These are plain, readable players to measure the encodings with, not tuned production drivers.
+#--------------------------------------------------------------------------------------------------------------
+
+PLAYER_COMMON = """
+ULA = &FE06
+ptr = &70
+end = &72
+
+	JMP init
+	JMP play
+
+; fetch the next byte from ptr, returns with flags set from the byte
+.getbyte
+	LDY #0 : LDA (ptr),Y
+	INC ptr : BNE getbyte_done : INC ptr+1
+.getbyte_done
+	CMP #0
+	RTS
+"""
+
+PLAYER_RAW = PLAYER_COMMON + """
+.init
+	RTS
+
+.play
+	LDA ptr : CMP end : LDA ptr+1 : SBC end+1 : BCS eof
+	JSR getbyte
+	STA ULA
+	CLC
+	RTS
+.eof
+	SEC
+	RTS
+"""
+
+PLAYER_LZ = PLAYER_COMMON + """
+HISTORY = &0800			; page aligned 256 byte history buffer
+lits = &74				; literal count (16-bit)
+mlen = &76				; match length (16-bit)
+pend = &78				; match length nibble waiting for the literals to finish
+moff = &79				; match offset
+hptr = &7A				; history write index
+value = &7B
+
+.init
+	LDA #0 : STA lits : STA lits+1 : STA mlen : STA mlen+1 : STA pend : STA hptr
+	RTS
+
+.play
+	LDA lits : ORA lits+1 : BNE literal
+	LDA mlen : ORA mlen+1 : BNE match
+	LDA pend : BNE startmatch
+
+	; start a new sequence
+	JSR getbyte : BEQ eof
+	TAX : AND #15 : STA pend
+	TXA : LSR A : LSR A : LSR A : LSR A : STA lits
+	CMP #15 : BNE newlits
+	JSR getbyte : CLC : ADC #15 : STA lits : LDA #0 : ADC #0 : STA lits+1
+.newlits
+	LDA lits : ORA lits+1 : BNE literal
+
+.startmatch
+	LDA pend : STA mlen : LDA #0 : STA pend
+	JSR getbyte : STA moff
+	LDA mlen : CMP #15 : BNE match
+	JSR getbyte : CLC : ADC #15 : STA mlen : LDA #0 : ADC #0 : STA mlen+1
+
+.match
+	LDA hptr : SEC : SBC moff : TAX : LDA HISTORY,X : STA value
+	LDA mlen : BNE match_dec : DEC mlen+1
+.match_dec
+	DEC mlen
+	JMP output
+
+.literal
+	JSR getbyte : STA value
+	LDA lits : BNE literal_dec : DEC lits+1
+.literal_dec
+	DEC lits
+
+.output
+	LDA value : LDX hptr : STA HISTORY,X : INC hptr
+	STA ULA
+	CLC
+	RTS
+
+.eof
+	SEC
+	RTS
+"""
+
+PLAYER_RLE = PLAYER_COMMON + """
+pal = &74				; palette pointer
+mode = &76				; 0 = nibble, 1 = byte, 2 = wide, 3 = raw
+count = &77				; frames left in the current run
+run = &78
+index = &79
+value = &7A
+
+.init
+	JSR getbyte : TAX
+	LDY #3 : CPX #&FF : BEQ init_mode	; raw mode has no palette
+	LDA ptr : STA pal : LDA ptr+1 : STA pal+1
+	TXA : CLC : ADC ptr : STA ptr : LDA ptr+1 : ADC #0 : STA ptr+1
+	LDY #0 : CPX #16 : BCC init_mode : INY : CPX #128 : BCC init_mode : INY
+.init_mode
+	STY mode
+	LDA #0 : STA count
+	RTS
+
+.play
+	LDA count : BEQ token
+	DEC count
+	LDA value : STA ULA
+	CLC
+	RTS
+
+.token
+	JSR getbyte
+	LDX mode : BEQ nibble : DEX : BEQ bytemode : DEX : BNE raw
+
+	; wide mode
+	CMP #&FF : BEQ eof
+	CMP #&FE : BEQ repeat
+	STA index : LDA #1 : STA run
+	JMP lookup
+.repeat
+	JSR getbyte : STA run
+	JMP startrun
+
+.nibble
+	CMP #&F0 : BEQ eof
+	TAX : LSR A : LSR A : LSR A : LSR A : STA index
+	TXA : AND #15 : BNE setrun
+	JSR getbyte
+	JMP setrun
+
+.bytemode
+	CMP #&FF : BEQ eof
+	TAX : AND #&7F : STA index
+	LDA #1 : CPX #&80 : BCC setrun
+	JSR getbyte
+
+.setrun
+	STA run
+.lookup
+	LDY index : LDA (pal),Y : STA value
+.startrun
+	LDX run : DEX : STX count		; a run of 0 means 256 frames
+	LDA value : STA ULA
+	CLC
+	RTS
+
+.raw
+	CMP #1 : BEQ eof
+	STA ULA
+	CLC
+	RTS
+
+.eof
+	SEC
+	RTS
+"""
+
+PLAYER_PAT = PLAYER_COMMON + """
+base = &74				; start of the file, pattern offsets are relative to it
+lotab = &76
+hitab = &78
+pp = &7A				; pattern data pointer
+plen = &7C				; frames left in the current pattern
+npat = &7D				; number of patterns (16-bit)
+table = &7F				; offset table pointer for extended indexes (4 bytes)
+
+.init
+	LDA ptr : STA base : LDA ptr+1 : STA base+1
+	JSR getbyte : STA npat : JSR getbyte : STA npat+1
+	LDA ptr : STA lotab : LDA ptr+1 : STA lotab+1
+	CLC : LDA lotab : ADC npat : STA hitab : LDA lotab+1 : ADC npat+1 : STA hitab+1
+	CLC : LDA hitab : ADC npat : STA ptr : LDA hitab+1 : ADC npat+1 : STA ptr+1
+	LDA #0 : STA plen
+	RTS
+
+.play
+	LDA plen : BEQ order
+.frame
+	LDY #0 : LDA (pp),Y : STA ULA
+	INC pp : BNE frame_done : INC pp+1
+.frame_done
+	DEC plen
+	CLC
+	RTS
+
+.order
+	JSR getbyte
+	CMP #&FF : BEQ eof
+	CMP #&FE : BEQ literal
+	CMP #&FD : BEQ extended
+
+	TAY
+	LDA (lotab),Y : CLC : ADC base : STA pp
+	LDA (hitab),Y : ADC base+1 : STA pp+1
+	JMP startpattern
+
+.extended
+	CLC : LDA lotab : ADC #253 : STA table : LDA lotab+1 : ADC #0 : STA table+1
+	CLC : LDA hitab : ADC #253 : STA table+2 : LDA hitab+1 : ADC #0 : STA table+3
+	JSR getbyte : TAY
+	LDA (table),Y : CLC : ADC base : STA pp
+	LDA (table+2),Y : ADC base+1 : STA pp+1
+
+.startpattern
+	LDY #0 : LDA (pp),Y : STA plen
+	INC pp : BNE frame : INC pp+1
+	JMP frame
+
+.literal
+	JSR getbyte : STA plen
+	LDA ptr : STA pp : LDA ptr+1 : STA pp+1
+	CLC : LDA ptr : ADC plen : STA ptr : LDA ptr+1 : ADC #0 : STA ptr+1
+	JMP frame
+
+.eof
+	SEC
+	RTS
+"""
+
+# player source for each encoder, by name
+PLAYERS = {
+	'raw' : PLAYER_RAW,
+	'lz' : PLAYER_LZ,
+	'rle' : PLAYER_RLE,
+	'pat' : PLAYER_PAT,
+}
+
+# bytes of RAM each player needs outside zero page, as well as its code
+PLAYER_WORKSPACE = {
+	'raw' : 0,
+	'lz' : 256,		# HISTORY page, whatever window size the stream was encoded with
+	'rle' : 0,
+	'pat' : 0,
+}
+
+
+#--------------------------------------------------------------------------------------------------------------
+# Harness
+# Loads a player and an encoded stream into a simulated 6502, calls the player once per frame and records
+# the cycles each call took and the values it wrote to &FE06. Cycle counts include the JSR to the player.
+# The memory map is a convenience for the simulation - real Electron tunes have to fit around the screen.
+#--------------------------------------------------------------------------------------------------------------
+
+class UlaPlayerSimulator:
+
+	PLAYER_ADDRESS = 0x0900
+	DATA_ADDRESS = 0x1000
+	DATA_LIMIT = 0xfc00		# keep clear of the FRED/JIM/SHEILA pages
+	ULA_REGISTER = 0xfe06
+	MAX_FRAME_CYCLES = 20000	# one 50Hz frame at 1MHz, a player taking longer than this has gone wrong
+
+	def __init__(self):
+		self.players = {}
+
+
+	def assemble(self, name):
+
+		if name not in self.players:
+			if name not in PLAYERS:
+				raise ValueError("No reference player for ULA encoder '" + name + "'")
+			code, symbols = Assembler6502(self.PLAYER_ADDRESS).assemble(PLAYERS[name])
+			self.players[name] = (code, symbols)
+		return self.players[name]
+
+
+	# play an encoded stream
+	# returns (ula_data, frame_cycles, init_cycles) where ula_data is the sequence of bytes written to the ULA
+	def run(self, name, data):
+
+		code, symbols = self.assemble(name)
+		if self.DATA_ADDRESS + len(data) > self.DATA_LIMIT:
+			raise ValueError("Encoded stream of " + str(len(data)) + " bytes is too big to simulate")
+
+		cpu = Cpu6502()
+		cpu.load(self.PLAYER_ADDRESS, code)
+		cpu.load(self.DATA_ADDRESS, data)
+		end = self.DATA_ADDRESS + len(data)
+		cpu.load(symbols['ptr'], bytearray([ self.DATA_ADDRESS & 255, self.DATA_ADDRESS >> 8, end & 255, end >> 8 ]))
+
+		init_cycles = cpu.call(self.PLAYER_ADDRESS, self.MAX_FRAME_CYCLES)
+
+		ula_data = bytearray()
+		frame_cycles = []
+		while True:
+			cpu.io_writes = []
+			cycles = cpu.call(self.PLAYER_ADDRESS + 3, self.MAX_FRAME_CYCLES)
+			writes = [ value for (cycle, address, value) in cpu.io_writes if address == self.ULA_REGISTER ]
+			if cpu.c:
+				if len(writes):
+					raise RuntimeError("Player wrote to the ULA in the end of stream frame")
+				break
+			if len(writes) != 1:
+				raise RuntimeError("Player wrote " + str(len(writes)) + " times to the ULA in frame " + str(len(frame_cycles)))
+			ula_data.append(writes[0])
+			frame_cycles.append(cycles)
+
+		return ula_data, frame_cycles, init_cycles
+
+
+	# encode a ULA stream, play it back and check the player output against the original
+	# returns dict of statistics
+	def measure(self, name, ula_data):
+
+		codec = CODECS[name]()
+		data = codec.compress(ula_data)
+		played, frame_cycles, init_cycles = self.run(name, data)
+		modelled = codec.decode_frames(data)[2]
+
+		return {
+			'codec': name,
+			'encoded_size': len(data),
+			'verified': played == ula_data,
+			'init_cycles': init_cycles,
+			'worst_case_cycles_per_frame': max(frame_cycles) if len(frame_cycles) else 0,
+			'average_cycles_per_frame': round(float(sum(frame_cycles)) / len(frame_cycles), 2) if len(frame_cycles) else 0.0,
+			'modelled_worst_case_cycles_per_frame': max(modelled) if len(modelled) else 0,
+		}
+
+
+#------------------------------------------------------------------------
+# Main()
+#------------------------------------------------------------------------
+
+import argparse
+
+# Determine if running as a script
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument("input", nargs="*", help="ULA data files to play (default is 'examples/*.ula.bin')")
+	parser.add_argument("-c", "--codecs", default=",".join(PLAYERS.keys()), metavar="<names>", help="Comma separated list of encoders to play, default: " + ",".join(PLAYERS.keys()))
+	args = parser.parse_args()
+
+	filenames = args.input
+	if len(filenames) == 0:
+		filenames = sorted(glob.glob(os.path.join("examples", "*.ula.bin")))
+
+	simulator = UlaPlayerSimulator()
+	failed = False
+	for filename in filenames:
+		ula_file = open(filename, 'rb')
+		ula_data = CODECS['raw']().split_marker(ula_file.read())[0]
+		ula_file.close()
+
+		print(os.path.basename(filename) + " (" + str(len(ula_data)) + " frames)")
+		for name in args.codecs.split(","):
+			result = simulator.measure(name, ula_data)
+			print("   " + name.ljust(4) + " : " + str(result['encoded_size']).rjust(6) + " bytes, worst case " + str(result['worst_case_cycles_per_frame']) + " cycles per frame (modelled " + str(result['modelled_worst_case_cycles_per_frame']) + "), average " + "%.1f" % result['average_cycles_per_frame'] + ", " + ("OK" if result['verified'] else "MISMATCH"))
+			if not result['verified']:
+				failed = True
+
+	if failed:
+		print("ERROR: Some players did not reproduce the ULA data")
+		sys.exit(1)
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# vgmcache.py
+# On-disk cache of parsed VGM register data, keyed by the VGM file contents
+# By Simon Morris (https://github.com/simondotm/)
+# See https://github.com/simondotm/vgm-packer
+#
+# Copyright (c) 2019 Simon Morris. All rights reserved.
+#
+# "MIT License":
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import zlib
+
+from modules.vgmparser import VgmStream
+
+
+#--------------------------------------------------------------------------------------------------------------
+# Parse cache
+# Parsing a VGM into register state is the same work whatever the conversion settings, so the results
+# are kept in a cache directory with one file per VGM, named by a hash of the VGM file contents and the
+# parser version. Changing either makes a new entry rather than reusing a stale one. The register frames
+# are all the conversion needs, so the packet stream they were parsed from isn't kept.
+#
+# .vgmc format, all little endian, zlib compressed after the magic number
+#  'VGMC'			- magic number
+#  [version]		- u16 format version
+#  [frames]			- u32 number of register frames
+#  [loop]			- u32 loop frame + 1, or 0 if the VGM doesn't loop
+#  [rr] * 11 * frames - register values, 11 bytes per frame
+#
+# The outputs of the conversion stages are cached as well, as zlib compressed .stage files named by a hash
+# of the stage name, the settings the stage depends on and a digest of its input data, so a stage is only
+# run again when its input or its own settings change.
+#
+# The cache is kept under MAX_SIZE bytes by deleting the least recently used entries, using the file
+# modification time, which is updated on every hit.
+#
+# Several conversions (eg. -j, --server workers) can share a cache directory. Entries are written to a
+# unique temporary file and renamed into place, and an entry that can't be read - deleted by another
+# conversion's eviction, truncated or corrupt - is treated as a miss.
+#--------------------------------------------------------------------------------------------------------------
+
+class VgmCache:
+
+	FORMAT_VERSION = 2
+	MAGIC = b'VGMC'
+	EXTENSION = ".vgmc"
+	STAGE_EXTENSION = ".stage"
+	MAX_SIZE = 64*1024*1024		# bytes
+	REGISTERS = 11
+
+	VERBOSE = False
+
+
+	def __init__(self, cache_dir, max_size = None):
+
+		self.cache_dir = cache_dir
+		if max_size is not None:
+			self.MAX_SIZE = max_size
+		if not os.path.isdir(cache_dir):
+			os.makedirs(cache_dir)
+
+
+	# returns the cache key for a VGM file, read in blocks so the file is never held in memory
+	def key(self, vgm_filename):
+
+		h = hashlib.sha1()
+		h.update(struct.pack('<HH', VgmStream.PARSER_VERSION, self.FORMAT_VERSION))
+		vgm_file = open(vgm_filename, 'rb')
+		while True:
+			block = vgm_file.read(65536)
+			if len(block) == 0:
+				break
+			h.update(block)
+		vgm_file.close()
+		return h.hexdigest()
+
+
+	def path(self, key):
+		return os.path.join(self.cache_dir, key + self.EXTENSION)
+
+
+	# returns (registers, loop_frame) for a cached VGM, or None if it isn't cached
+	# registers is a bytes of 11 register values per frame
+	def load(self, key):
+
+		filename = self.path(key)
+		data = self.read_file(filename)
+		if data is None:
+			return None
+
+		try:
+			if data[:4] != self.MAGIC:
+				raise ValueError("bad magic number")
+			data = zlib.decompress(data[4:])
+			version, frames, loop = struct.unpack_from('<HII', data, 0)
+			if version != self.FORMAT_VERSION:
+				return None
+			offset = struct.calcsize('<HII')
+			registers = data[offset:offset+frames*self.REGISTERS]
+			if len(registers) != frames*self.REGISTERS:
+				raise ValueError("truncated entry")
+		except (ValueError, zlib.error, struct.error) as e:
+			print("WARNING: Ignoring bad parse cache entry '" + filename + "' (" + str(e) + ")")
+			return None
+
+		if self.VERBOSE: print("Parse cache hit '" + filename + "'")
+		loop_frame = loop - 1 if loop else None
+		return registers, loop_frame
+
+
+	# add a parsed VGM to the cache, then evict old entries if it is over size
+	def store(self, key, registers, loop_frame):
+
+		data = bytearray()
+		data.extend(struct.pack('<HII', self.FORMAT_VERSION, len(registers) // self.REGISTERS, loop_frame + 1 if loop_frame is not None else 0))
+		data.extend(registers)
+
+		filename = self.path(key)
+		self.write_file(filename, self.MAGIC + zlib.compress(bytes(data), 9))
+
+		if self.VERBOSE: print("Parse cache stored '" + filename + "'")
+		self.evict()
+
+
+	# returns the contents of a cache file, or None if it isn't cached or can't be read
+	# a hit is marked as the most recently used
+	def read_file(self, filename):
+
+		try:
+			cache_file = open(filename, 'rb')
+			data = cache_file.read()
+			cache_file.close()
+			os.utime(filename, None)
+		except FileNotFoundError:
+			return None
+		except OSError as e:
+			print("WARNING: Can't read cache entry '" + filename + "' (" + str(e) + ")")
+			return None
+		return data
+
+
+	# written to a temporary file of its own first so that other conversions never see a partial entry
+	def write_file(self, filename, data):
+
+		fd, temp_filename = tempfile.mkstemp(dir = self.cache_dir, prefix = os.path.basename(filename) + ".", suffix = ".tmp")
+		try:
+			cache_file = os.fdopen(fd, 'wb')
+			cache_file.write(data)
+			cache_file.close()
+			os.replace(temp_filename, filename)
+		except:
+			if os.path.exists(temp_filename):
+				os.remove(temp_filename)
+			raise
+
+
+	#----------------------------------------------------------
+	# Stage outputs
+	#----------------------------------------------------------
+
+	# returns the cache key for the output of a stage
+	# settings is a dict of only the settings that the stage output depends on
+	def stage_key(self, stage, settings, input_data):
+
+		h = hashlib.sha1()
+		h.update(struct.pack('<HH', VgmStream.PARSER_VERSION, self.FORMAT_VERSION))
+		h.update(stage.encode('ascii'))
+		h.update(json.dumps(settings, sort_keys = True).encode('ascii'))
+		h.update(hashlib.sha1(bytes(input_data)).digest())
+		return h.hexdigest()
+
+
+	# returns the cached output bytes of a stage, or None if it isn't cached
+	def load_stage(self, key):
+
+		filename = os.path.join(self.cache_dir, key + self.STAGE_EXTENSION)
+		data = self.read_file(filename)
+		if data is None:
+			return None
+
+		try:
+			return zlib.decompress(data)
+		except zlib.error as e:
+			print("WARNING: Ignoring bad stage cache entry '" + filename + "' (" + str(e) + ")")
+			return None
+
+
+	def store_stage(self, key, data):
+
+		self.write_file(os.path.join(self.cache_dir, key + self.STAGE_EXTENSION), zlib.compress(bytes(data), 9))
+		self.evict()
+
+
+	# delete the least recently used entries until the cache is under MAX_SIZE
+	# entries can be deleted by other conversions sharing the cache while this runs
+	def evict(self):
+
+		entries = []
+		total = 0
+		for name in os.listdir(self.cache_dir):
+			if not name.endswith(self.EXTENSION) and not name.endswith(self.STAGE_EXTENSION):
+				continue
+			filename = os.path.join(self.cache_dir, name)
+			try:
+				st = os.stat(filename)
+			except FileNotFoundError:
+				continue
+			entries.append( (st.st_mtime, st.st_size, filename) )
+			total += st.st_size
+
+		entries.sort()
+		while total > self.MAX_SIZE and len(entries) > 1:
+			mtime, size, filename = entries.pop(0)
+			try:
+				os.remove(filename)
+			except FileNotFoundError:
+				pass
+			total -= size
+			if self.VERBOSE: print("Parse cache evicted '" + filename + "'")
+
+
+	# generator for the register frames of a cache entry, a new bytearray of 11 values per frame
+	def iter_register_frames(self, registers):
+
+		for n in range(0, len(registers), self.REGISTERS):
+			yield bytearray(registers[n:n+self.REGISTERS])
+
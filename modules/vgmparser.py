@@ -43,6 +43,47 @@ else:
 class FatalError(Exception):
 	pass
 
+
+# forward only reader for VGM data that can't be seeked, eg. a pipe on stdin
+# the start of the stream is kept so that the header can be re-read, otherwise seeks skip forward by reading
+class PipeReader:
+
+	HEADER_SIZE = 0x100		# covers the VGM header up to the largest data offset in use
+
+	def __init__(self, stream):
+		self.stream = stream
+		self.header = stream.read(self.HEADER_SIZE)
+		self.position = 0
+
+	def tell(self):
+		return self.position
+
+	def read(self, size = -1):
+		data = b''
+		if self.position < len(self.header):
+			if size < 0:
+				data = self.header[self.position:]
+			else:
+				data = self.header[self.position:self.position+size]
+				size -= len(data)
+			self.position += len(data)
+		if size != 0 and self.position >= len(self.header):
+			more = self.stream.read(size)
+			self.position += len(more)
+			data += more
+		return data
+
+	def seek(self, offset, whence = 0):
+		if whence == 1:
+			offset += self.position
+		if offset < self.position and self.position > len(self.header):
+			raise IOError("Can't seek backwards in a VGM pipe")
+		if offset <= len(self.header):
+			self.position = offset
+		else:
+			self.read(offset - self.position)
+		return self.position
+
 class VgmStream:
 
 
@@ -87,6 +128,7 @@ class VgmStream:
 	# script vars / configs
 
 	VGM_FREQUENCY = 44100
+	PARSER_VERSION = 2	# bump when a change to the parser changes its output, so cached parses are not reused
 
 
 	# script options
@@ -105,6 +147,8 @@ class VgmStream:
 	vgm_filename = ''
 	vgm_loop_offset = 0
 	vgm_loop_length = 0
+	loop_command = None		# index into command_list of the first command of the loop, if the VGM loops
+	loop_frame = None		# packet number that the loop starts at, set by as_binary()
 	
 	# Supported VGM versions
 	supported_ver_list = [
@@ -303,20 +347,30 @@ class VgmStream:
 	}
 
 	
-	# constructor - pass in the filename of the VGM
-	def __init__(self, vgm_filename):
+	# constructor - pass in the filename of the VGM, or '-' to read it from stdin
+	# if stream is True the file is kept open and read a command at a time by iter_commands(),
+	# rather than loaded and parsed into command_list up front
+	# stdin is always streamed, and its GD3 tag is only read once the commands have been
+	def __init__(self, vgm_filename, stream = False):
 
 		self.vgm_filename = vgm_filename
+		self.pipe = vgm_filename == '-'
+		self.stream = stream or self.pipe
 		print("  VGM file loaded : '" + vgm_filename + "'")
 		
 		# open the vgm file and parse it
-		vgm_file = open(vgm_filename, 'rb')
-		vgm_data = vgm_file.read()
+		if self.pipe:
+			self.data = PipeReader(sys.stdin.buffer)
+		elif stream:
+			self.data = open(vgm_filename, 'rb')
+		else:
+			vgm_file = open(vgm_filename, 'rb')
+			vgm_data = vgm_file.read()
 		
-		# Store the VGM data and validate it
-		self.data = ByteBuffer(vgm_data)
+			# Store the VGM data and validate it
+			self.data = ByteBuffer(vgm_data)
 		
-		vgm_file.close()
+			vgm_file.close()
 		
 		# parse
 		self.validate_vgm_data()
@@ -371,11 +425,20 @@ class VgmStream:
 		self.vgm_source_clock = self.metadata['sn76489_clock']
 		self.vgm_target_clock = self.vgm_source_clock
 		
+		# the loop offset is relative to its own header field, and only counts if there are loop samples
+		self.loop_position = None
+		if self.vgm_loop_offset != 0 and self.vgm_loop_length != 0:
+			self.loop_position = self.vgm_loop_offset + self.metadata_offsets[self.metadata['version']]['loop_offset']['offset']
+
 		# Parse GD3 data and the VGM commands
-		self.parse_gd3()
-		self.parse_commands()
+		if not self.pipe:
+			self.parse_gd3()
+		if not self.stream:
+			self.parse_commands()
 		
-		print( "   VGM Commands # : " + str(len(self.command_list)) )
+			print( "   VGM Commands # : " + str(len(self.command_list)) )
+			if self.loop_command is not None:
+				print( "   VGM Loop Command # : " + str(self.loop_command) )
 		print( "" )
 
 
@@ -393,6 +456,8 @@ class VgmStream:
 			# a vgz file). Try un-gzipping the file and trying again.
 			self.data.seek(0)
 			self.data = gzip.GzipFile(fileobj=self.data, mode='rb')
+			if self.pipe:
+				self.data = PipeReader(self.data)
 
 			try:
 				if self.data.read(4) != self.vgm_magic_number:
@@ -443,17 +508,19 @@ class VgmStream:
 		original_pos = self.data.tell()
 
 		# Seek to the start of the GD3 data
-		self.data.seek(
-			self.metadata['gd3_offset'] +
-			self.metadata_offsets[self.metadata['version']]['gd3_offset']['offset']
-		)
+		gd3_position = self.metadata['gd3_offset'] + self.metadata_offsets[self.metadata['version']]['gd3_offset']['offset']
+		if self.pipe and (self.metadata['gd3_offset'] == 0 or gd3_position < self.data.tell()):
+			# no GD3 tag after the commands
+			gd3_data = ByteBuffer(b'')
+		else:
+			self.data.seek(gd3_position)
 
-		# Skip 8 bytes ('Gd3 ' string and 4 byte version identifier)
-		self.data.seek(8, 1)
+			# Skip 8 bytes ('Gd3 ' string and 4 byte version identifier)
+			self.data.seek(8, 1)
 
-		# Get the length of the GD3 data, then read it
-		gd3_length = struct.unpack('<I', self.data.read(4))[0]
-		gd3_data = ByteBuffer(self.data.read(gd3_length))
+			# Get the length of the GD3 data, then read it
+			gd3_length = struct.unpack('<I', self.data.read(4))[0]
+			gd3_data = ByteBuffer(self.data.read(gd3_length))
 
 		# Parse the GD3 data
 		gd3_fields = []
@@ -519,11 +586,18 @@ class VgmStream:
 
 
 		# Seek back to the original position in the VGM data
-		self.data.seek(original_pos)
+		if not self.pipe:
+			self.data.seek(original_pos)
 
 	#-------------------------------------------------------------------------------------------------
 
 	def parse_commands(self):
+		self.command_list = list(self.iter_commands())
+
+
+	# generator for the VGM commands, read one at a time from the VGM data
+	# yields a dict of command and data for each command
+	def iter_commands(self):
 		# Save the current position of the VGM data
 		original_pos = self.data.tell()
 
@@ -533,50 +607,52 @@ class VgmStream:
 			self.metadata_offsets[self.metadata['version']]['vgm_data_offset']['offset']
 		)
 
+		self.loop_command = None
+		command_count = 0
 		while True:
+			# note which command the loop starts at
+			if self.loop_position is not None and self.loop_command is None and self.data.tell() >= self.loop_position:
+				self.loop_command = command_count
+
 			# Read a byte, this will be a VGM command, we will then make
 			# decisions based on the given command
 			command = self.data.read(1)
 
 			# Break if we are at the end of the file
-			if command == '':
+			if len(command) == 0:
 				break
 
+			q = None
 			# 0x4f dd - Game Gear PSG stereo, write dd to port 0x06
 			# 0x50 dd - PSG (SN76489/SN76496) write value dd
 			if command in [b'\x4f', b'\x50']:
-				self.command_list.append({
+				q = {
 					'command': command,
 					'data': self.data.read(1),
-				})
+				}
 
 			# 0x51 aa dd - YM2413, write value dd to register aa
 			# 0x52 aa dd - YM2612 port 0, write value dd to register aa
 			# 0x53 aa dd - YM2612 port 1, write value dd to register aa
 			# 0x54 aa dd - YM2151, write value dd to register aa
 			elif command in [b'\x51', b'\x52', b'\x53', b'\x54']:
-				self.command_list.append({
+				q = {
 					'command': command,
 					'data': self.data.read(2),
-				})
+				}
 
 			# 0x61 nn nn - Wait n samples, n can range from 0 to 65535
 			elif command == b'\x61':
-				self.command_list.append({
+				q = {
 					'command': command,
 					'data': self.data.read(2),
-				})
+				}
 
 			# 0x62 - Wait 735 samples (60th of a second)
 			# 0x63 - Wait 882 samples (50th of a second)
 			# 0x66 - End of sound data
 			elif command in [b'\x62', b'\x63', b'\x66']:
-				self.command_list.append({'command': command, 'data': None})
-
-				# Stop processing commands if we are at the end of the music
-				# data
-				if command == b'\x66':
-					break
+				q = {'command': command, 'data': None}
 
 			# 0x67 0x66 tt ss ss ss ss - Data block
 			elif command == b'\x67':
@@ -593,46 +669,67 @@ class VgmStream:
 			# 0x8n - YM2612 port 0 address 2A write from the data bank, then
 			#        wait n samples; n can range from 0 to 15
 			elif b'\x70' <= command <= b'\x8f':
-				self.command_list.append({'command': command, 'data': None})
+				q = {'command': command, 'data': None}
 
 			# 0xe0 dddddddd - Seek to offset dddddddd (Intel byte order) in PCM
 			#                 data bank
 			elif command == b'\xe0':
-				self.command_list.append({
+				q = {
 					'command': command,
 					'data': self.data.read(4),
-				})
+				}
 				
 			# 0x30 dd - dual chip command
+			# the data byte is always read, so that it isn't parsed as a command when dual chip mode is disabled
 			elif command == b'\x30':
+				data = self.data.read(1)
 				if self.dual_chip_mode_enabled:
-					self.command_list.append({
+					q = {
 						'command': command,
-						'data': self.data.read(1),
-					})
-			
+						'data': data,
+					}
+
+			if q is not None:
+				yield q
+				command_count += 1
+
+			# Stop processing commands if we are at the end of the music
+			# data
+			if command == b'\x66':
+				break
+
 
 		# Seek back to the original position in the VGM data
-		self.data.seek(original_pos)
+		# a pipe can only be read once, and the GD3 tag follows the commands
+		if self.pipe:
+			self.parse_gd3()
+		else:
+			self.data.seek(original_pos)
 
 
 	#-------------------------------------------------------------------------------------------------
 	
-	# returns bytearray containing the raw data version of the vgm
-	def as_binary(self, rawheader = True):
-		print( "   VGM Processing : Output binary file " )
+	# generator for the packets of the raw data version of the vgm, one packet per play interval
+	# yields a bytearray of the PSG writes for each packet, ending with one last empty packet
+	# commands defaults to the parsed command_list, or the VGM file read a command at a time in stream mode
+	# sets loop_frame to the number of the packet that the loop starts in, before that packet is yielded
+	def iter_packets(self, commands = None):
+
+		if commands is None:
+			commands = self.iter_commands() if self.stream else self.command_list
 
-		byte_size = 1
-		packet_size = 0
 		play_rate = self.metadata['rate']
-		play_interval = self.VGM_FREQUENCY / play_rate
-		data_block = bytearray()
 		packet_block = bytearray()
 
 		packet_count = 0
 
 		# emit the packet data
-		for q in self.command_list:
+		self.loop_frame = None
+		for index, q in enumerate(commands):
+
+			# the loop starts with the packet being built when the loop command is reached
+			if index == self.loop_command:
+				self.loop_frame = packet_count
 			
 			command = q["command"]
 			if command != struct.pack('B', 0x50):
@@ -640,11 +737,7 @@ class VgmStream:
 				# non-write command, so flush any pending packet data
 				if self.VERBOSE: print( "Packet length " + str(len(packet_block)) )
 
-				# python 3 struct.pack returns iterable "bytes" even if len is 1, so we use extend rather than append since this is compatible with python 2 and 3
-				#data_block.append( struct.pack('B', len(packet_block) ) )
-				data_block.extend( struct.pack('B', len(packet_block) ) )
-				
-				data_block.extend(packet_block)
+				yield packet_block
 				packet_count += 1
 				
 				#if packet_count > 30*play_rate:
@@ -673,14 +766,14 @@ class VgmStream:
 					intervals = wait / (self.VGM_FREQUENCY / play_rate)
 					if intervals == 0:
 						print( "ERROR in data stream, wait value (" + str(wait) + ") was not divisible by play_rate (" + str((self.VGM_FREQUENCY / play_rate)) + "), bailing" )
-						return
+						raise FatalError("Wait value not divisible by play rate")
 					else:
 						if self.VERBOSE: print( "WAIT " + str(intervals) + " intervals" )
 						
 					# emit empty packet headers to simulate wait commands
 					intervals -= 1
 					while intervals > 0:
-						data_block.append(0)
+						yield bytearray()
 						if self.VERBOSE: print( "Packet length 0" )
 						intervals -= 1
 						packet_count += 1
@@ -692,7 +785,25 @@ class VgmStream:
 				packet_block.extend(q['data'])
 
 		# eof
-		data_block.append(0x00)	# append one last wait
+		yield bytearray()	# append one last wait
+
+
+	# returns bytearray containing the raw data version of the vgm
+	def as_binary(self, rawheader = True):
+		print( "   VGM Processing : Output binary file " )
+
+		play_rate = self.metadata['rate']
+		data_block = bytearray()
+
+		packet_count = 0
+		for packet_block in self.iter_packets():
+			# python 3 struct.pack returns iterable "bytes" even if len is 1, so we use extend rather than append since this is compatible with python 2 and 3
+			data_block.extend( struct.pack('B', len(packet_block) ) )
+			data_block.extend(packet_block)
+			packet_count += 1
+
+		# the last wait isn't counted
+		packet_count -= 1
 		data_block.append(0xFF)	# signal EOF
 
 
@@ -705,6 +816,8 @@ class VgmStream:
 		header_block.extend(struct.pack('B', (packet_count >> 8) & 0xff))	
 
 		print( "    Num packets " + str(packet_count) )
+		if self.loop_frame is not None:
+			print( "    Loop packet " + str(self.loop_frame) )
 		duration = packet_count / play_rate
 		duration_mm = int(duration / 60.0)
 		duration_ss = int(duration % 60.0)
@@ -760,21 +873,13 @@ class VgmStream:
 
 
 			
-	# write vgm file (with same header data as the input, but from binary register data)
-	# registers is an array of 11 byte arrays, each byte array containing the tune data
-	def write_vgm(self, vgm_stream, filename):
-			
-		print("   Writing output VGM file '" + filename + "'")
-
-
-		vgm_stream_length = len(vgm_stream)		
+	# returns bytearray of the GD3 tag for an output VGM, or an empty bytearray if the tag is stripped
+	def gd3_stream(self):
 
 		# build the GD3 data block
 		gd3_data = bytearray()
 		gd3_stream = bytearray()	
-		gd3_stream_length = 0
 		
-		gd3_offset = 0
 		if self.STRIP_GD3 == False:
 			gd3_data.extend(self.gd3_data['title_eng'] + b'\x00\x00')
 			gd3_data.extend(self.gd3_data['title_jap'] + b'\x00\x00')
@@ -792,13 +897,21 @@ class VgmStream:
 			gd3_stream.extend(struct.pack('I', 0x100))				# GD3 version
 			gd3_stream.extend(struct.pack('I', len(gd3_data)))		# GD3 length		
 			gd3_stream.extend(gd3_data)		
-			
-			gd3_offset = (64-20) + vgm_stream_length
-			gd3_stream_length = len(gd3_stream)
 		else:
 			print("   VGM Processing : GD3 tag was stripped")
-		
-		# build the full VGM output stream		
+
+		return gd3_stream
+
+
+	# returns the 64 byte header for an output VGM with vgm_stream_length bytes of commands
+	# loop_offset is the offset of the loop start in the commands, or None if the output doesn't loop
+	# total_samples overrides the source length if the output has been cut
+	def vgm_header(self, vgm_stream_length, gd3_stream_length, loop_offset = None, loop_samples = 0, total_samples = None):
+
+		gd3_offset = 0
+		if gd3_stream_length:
+			gd3_offset = (64-20) + vgm_stream_length
+
 		vgm_data = bytearray()
 		vgm_data.extend(self.vgm_magic_number)
 		vgm_data.extend(struct.pack('I', 64 + vgm_stream_length + gd3_stream_length - 4))				# EoF offset
@@ -806,9 +919,15 @@ class VgmStream:
 		vgm_data.extend(struct.pack('I', self.metadata['sn76489_clock']))
 		vgm_data.extend(struct.pack('I', self.metadata['ym2413_clock']))
 		vgm_data.extend(struct.pack('I', gd3_offset))				# GD3 offset
-		vgm_data.extend(struct.pack('I', self.metadata['total_samples']))				# total samples
-		vgm_data.extend(struct.pack('I', 0)) #self.metadata['loop_offset']))				# loop offset
-		vgm_data.extend(struct.pack('I', 0)) #self.metadata['loop_samples']))				# loop # samples
+		if total_samples is None:
+			total_samples = self.metadata['total_samples']
+		vgm_data.extend(struct.pack('I', total_samples))				# total samples
+		if loop_offset is not None:
+			vgm_data.extend(struct.pack('I', 64 + loop_offset - 0x1c))				# loop offset, relative to this field
+			vgm_data.extend(struct.pack('I', loop_samples))				# loop # samples
+		else:
+			vgm_data.extend(struct.pack('I', 0))				# loop offset
+			vgm_data.extend(struct.pack('I', 0))				# loop # samples
 		vgm_data.extend(struct.pack('I', self.metadata['rate']))				# rate
 		vgm_data.extend(struct.pack('H', self.metadata['sn76489_feedback']))				# sn fb
 		vgm_data.extend(struct.pack('B', self.metadata['sn76489_shift_register_width']))				# SNW	
@@ -819,18 +938,94 @@ class VgmStream:
 		vgm_data.extend(struct.pack('I', 0))				# SEGA PCM clock	
 		vgm_data.extend(struct.pack('I', 0))				# SPCM interface	
 
+		return vgm_data
+
+
+	# write vgm file (with same header data as the input, but from binary register data)
+	# registers is an array of 11 byte arrays, each byte array containing the tune data
+	# loop_offset is the offset of the loop start in vgm_stream, or None if the output doesn't loop
+	# total_samples overrides the source length if the output has been cut
+	def write_vgm(self, vgm_stream, filename, loop_offset = None, loop_samples = 0, total_samples = None):
+			
+		print("   Writing output VGM file '" + filename + "'")
+
+		gd3_stream = self.gd3_stream()
+		
+		# build the full VGM output stream		
+		vgm_data = self.vgm_header(len(vgm_stream), len(gd3_stream), loop_offset, loop_samples, total_samples)
+
 		# attach the vgm data
 		vgm_data.extend(vgm_stream)
 
 		# attach the vgm gd3 tag if required
-		if self.STRIP_GD3 == False:
-			vgm_data.extend(gd3_stream)
+		vgm_data.extend(gd3_stream)
 		
 		# write to output file
 		vgm_file = open(filename, 'wb')
 		vgm_file.write(vgm_data)
 		vgm_file.close()
 		
-		print("   VGM Processing : Written " + str(int(len(vgm_data))) + " bytes, GD3 tag used " + str(gd3_stream_length) + " bytes")
+		print("   VGM Processing : Written " + str(int(len(vgm_data))) + " bytes, GD3 tag used " + str(len(gd3_stream)) + " bytes")
 		
-		print("All done.")	
\ No newline at end of file
+		print("All done.")
+
+
+	# write vgm file from a generator of command chunks, so the commands don't have to be held in memory
+	# chunks are (bytes, samples) pairs, where samples is the wait time in the chunk, and a (None, 0) chunk marks the loop start
+	# the header is written last, once the lengths and loop offset are known
+	def write_vgm_chunks(self, chunks, filename, total_samples = None):
+
+		print("   Writing output VGM file '" + filename + "'")
+
+		vgm_file = open(filename, 'wb')
+		vgm_stream_length = self.write_vgm_stream(chunks, vgm_file, total_samples)
+		vgm_file.close()
+
+		return vgm_stream_length
+
+
+	# write vgm data from a generator of command chunks to an open binary file object, eg. stdout
+	# if the file can't be seeked back to patch the header, the commands are held until the end instead
+	def write_vgm_stream(self, chunks, vgm_file, total_samples = None):
+
+		seekable = vgm_file.seekable()
+		vgm_stream = bytearray()
+		if seekable:
+			header_position = vgm_file.tell()
+			vgm_file.write(bytearray(64))
+
+		vgm_stream_length = 0
+		samples = 0
+		loop_offset = None
+		loop_start_samples = 0
+		for data, chunk_samples in chunks:
+			if data is None:
+				loop_offset = vgm_stream_length
+				loop_start_samples = samples
+				continue
+			if seekable:
+				vgm_file.write(data)
+			else:
+				vgm_stream.extend(data)
+			vgm_stream_length += len(data)
+			samples += chunk_samples
+
+		gd3_stream = self.gd3_stream()
+		vgm_header = self.vgm_header(vgm_stream_length, len(gd3_stream), loop_offset, samples - loop_start_samples, total_samples)
+
+		if seekable:
+			vgm_file.write(gd3_stream)
+			end_position = vgm_file.tell()
+			vgm_file.seek(header_position)
+			vgm_file.write(vgm_header)
+			vgm_file.seek(end_position)
+		else:
+			vgm_file.write(vgm_header)
+			vgm_file.write(vgm_stream)
+			vgm_file.write(gd3_stream)
+
+		print("   VGM Processing : Written " + str(64 + vgm_stream_length + len(gd3_stream)) + " bytes, GD3 tag used " + str(len(gd3_stream)) + " bytes")
+		
+		print("All done.")
+
+		return vgm_stream_length	
\ No newline at end of file
@@ -0,0 +1,462 @@
+#!/usr/bin/env python
+# vgmprofile.py
+# Per stage timing and throughput instrumentation for the VGM conversion
+# By Simon Morris (https://github.com/simondotm/)
+# See https://github.com/simondotm/vgm-packer
+#
+# Copyright (c) 2019 Simon Morris. All rights reserved.
+#
+# "MIT License":
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+import json
+import linecache
+import os
+import time
+import tracemalloc
+
+from contextlib import contextmanager
+
+
+#--------------------------------------------------------------------------------------------------------------
+# Stage profiler
+# The conversion is a pipeline of generators, so the stages run interleaved a frame at a time rather than
+# one after the other. Each stage is timed exclusive of the stages it pulls its input from: the profiler
+# keeps a stack of the running stages, and entering a stage pauses the one below it. So the stage times
+# add up to the total time, whether the stages ran interleaved or in turn.
+#
+# Throughput is given in frames of the tune per second, so that stages working on commands, packets,
+# frames or files can be compared directly.
+#
+# The Chrome trace has one track per stage. Stage runs that are less than MERGE_GAP apart are merged
+# into one event (with the time actually spent in the stage in its args), otherwise a streamed tune
+# would make several events per frame for each stage.
+#
+# With memory set, allocations are traced with tracemalloc (which slows everything down a lot more, so
+# don't read much into the timings). Each stage gets the high water mark of the traced heap while it
+# was running, and its retained memory - the growth of the heap from the stage starting to the stage
+# finishing, from one diff of a snapshot taken when the stage first runs and one taken when it is done
+# (when its generator is exhausted or its block exits, or at the end of the conversion for a stage that
+# is entered a frame at a time). Adding up the growth at every switch instead would charge a streaming
+# stage with every item it handed on, however soon the consumer dropped it.
+# Python can't tell what type an allocation is for, so the structures holding the memory are given by
+# allocation site instead, with the line of code that made them: the sites each stage retained, and the
+# sites at the largest heap seen at a stage switch (a snapshot is taken whenever the heap has grown by
+# SNAPSHOT_GROWTH since the last one) and at the end of the conversion.
+#--------------------------------------------------------------------------------------------------------------
+
+class StageProfiler:
+
+	ROOT = "process"		# stage that time outside any other stage is charged to
+	MERGE_GAP = 0.001		# seconds
+	SNAPSHOT_GROWTH = 1.1	# heap growth before the largest heap is snapshotted again
+	TOP_SITES = 10			# allocation sites to report
+	STAGE_SITES = 3			# allocation sites to report for each stage's retained memory
+
+	VERBOSE = False
+
+
+	def __init__(self, source = None, memory = False):
+
+		self.source = source
+		self.memory = memory
+		self.frames = 0			# frames in the tune, set by the caller
+		self.stages = {}		# name : totals, in the order the stages first ran
+		self.sources = {}		# name : name of the stage whose output is this stage's input
+		self.stack = []			# [ name, wall start, cpu start ] of the running stages
+		self.pending = {}		# name : [ start, end, wall ] of the trace event being merged
+		self.events = []
+
+		self.start_wall = time.perf_counter()
+		self.start_cpu = time.process_time()
+		self.end_wall = None
+		self.end_cpu = None
+
+		self.tracing = False
+		self.peak = 0			# largest traced heap seen
+		self.snapshot_size = 0	# traced heap when the peak sites were snapshotted
+		self.peak_sites = []
+		self.retained_sites = []
+		self.held = 0			# bytes of the snapshots kept for the open stages
+		if memory and not tracemalloc.is_tracing():
+			tracemalloc.start()
+			self.tracing = True
+
+		self.begin(self.ROOT)
+
+
+	def get_stage(self, name):
+
+		stage = self.stages.get(name)
+		if stage is None:
+			stage = self.stages[name] = { 'wall': 0.0, 'cpu': 0.0, 'items': 0, 'bytes_in': 0, 'bytes_out': 0, 'peak': 0, 'retained': 0, 'sites': [], 'opened': None, 'held': 0 }
+		return stage
+
+
+	# snapshot the heap when a stage first runs (or runs again after it was closed)
+	# the snapshot object is counted in the traced heap while it is kept, so it is left out of the peaks
+	def open(self, stage):
+
+		if self.memory and stage['opened'] is None:
+			before = tracemalloc.get_traced_memory()[0]
+			stage['opened'] = self.get_snapshot(False)
+			stage['held'] = tracemalloc.get_traced_memory()[0] - before
+			self.held += stage['held']
+
+
+	# charge a stage that is done with the growth of the heap since it was opened
+	def close(self, name):
+
+		stage = self.stages[name]
+		if stage['opened'] is None:
+			return
+		diff = self.get_snapshot().compare_to(self.filter(stage['opened']), 'lineno')
+		stage['opened'] = None
+		self.held -= stage['held']
+		stage['retained'] += sum(stat.size_diff for stat in diff)
+		diff.sort(key = lambda stat: stat.size_diff, reverse = True)
+		stage['sites'] = [ self.get_site(stat.traceback[0], stat.size_diff, stat.count_diff) for stat in diff[:self.STAGE_SITES] if stat.size_diff > 0 ]
+		if self.VERBOSE: print("Memory : " + name + " retained " + str(stage['retained']))
+
+
+	# read the clocks at a stage switch, and charge the running stage
+	# returns (wall, cpu) times
+	# the traced memory is read first and the peak for the next stage is reset last (in resume()),
+	# so that the profiler's own allocations in between are not charged to any stage
+	def pause(self):
+
+		memory = tracemalloc.get_traced_memory() if self.memory else None
+		wall = time.perf_counter()
+		cpu = time.process_time()
+		if len(self.stack):
+			self.charge(wall, cpu, memory)
+		return wall, cpu
+
+
+	# start charging the stage on top of the stack with the high water mark of the heap from now on
+	def resume(self):
+
+		if self.memory:
+			tracemalloc.reset_peak()
+
+
+	# charge the running stage with the time and memory since it was last resumed
+	def charge(self, wall, cpu, memory):
+
+		entry = self.stack[-1]
+		name = entry[0]
+		stage = self.get_stage(name)
+		stage['wall'] += wall - entry[1]
+		stage['cpu'] += cpu - entry[2]
+
+		if self.memory:
+			current, peak = [ size - self.held for size in memory ]
+			stage['peak'] = max(stage['peak'], peak)
+			self.peak = max(self.peak, peak)
+			if current > self.snapshot_size * self.SNAPSHOT_GROWTH:
+				self.snapshot_size = current
+				self.peak_sites = self.get_sites()
+
+		# extend the stage's pending trace event, or start a new one
+		# (not when tracing memory, as the trace would be skewed and the events would be counted in the heap)
+		event = self.pending.get(name)
+		if self.memory:
+			pass
+		elif event is not None and entry[1] - event[1] <= self.MERGE_GAP:
+			event[1] = wall
+			event[2] += wall - entry[1]
+		else:
+			if event is not None:
+				self.add_event(name, event)
+			self.pending[name] = [ entry[1], wall, wall - entry[1] ]
+
+
+	def add_event(self, name, event):
+
+		start, end, wall = event
+		self.events.append({
+			'name': name,
+			'cat': 'stage',
+			'ph': 'X',
+			'ts': int((start - self.start_wall) * 1000000),
+			'dur': int((end - start) * 1000000),
+			'pid': 1,
+			'tid': list(self.stages.keys()).index(name) + 1,
+			'args': { 'wall_ms': wall * 1000 },
+		})
+
+
+	# enter a stage, pausing the running one
+	def begin(self, name):
+
+		wall, cpu = self.pause()
+		self.open(self.get_stage(name))
+		self.stack.append( [ name, wall, cpu ] )
+		self.resume()
+
+
+	# leave the running stage, counting the items and bytes it consumed and produced, and resume the one below it
+	# done closes the stage, when it won't run again
+	def end(self, bytes_in = 0, bytes_out = 0, items = 1, done = False):
+
+		wall, cpu = self.pause()
+		name = self.stack.pop()[0]
+		stage = self.stages[name]
+		stage['items'] += items
+		stage['bytes_in'] += bytes_in
+		stage['bytes_out'] += bytes_out
+		if done:
+			self.close(name)
+		if len(self.stack):
+			self.stack[-1][1] = wall
+			self.stack[-1][2] = cpu
+			self.resume()
+
+
+	# count extra bytes for a stage, eg. once its output files have been written
+	def add(self, name, bytes_in = 0, bytes_out = 0):
+
+		stage = self.get_stage(name)
+		stage['bytes_in'] += bytes_in
+		stage['bytes_out'] += bytes_out
+
+
+	@contextmanager
+	def stage(self, name):
+
+		self.begin(name)
+		try:
+			yield
+		finally:
+			self.end(items = 0, done = True)
+
+
+	# wrap a generator stage, timing the production of each item
+	# size(item) returns the output bytes of the item, and size_in(item) the input bytes it was made from
+	# source is the stage whose output bytes are (also) this stage's input bytes
+	def iter(self, name, iterable, size = None, source = None, size_in = None):
+
+		if source is not None:
+			self.sources[name] = source
+		items = iter(iterable)
+		while True:
+			self.begin(name)
+			try:
+				item = next(items)
+			except StopIteration:
+				self.end(items = 0, done = True)
+				return
+			except:
+				self.end(items = 0, done = True)
+				raise
+			self.end(size_in(item) if size_in is not None else 0, size(item) if size is not None else 0)
+			yield item
+			# let go of the item while still in the consumer's stage, so a consumer that drops the items
+			# it is handed is the one charged with freeing them
+			item = None
+
+
+	# returns the number of items a stage has produced
+	def items(self, name):
+		return self.get_stage(name)['items']
+
+
+	# stop the clock, ending the root stage and any stages left running by an exception,
+	# and closing the stages that are still open
+	def finish(self):
+
+		if self.end_wall is not None:
+			return
+		while len(self.stack):
+			self.end(items = 0, done = True)
+		self.end_wall = time.perf_counter()
+		self.end_cpu = time.process_time()
+		if self.memory:
+			for name in self.stages.keys():
+				self.close(name)
+			self.retained_sites = self.get_sites()
+			if self.tracing:
+				tracemalloc.stop()
+				self.tracing = False
+		for name, event in self.pending.items():
+			self.add_event(name, event)
+		self.pending = {}
+		self.events.sort(key = lambda e: e['ts'])
+
+
+	# returns a snapshot of the traced heap
+	# the traces of a snapshot aren't traced themselves, but filtering them makes a traced copy, so a snapshot
+	# that is kept while the conversion runs is only filtered once it is used
+	def get_snapshot(self, filtered = True):
+
+		snapshot = tracemalloc.take_snapshot()
+		if not filtered:
+			return snapshot
+		return self.filter(snapshot)
+
+
+	# leave out the profiler's own allocations
+	def filter(self, snapshot):
+
+		return snapshot.filter_traces([
+			tracemalloc.Filter(False, tracemalloc.__file__),
+			tracemalloc.Filter(False, __file__),
+		])
+
+
+	def get_site(self, frame, size, count):
+
+		return { 'filename': frame.filename, 'lineno': frame.lineno, 'size': size, 'count': count }
+
+
+	# returns the TOP_SITES allocation sites holding the most traced memory
+	def get_sites(self):
+
+		return [ self.get_site(stat.traceback[0], stat.size, stat.count) for stat in self.get_snapshot().statistics('lineno')[:self.TOP_SITES] ]
+
+
+	# returns sites with their file:line and the line of code, which are only looked up once the
+	# tracing is over, since the source file cache would be counted in the heap
+	def describe_sites(self, sites):
+
+		return [ {
+			'site': os.path.relpath(site['filename']) + ":" + str(site['lineno']),
+			'code': linecache.getline(site['filename'], site['lineno']).strip(),
+			'size': site['size'],
+			'count': site['count'],
+		} for site in sites ]
+
+
+	#----------------------------------------------------------
+	# Reports
+	#----------------------------------------------------------
+
+	def report(self):
+
+		self.finish()
+		wall = self.end_wall - self.start_wall
+		cpu = self.end_cpu - self.start_cpu
+
+		stages = []
+		for name, stage in self.stages.items():
+			bytes_in = stage['bytes_in']
+			if self.sources.get(name) in self.stages:
+				bytes_in += self.stages[self.sources[name]]['bytes_out']
+			stages.append({
+				'name': name,
+				'wall_ms': stage['wall'] * 1000,
+				'cpu_ms': stage['cpu'] * 1000,
+				'fps': self.frames / stage['wall'] if stage['wall'] > 0 else 0.0,
+				'items': stage['items'],
+				'bytes_in': bytes_in,
+				'bytes_out': stage['bytes_out'],
+			})
+
+		return {
+			'source': self.source,
+			'frames': self.frames,
+			'wall_ms': wall * 1000,
+			'cpu_ms': cpu * 1000,
+			'fps': self.frames / wall if wall > 0 else 0.0,
+			'stages': stages,
+		}
+
+
+	# print the stage table to the log and return the report
+	def print_report(self):
+
+		report = self.report()
+		print("Profile : " + str(report['frames']) + " frames in " + "%.1f" % report['wall_ms'] + "ms (" + "%.1f" % report['cpu_ms'] + "ms CPU), " + "%.0f" % report['fps'] + " frames/s")
+		print("Profile : " + "stage".ljust(16) + "wall ms".rjust(10) + "cpu ms".rjust(10) + "%".rjust(6) + "frames/s".rjust(12) + "bytes in".rjust(12) + "bytes out".rjust(12))
+		for stage in report['stages']:
+			share = 100.0 * stage['wall_ms'] / report['wall_ms'] if report['wall_ms'] > 0 else 0.0
+			print("Profile : " + stage['name'].ljust(16) + ("%.1f" % stage['wall_ms']).rjust(10) + ("%.1f" % stage['cpu_ms']).rjust(10) + ("%.1f" % share).rjust(6) + ("%.0f" % stage['fps']).rjust(12) + str(stage['bytes_in']).rjust(12) + str(stage['bytes_out']).rjust(12))
+		return report
+
+
+	def memory_report(self):
+
+		self.finish()
+		stages = []
+		for name, stage in self.stages.items():
+			stages.append({
+				'name': name,
+				'peak': stage['peak'],
+				'retained': stage['retained'],
+				'retained_sites': self.describe_sites(stage['sites']),
+			})
+
+		return {
+			'source': self.source,
+			'frames': self.frames,
+			'peak': self.peak,
+			'largest_heap': self.snapshot_size,
+			'stages': stages,
+			'peak_sites': self.describe_sites(self.peak_sites),
+			'retained_sites': self.describe_sites(self.retained_sites),
+		}
+
+
+	# print the memory tables to the log and return the memory report
+	def print_memory_report(self):
+
+		kb = lambda size: "%.1f" % (size / 1024.0)
+		report = self.memory_report()
+		print("Memory : peak " + kb(report['peak']) + "KB traced for " + str(report['frames']) + " frames")
+		if len(report['peak_sites']) and self.snapshot_size > 0:
+			site = report['peak_sites'][0]
+			print("Memory : " + "%.0f" % (100.0 * site['size'] / self.snapshot_size) + "% of the largest heap (" + kb(self.snapshot_size) + "KB) was allocated by " + site['site'] + "  " + site['code'])
+		print("Memory : " + "stage".ljust(16) + "peak KB".rjust(12) + "retained KB".rjust(14))
+		for stage in report['stages']:
+			print("Memory : " + stage['name'].ljust(16) + kb(stage['peak']).rjust(12) + kb(stage['retained']).rjust(14))
+		for title, sites in [ ("at the largest heap", report['peak_sites']), ("at the end", report['retained_sites']) ]:
+			print("Memory : largest allocation sites " + title)
+			for site in sites:
+				print("Memory : " + kb(site['size']).rjust(10) + "KB " + str(site['count']).rjust(8) + " blocks  " + site['site'] + "  " + site['code'])
+		return report
+
+
+	def write_memory_report(self, filename):
+
+		report_file = open(filename, 'w')
+		json.dump(self.memory_report(), report_file, indent = 1)
+		report_file.close()
+
+
+	def write_report(self, filename):
+
+		report_file = open(filename, 'w')
+		json.dump(self.report(), report_file, indent = 1)
+		report_file.close()
+
+
+	# Chrome trace event format, for chrome://tracing or https://ui.perfetto.dev
+	def write_trace(self, filename):
+
+		self.finish()
+		events = []
+		for tid, name in enumerate(self.stages.keys()):
+			events.append({ 'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid + 1, 'args': { 'name': name } })
+			events.append({ 'name': 'thread_sort_index', 'ph': 'M', 'pid': 1, 'tid': tid + 1, 'args': { 'sort_index': tid } })
+		events.append({ 'name': 'process_name', 'ph': 'M', 'pid': 1, 'tid': 0, 'args': { 'name': str(self.source) } })
+
+		trace_file = open(filename, 'w')
+		json.dump({ 'traceEvents': events + self.events, 'displayTimeUnit': 'ms' }, trace_file)
+		trace_file.close()
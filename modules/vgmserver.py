@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# vgmserver.py
+# JSON-lines request server with a warm pool of worker processes
+# By Simon Morris (https://github.com/simondotm/)
+# See https://github.com/simondotm/vgm-packer
+#
+# Copyright (c) 2019 Simon Morris. All rights reserved.
+#
+# "MIT License":
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+import json
+import os
+import socketserver
+import threading
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+
+#--------------------------------------------------------------------------------------------------------------
+# JSON-lines protocol
+# Each request is one line of JSON, and gets one line of JSON back once it has been handled. Requests are
+# handled in parallel, so replies can come back in a different order - a request can include an "id" of
+# any type, which is copied to its reply.
+#
+#  reply	- { "id": <id>, "ok": true, ...handler results..., "total_ms": <n> }
+#			  { "id": <id>, "ok": false, "error": "<message>", "total_ms": <n> }
+#
+# total_ms is the time from the request being read to its reply, including any time spent queued for a worker.
+# The handler is called in a worker process, which stays running between requests, so each request only pays
+# for its own work rather than interpreter startup and imports.
+#--------------------------------------------------------------------------------------------------------------
+
+class JsonLinesServer:
+
+	VERBOSE = False
+
+
+	# handler(request) is called with each request dict in a worker process and returns a dict of results
+	# it must be a module level function so it can be sent to the workers
+	# initializer() is called once in each worker process when it starts
+	def __init__(self, handler, jobs = None, initializer = None):
+
+		self.handler = handler
+		self.executor = ProcessPoolExecutor(max_workers = jobs, initializer = initializer)
+
+
+	def close(self):
+		self.executor.shutdown()
+
+
+	# handle one request line, calling reply(response) once it is done
+	# returns a threading.Event that is set once the reply has been made
+	def submit(self, line, reply):
+
+		received = time.time()
+		replied = threading.Event()
+
+		def respond(response):
+			response['total_ms'] = int((time.time() - received) * 1000)
+			reply(response)
+			replied.set()
+
+		try:
+			request = json.loads(line)
+			if not isinstance(request, dict):
+				raise ValueError("request must be a JSON object")
+		except ValueError as e:
+			respond({ 'id': None, 'ok': False, 'error': "Bad request - " + str(e) })
+			return replied
+
+		if self.VERBOSE: print("Request " + str(request.get('id')))
+
+		def done(future):
+			response = { 'id': request.get('id') }
+			try:
+				response.update(future.result())
+				response['ok'] = True
+			except Exception as e:
+				response['ok'] = False
+				response['error'] = str(e)
+			respond(response)
+
+		future = self.executor.submit(self.handler, request)
+		future.add_done_callback(done)
+		return replied
+
+
+	# serve requests read from a text stream, eg. stdin, with replies written to another, eg. stdout
+	# returns once the input ends and every request has been replied to
+	def serve_stream(self, infile, outfile):
+
+		lock = threading.Lock()
+		def reply(response):
+			with lock:
+				outfile.write(json.dumps(response) + "\n")
+				outfile.flush()
+
+		pending = []
+		for line in infile:
+			if len(line.strip()) == 0:
+				continue
+			pending.append(self.submit(line, reply))
+		for replied in pending:
+			replied.wait()
+
+
+	# serve requests from clients connecting to a Unix socket at path, until interrupted
+	# each connection is a stream of request lines, replied to on the same connection
+	def serve_unix(self, path):
+
+		server = self
+
+		class Handler(socketserver.StreamRequestHandler):
+			def handle(self):
+				lock = threading.Lock()
+				def reply(response):
+					with lock:
+						try:
+							self.wfile.write((json.dumps(response) + "\n").encode('utf-8'))
+							self.wfile.flush()
+						except OSError:
+							# client has gone
+							pass
+
+				pending = []
+				for line in self.rfile:
+					if len(line.strip()) == 0:
+						continue
+					pending.append(server.submit(line.decode('utf-8'), reply))
+				for replied in pending:
+					replied.wait()
+
+		if os.path.exists(path):
+			os.remove(path)
+		unix_server = socketserver.ThreadingUnixStreamServer(path, Handler)
+		print("Listening on '" + path + "'")
+		try:
+			unix_server.serve_forever()
+		finally:
+			unix_server.server_close()
+			os.remove(path)
+
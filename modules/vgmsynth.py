@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# vgmsynth.py
+# Deterministic synthetic SN76489 VGM generator for benchmarks and stress tests
+# By Simon Morris (https://github.com/simondotm/)
+# See https://github.com/simondotm/vgm-packer
+#
+# Copyright (c) 2019 Simon Morris. All rights reserved.
+#
+# "MIT License":
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+import random
+import struct
+import sys
+
+from modules.vgmparser import VgmStream
+
+
+#--------------------------------------------------------------------------------------------------------------
+# Writes made-up but valid SN76489 VGM files of any length, for benchmarks and stress tests that can't
+# (or shouldn't) use real tunes. Every frame makes a random number of register writes, averaging DENSITY:
+# new notes and volume changes on the tone channels, and noise changes if NOISE is set. Everything comes
+# from a random number generator seeded with SEED, so the same settings always give the same file.
+#
+# The output uses the same header and GD3 tag code as the converter's own VGM output, via VgmStream, and
+# the commands are generated a frame at a time, so hours long files don't have to fit in memory.
+#
+# Optional extras:
+#  DUAL_CHIP - sets the dual chip clock flag and sends about half the writes to the second chip (0x30 dd)
+#  IRREGULAR - the fraction of frames whose wait is split in two, with some of the writes in between, or
+#              which are merged with the frames after them into one longer 0x61 wait
+#--------------------------------------------------------------------------------------------------------------
+
+class VgmSynth(VgmStream):
+
+	DURATION = 60.0			# seconds
+	RATE = 50				# frames per second, 50 and 60 use the short wait commands, others 0x61 nn nn
+	DENSITY = 4.0			# average register writes per frame
+	CHANNELS = 3			# number of tone channels used (0-3)
+	ACTIVITY = 0.75			# fraction of notes that are sounding rather than rests
+	NOISE = 0.1				# fraction of writes that go to the noise channel, 0 leaves it silent
+	DUAL_CHIP = False
+	IRREGULAR = 0.0
+	SEED = 0
+
+	CLOCK = 4000000			# BBC Micro SN76489 clock
+	DUAL_CHIP_FLAG = 0x40000000
+	MAX_MERGE = 8			# longest run of frames merged into one wait
+
+
+	# sets up the header metadata and GD3 tag that VgmStream uses to write the output
+	# (there's no source file to parse)
+	def __init__(self, title = "Synthetic"):
+
+		self.vgm_filename = title
+		self.metadata = {
+			'sn76489_clock': self.CLOCK | (self.DUAL_CHIP_FLAG if self.DUAL_CHIP else 0),
+			'ym2413_clock': 0,
+			'total_samples': 0,
+			'rate': self.RATE,
+			'sn76489_feedback': 0x0003,
+			'sn76489_shift_register_width': 15,
+			'ym2612_clock': 0,
+			'ym2151_clock': 0,
+		}
+
+		text = lambda s: s.encode("utf_16_le")
+		self.gd3_data = {
+			'title_eng': text(title),
+			'title_jap': b'',
+			'game_eng': b'',
+			'game_jap': b'',
+			'console_eng': text("BBC Micro"),
+			'console_jap': b'',
+			'artist_eng': text("vgmsynth"),
+			'artist_jap': b'',
+			'date': b'',
+			'vgm_creator': text("vgmsynth"),
+			'notes': text(self.get_settings()),
+		}
+
+
+	# returns a one line description of the settings, for the GD3 notes and the log
+	def get_settings(self):
+
+		return ("duration " + str(self.DURATION) + "s, rate " + str(self.RATE) + "Hz, density " + str(self.DENSITY) +
+			", channels " + str(self.CHANNELS) + ", activity " + str(self.ACTIVITY) + ", noise " + str(self.NOISE) +
+			", dual chip " + str(self.DUAL_CHIP) + ", irregular " + str(self.IRREGULAR) + ", seed " + str(self.SEED))
+
+
+	# returns the number of samples in one frame
+	def get_frame_samples(self):
+		return int(round(self.VGM_FREQUENCY / float(self.RATE)))
+
+
+	# returns the number of frames in the output
+	def get_frames(self):
+		return int(round(self.DURATION * self.RATE))
+
+
+	# returns bytes of the commands for a wait of samples
+	def wait_command(self, samples):
+
+		if samples == 735:
+			return b'\x62'
+		if samples == 882:
+			return b'\x63'
+		if samples <= 16:
+			return bytes([0x70 + samples - 1])
+		return b'\x61' + struct.pack('<H', samples)
+
+
+	# returns bytes of the PSG data for one random register write
+	# state is the [tone, volume] of each of the 4 channels, for the chip being written
+	def random_write(self, rng, state):
+
+		if self.NOISE > 0 and (self.CHANNELS == 0 or rng.random() < self.NOISE):
+			channel = 3
+		elif self.CHANNELS > 0:
+			channel = rng.randrange(self.CHANNELS)
+		else:
+			return b''
+
+		# about half the writes are new notes and half are volume changes (eg. envelopes)
+		if rng.random() < 0.5:
+			if rng.random() < self.ACTIVITY:
+				volume = rng.randrange(15)
+			else:
+				volume = 15
+			state[channel][1] = volume
+			return bytes([0x90 | (channel << 5) | volume])
+
+		if channel == 3:
+			# white or periodic noise, at one of the fixed rates or tone 2's rate
+			tone = rng.randrange(8)
+			state[channel][0] = tone
+			return bytes([0xe0 | tone])
+
+		tone = rng.randrange(1, 1024)
+		state[channel][0] = tone
+		return bytes([0x80 | (channel << 5) | (tone & 15), (tone >> 4) & 63])
+
+
+	# generator for the VGM commands, a frame at a time
+	# yields (bytes, samples) chunks for VgmStream.write_vgm_chunks(), ending with the end of data command
+	def iter_chunks(self):
+
+		rng = random.Random(self.SEED)
+		chips = [ [ [0, 15] for c in range(4) ] for n in range(2 if self.DUAL_CHIP else 1) ]
+		frame_samples = self.get_frame_samples()
+		frames = self.get_frames()
+
+		# start with every channel silent, on each chip
+		data = bytearray()
+		for chip in range(len(chips)):
+			for channel in range(4):
+				data.extend(b'\x30' if chip else b'\x50')
+				data.append(0x9f | (channel << 5))
+		yield (bytes(data), 0)
+
+		frame = 0
+		while frame < frames:
+
+			# random number of writes, averaging DENSITY
+			count = int(self.DENSITY)
+			if rng.random() < self.DENSITY - count:
+				count += 1
+
+			writes = []
+			for n in range(count):
+				chip = 1 if self.DUAL_CHIP and rng.random() < 0.5 else 0
+				for b in self.random_write(rng, chips[chip]):
+					writes.append(b'\x30' if chip else b'\x50')
+					writes.append(bytes([b]))
+
+			split = 0
+			merge = 1
+			if self.IRREGULAR > 0 and rng.random() < self.IRREGULAR:
+				if rng.random() < 0.5:
+					split = rng.randrange(1, frame_samples)
+				else:
+					merge = min(rng.randrange(2, self.MAX_MERGE + 1), frames - frame, 65535 // frame_samples)
+
+			if split:
+				# the wait is cut in two, with the second half of the writes after the first part
+				# writes are in (command, data) pairs, so cut on an even index
+				cut = (len(writes) // 4) * 2
+				yield (b''.join(writes[:cut]) + self.wait_command(split), split)
+				yield (b''.join(writes[cut:]) + self.wait_command(frame_samples - split), frame_samples - split)
+			else:
+				yield (b''.join(writes) + self.wait_command(frame_samples * merge), frame_samples * merge)
+
+			frame += merge
+
+		yield (b'\x66', 0)
+
+
+	# write the synthetic VGM to filename
+	# returns the number of bytes of VGM commands
+	def write(self, filename):
+
+		print("   VGM Synthesis : " + self.get_settings())
+		return self.write_vgm_chunks(self.iter_chunks(), filename, self.get_frames() * self.get_frame_samples())
+
+
+#------------------------------------------------------------------------
+# Main()
+#------------------------------------------------------------------------
+
+import argparse
+
+# Determine if running as a script
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument("output", help="VGM file to write")
+	parser.add_argument("-d", "--duration", type=float, default=VgmSynth.DURATION, metavar="<s>", help="Length in seconds, default: " + str(VgmSynth.DURATION))
+	parser.add_argument("-r", "--rate", type=int, default=VgmSynth.RATE, metavar="<hz>", help="Frames per second, default: " + str(VgmSynth.RATE))
+	parser.add_argument("-w", "--density", type=float, default=VgmSynth.DENSITY, metavar="<n>", help="Average register writes per frame, default: " + str(VgmSynth.DENSITY))
+	parser.add_argument("-c", "--channels", type=int, default=VgmSynth.CHANNELS, choices=range(4), metavar="<n>", help="Number of tone channels used (0-3), default: " + str(VgmSynth.CHANNELS))
+	parser.add_argument("-a", "--activity", type=float, default=VgmSynth.ACTIVITY, metavar="<f>", help="Fraction of notes that sound rather than rest, default: " + str(VgmSynth.ACTIVITY))
+	parser.add_argument("-n", "--noise", type=float, default=VgmSynth.NOISE, metavar="<f>", help="Fraction of writes to the noise channel, 0 for none, default: " + str(VgmSynth.NOISE))
+	parser.add_argument("--dual", help="Write a dual chip VGM", action="store_true")
+	parser.add_argument("-i", "--irregular", type=float, default=VgmSynth.IRREGULAR, metavar="<f>", help="Fraction of frames with split or merged waits, default: " + str(VgmSynth.IRREGULAR))
+	parser.add_argument("-s", "--seed", type=int, default=VgmSynth.SEED, metavar="<n>", help="Random number seed, default: " + str(VgmSynth.SEED))
+	args = parser.parse_args()
+
+	if args.rate <= 0 or VgmSynth.VGM_FREQUENCY // args.rate < 2:
+		print("ERROR: Rate must be between 1 and " + str(VgmSynth.VGM_FREQUENCY // 2) + " Hz")
+		sys.exit(1)
+	if args.duration * VgmSynth.VGM_FREQUENCY >= 2**32:
+		print("ERROR: Duration is too long for a VGM file")
+		sys.exit(1)
+
+	VgmSynth.DURATION = args.duration
+	VgmSynth.RATE = args.rate
+	VgmSynth.DENSITY = args.density
+	VgmSynth.CHANNELS = args.channels
+	VgmSynth.ACTIVITY = args.activity
+	VgmSynth.NOISE = args.noise
+	VgmSynth.DUAL_CHIP = args.dual
+	VgmSynth.IRREGULAR = args.irregular
+	VgmSynth.SEED = args.seed
+
+	VgmSynth().write(args.output)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# vgmwatch.py
+# Watches VGM files and directories for changes, for incremental reconversion
+# By Simon Morris (https://github.com/simondotm/)
+# See https://github.com/simondotm/vgm-packer
+#
+# Copyright (c) 2019 Simon Morris. All rights reserved.
+#
+# "MIT License":
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the Software
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+
+import hashlib
+import os
+import time
+
+
+#--------------------------------------------------------------------------------------------------------------
+# File watcher
+# Polls a set of VGM files and directories (searched recursively) and reports the VGMs that have changed.
+# A file is only hashed when its modification time or size changes, and only reported when its contents
+# have actually changed, so re-saving a tune without edits or touching it doesn't cause a reconversion.
+# Files are hashed a block at a time, so a large VGM is never held in memory to be checked.
+# Polling keeps this dependency free and works the same on every platform.
+#--------------------------------------------------------------------------------------------------------------
+
+class VgmWatcher:
+
+	POLL_INTERVAL = 0.1			# seconds between scans
+	BLOCK_SIZE = 65536			# bytes read at a time when hashing a file
+	EXTENSIONS = [ ".vgm", ".vgz" ]
+	IGNORE = [ ".electron.vgm" ]	# converter outputs, which must not be converted again
+
+	VERBOSE = False
+
+
+	def __init__(self, paths):
+
+		self.paths = paths
+		self.files = {}		# filename -> (mtime, size, digest) when last reported
+
+
+	# returns True if filename is a VGM to watch
+	def is_vgm(self, filename):
+
+		name = filename.lower()
+		for ignore in self.IGNORE:
+			if name.endswith(ignore):
+				return False
+		return os.path.splitext(name)[1] in self.EXTENSIONS
+
+
+	# returns the sorted list of VGM files currently under the watched paths
+	def scan(self):
+
+		files = []
+		for path in self.paths:
+			if os.path.isdir(path):
+				for root, dirs, names in os.walk(path):
+					for name in names:
+						if self.is_vgm(name):
+							files.append(os.path.join(root, name))
+			elif os.path.isfile(path):
+				files.append(path)
+		return sorted(files)
+
+
+	# returns the hash of a file's contents
+	def digest(self, filename):
+
+		h = hashlib.sha1()
+		vgm_file = open(filename, 'rb')
+		while True:
+			block = vgm_file.read(self.BLOCK_SIZE)
+			if len(block) == 0:
+				break
+			h.update(block)
+		vgm_file.close()
+		return h.hexdigest()
+
+
+	# returns the list of VGM files that are new or have changed contents since the last call
+	# the first call returns every file
+	def changed(self):
+
+		changed = []
+		files = {}
+		for filename in self.scan():
+			try:
+				st = os.stat(filename)
+			except OSError:
+				# deleted since the scan
+				continue
+
+			last = self.files.get(filename)
+			if last is not None and last[0] == st.st_mtime and last[1] == st.st_size:
+				files[filename] = last
+				continue
+
+			digest = self.digest(filename)
+			files[filename] = (st.st_mtime, st.st_size, digest)
+			if last is None or last[2] != digest:
+				changed.append(filename)
+			elif self.VERBOSE:
+				print("'" + filename + "' touched but unchanged")
+
+		self.files = files
+		return changed
+
+
+	# call convert(filename) for every VGM, then again for each VGM whenever it changes, until interrupted
+	def watch(self, convert):
+
+		print("Watching " + ", ".join([ "'" + p + "'" for p in self.paths ]) + " for changes, ctrl-c to stop")
+		while True:
+			for filename in self.changed():
+				convert(filename)
+			time.sleep(self.POLL_INTERVAL)
+
@@ -0,0 +1,68 @@
+# conftest.py
+# Lets the tests import vgm2electron and the modules package when pytest is run from anywhere
+
+import glob
+import os
+import random
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+	sys.path.insert(0, ROOT)
+
+EXAMPLES = os.path.join(ROOT, "examples")
+
+
+def load_example(name):
+
+	example_file = open(os.path.join(EXAMPLES, name), 'rb')
+	data = example_file.read()
+	example_file.close()
+	return data
+
+
+# the ULA data of every example, by filename
+def ula_examples():
+
+	return sorted(os.path.basename(f) for f in glob.glob(os.path.join(EXAMPLES, "*.ula.bin")))
+
+
+# random ULA data, from the first values of the 255 ULA values (which are never 0x01)
+def random_ula(rng, size, values = 255):
+
+	choices = [ v for v in range(256) if v != 1 ][:values]
+	return bytearray(rng.choice(choices) for i in range(size))
+
+
+# empty and single frame streams, runs and literals longer than a length field, incompressible data
+def ula_edge_cases():
+
+	rng = random.Random(1)
+	return [ bytearray(), bytearray([0x80]), bytearray([0x33]) * 1000, random_ula(rng, 1000), random_ula(rng, 1000, 3) ]
+
+
+# convert a VGM with the given vgm2electron command line options, as a fixture so that the
+# VgmElectron settings are put back to the defaults after each test
+# returns the output filename
+@pytest.fixture
+def convert(tmp_path):
+
+	import vgm2electron
+
+	def convert(src_filename, options = [], name = "out.electron.vgm"):
+		vgm2electron.apply_args(vgm2electron.get_parser().parse_args(options))
+		dst_filename = str(tmp_path / name)
+		vgm2electron.VgmElectron().process(src_filename, dst_filename)
+		return dst_filename
+
+	yield convert
+	vgm2electron.apply_args(vgm2electron.get_parser().parse_args([]))
+
+
+# returns the number of packets (frames) the parser reads from a VGM file
+def count_packets(filename):
+
+	from modules.vgmparser import VgmStream
+	return sum(1 for packet in VgmStream(filename, True).iter_packets())
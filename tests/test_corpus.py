@@ -0,0 +1,25 @@
+# test_corpus.py
+# Benchmark baseline comparison
+
+from benchmarks.corpus import CorpusBenchmark
+
+
+def result(time, peak_memory, size):
+	return { 'file': "tune.vgm", 'profile': "default", 'time': time, 'peak_memory': peak_memory, 'sizes': { ".ula.bin": size } }
+
+
+def test_compare():
+
+	benchmark = CorpusBenchmark(memory = False)
+	try:
+		baseline = [ result(1.0, 1000, 100) ]
+		assert benchmark.compare([ result(1.1, 1100, 100) ], baseline) == []
+		assert len(benchmark.compare([ result(2.0, 1000, 100) ], baseline)) == 1
+		assert len(benchmark.compare([ result(1.0, 2000, 101) ], baseline)) == 2
+
+		# times from another machine, or a baseline without them, are not compared
+		assert benchmark.compare([ result(2.0, 1000, 100) ], baseline, compare_times = False) == []
+		del baseline[0]['time']
+		assert benchmark.compare([ result(2.0, 1000, 100) ], baseline) == []
+	finally:
+		benchmark.close()
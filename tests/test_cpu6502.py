@@ -0,0 +1,191 @@
+# test_cpu6502.py
+# Opcode behaviour and cycle counts of the 6502 simulator and assembler
+
+import pytest
+
+from modules.cpu6502 import Assembler6502, Cpu6502, OPCODES
+
+
+ORIGIN = 0x0200
+
+
+# assemble source at ORIGIN, followed by an RTS, and call it
+# returns (cpu, cycles taken by the body, excluding the JSR and RTS)
+def run(source, setup = None):
+
+	code, symbols = Assembler6502(ORIGIN).assemble(source + "\n\tRTS\n")
+	cpu = Cpu6502()
+	cpu.load(ORIGIN, code)
+	if setup is not None:
+		setup(cpu)
+	cycles = cpu.call(ORIGIN)
+	return cpu, cycles - 12
+
+
+def test_opcode_table():
+
+	opcodes = [ opcode for modes in OPCODES.values() for (mode, opcode, cycles) in modes ]
+	assert len(opcodes) == 151
+	assert len(set(opcodes)) == 151
+
+
+def test_load_store_and_flags():
+
+	cpu, cycles = run("LDA #0 : STA &70 : LDX #&80 : STX &71 : LDY &70")
+	assert cpu.memory[0x70] == 0 and cpu.memory[0x71] == 0x80
+	assert cpu.y == 0 and cpu.z == 1 and cpu.n == 0
+	assert cycles == 2 + 3 + 2 + 3 + 3
+
+
+@pytest.mark.parametrize("a, value, carry, result, c, v", [
+	(0x50, 0x10, 0, 0x60, 0, 0),
+	(0x50, 0x50, 0, 0xa0, 0, 1),	# positive + positive overflows to negative
+	(0xff, 0x01, 0, 0x00, 1, 0),
+	(0x80, 0xff, 1, 0x80, 1, 0),
+	(0xd0, 0x90, 0, 0x60, 1, 1),	# negative + negative overflows to positive
+])
+def test_adc(a, value, carry, result, c, v):
+
+	cpu, cycles = run(("SEC" if carry else "CLC") + " : LDA #" + str(a) + " : ADC #" + str(value))
+	assert (cpu.a, cpu.c, cpu.v) == (result, c, v)
+
+
+@pytest.mark.parametrize("a, value, result, c", [
+	(0x50, 0x10, 0x40, 1),
+	(0x10, 0x20, 0xf0, 0),	# borrow clears carry
+	(0x20, 0x20, 0x00, 1),
+])
+def test_sbc(a, value, result, c):
+
+	cpu, cycles = run("SEC : LDA #" + str(a) + " : SBC #" + str(value))
+	assert (cpu.a, cpu.c, cpu.z) == (result, c, 1 if result == 0 else 0)
+
+
+def test_compare():
+
+	cpu, cycles = run("LDA #&40 : CMP #&40")
+	assert (cpu.c, cpu.z, cpu.n) == (1, 1, 0)
+	cpu, cycles = run("LDX #&10 : CPX #&20")
+	assert (cpu.c, cpu.z, cpu.n) == (0, 0, 1)
+
+
+def test_shifts_and_rotates():
+
+	cpu, cycles = run("LDA #&81 : ASL A")
+	assert (cpu.a, cpu.c) == (0x02, 1)
+	cpu, cycles = run("LDA #&81 : LSR A")
+	assert (cpu.a, cpu.c) == (0x40, 1)
+	cpu, cycles = run("SEC : LDA #&80 : ROL A")
+	assert (cpu.a, cpu.c) == (0x01, 1)
+	cpu, cycles = run("SEC : LDA #&01 : ROR A")
+	assert (cpu.a, cpu.c) == (0x80, 1)
+	cpu, cycles = run("LDA #&40 : STA &70 : ASL &70")
+	assert (cpu.memory[0x70], cpu.n) == (0x80, 1)
+
+
+def test_inc_dec_wrap():
+
+	cpu, cycles = run("LDX #&ff : INX : LDY #0 : DEY : DEC &70")
+	assert (cpu.x, cpu.y, cpu.memory[0x70]) == (0, 0xff, 0xff)
+
+
+def test_bit():
+
+	cpu, cycles = run("LDA #&c0 : STA &70 : LDA #&01 : BIT &70")
+	assert (cpu.n, cpu.v, cpu.z) == (1, 1, 1)
+
+
+def test_stack():
+
+	cpu, cycles = run("LDA #&12 : PHA : LDA #0 : PLA : SEC : PHP : CLC : PLP")
+	assert (cpu.a, cpu.c, cpu.sp) == (0x12, 1, 0xff)
+
+
+def test_jsr_rts():
+
+	cpu, cycles = run("JSR sub : LDX #1 : JMP done\n.sub\n\tLDY #2 : RTS\n.done")
+	assert (cpu.x, cpu.y) == (1, 2)
+	assert cycles == 6 + 2 + 6 + 2 + 3
+
+
+def test_branch_cycles():
+
+	# not taken, taken
+	cpu, cycles = run("LDA #1 : BEQ skip : BNE skip\n.skip")
+	assert cycles == 2 + 2 + 3
+
+
+def test_branch_page_cross():
+
+	# a taken branch to another page costs one more cycle
+	# the BEQ ends at &02FF and skip is at &0300
+	source = "\n".join([ "\tNOP" ] * 251) + "\n\tLDA #0 : BEQ skip : NOP\n.skip"
+	code, symbols = Assembler6502(ORIGIN).assemble(source)
+	assert symbols['skip'] == 0x0300
+	cpu, cycles = run(source)
+	assert cycles == 251 * 2 + 2 + 4
+
+
+def test_index_page_penalty():
+
+	def setup(cpu):
+		cpu.memory[0x1100] = 0x42
+		cpu.memory[0x10ff] = 0x24
+
+	cpu, cycles = run("LDX #&01 : LDA &10ff,X", setup)
+	assert cpu.a == 0x42
+	assert cycles == 2 + 5
+	cpu, cycles = run("LDX #&00 : LDA &10ff,X", setup)
+	assert cpu.a == 0x24
+	assert cycles == 2 + 4
+
+	# stores always take the extra cycle, crossing a page or not
+	cpu, cycles = run("LDX #&00 : STA &1000,X")
+	assert cycles == 2 + 5
+
+
+def test_indirect_y():
+
+	def setup(cpu):
+		cpu.memory[0x70:0x72] = bytearray([ 0xf0, 0x10 ])
+		cpu.memory[0x1100] = 0x99
+
+	cpu, cycles = run("LDY #&10 : LDA (&70),Y", setup)
+	assert cpu.a == 0x99
+	assert cycles == 2 + 6
+
+
+def test_jmp_indirect_page_bug():
+
+	# the NMOS 6502 fetches the high byte of the vector from the start of the same page
+	def setup(cpu):
+		cpu.memory[0x12ff] = 0x00
+		cpu.memory[0x1200] = 0x03
+		cpu.memory[0x1300] = 0x04
+		cpu.memory[0x0300] = 0x60	# RTS
+		cpu.memory[0x0400] = 0x02	# illegal, if the vector were fetched from &1300
+
+	cpu, cycles = run("LDX #7 : JMP (&12ff)", setup)
+	assert cpu.x == 7
+
+
+def test_io_writes():
+
+	cpu, cycles = run("LDA #&55 : STA &FE06 : STA &0E06")
+	assert [ (address, value) for (cycle, address, value) in cpu.io_writes ] == [ (0xfe06, 0x55) ]
+
+
+def test_illegal_opcode():
+
+	cpu = Cpu6502()
+	cpu.memory[ORIGIN] = 0x02
+	with pytest.raises(RuntimeError):
+		cpu.call(ORIGIN)
+
+
+def test_assembler_errors():
+
+	with pytest.raises(ValueError):
+		Assembler6502(ORIGIN).assemble("LDA missing")
+	with pytest.raises(ValueError):
+		Assembler6502(ORIGIN).assemble("FOO #1")
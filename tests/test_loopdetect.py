@@ -0,0 +1,125 @@
+# test_loopdetect.py
+# Loop detection on frame rows, and the loop marker in the converter outputs
+
+import random
+import struct
+
+import pytest
+
+from modules.loopdetect import LoopDetector
+
+
+# rows of 11 register values, all different
+def random_rows(rng, count):
+	return [ bytearray(rng.randrange(256) for r in range(11)) for i in range(count) ]
+
+
+def test_tune_played_twice():
+
+	rng = random.Random(1)
+	intro = random_rows(rng, 30)
+	body = random_rows(rng, 100)
+	assert LoopDetector().detect(intro + body + body + body[:40]) == (130, 30)
+
+
+# loop periods are rounded up to a multiple of PERIOD_STEP, as long as the tune repeats for long enough
+def test_period_step():
+
+	rng = random.Random(5)
+	body = random_rows(rng, 100)
+	detector = LoopDetector()
+	detector.PERIOD_STEP = 6
+	end, loop_start = detector.detect(body * 5)
+	assert (end - loop_start) == 300
+	assert detector.detect(body * 2) is None
+
+
+def test_trailing_silence():
+
+	rng = random.Random(2)
+	body = random_rows(rng, 80)
+	silence = [ bytearray(11) ] * 25
+	assert LoopDetector().detect(body + body + silence) == (80, 0)
+
+
+def test_no_loop():
+
+	rng = random.Random(3)
+	assert LoopDetector().detect(random_rows(rng, 500)) is None
+	# a held note repeats, but isn't a loop
+	assert LoopDetector().detect([ bytearray([1] * 11) ] * 500) is None
+
+
+def test_tolerance():
+
+	rng = random.Random(4)
+	body = random_rows(rng, 100)
+	repeat = [ bytearray(row) for row in body ]
+	repeat[50][0] ^= 0xff
+	detector = LoopDetector()
+	assert detector.detect(body + repeat) != (100, 0)
+	detector.TOLERANCE = 1
+	assert detector.detect(body + repeat) == (100, 0)
+
+
+def read_file(filename):
+
+	f = open(filename, 'rb')
+	data = f.read()
+	f.close()
+	return data
+
+
+# a synthetic tune with a 100 frame body (not a multiple of the 6 frame arpeggiator cycle) played 5 times
+def write_repeated_synth(filename):
+
+	from modules.vgmsynth import VgmSynth
+	synth = VgmSynth()
+	synth.DURATION = 2.0
+	synth.NOISE = 0.0
+	chunks = list(synth.iter_chunks())
+	body = chunks[1:-1]
+	synth.write_vgm_chunks([ chunks[0] ] + body * 5 + [ chunks[-1] ], filename, synth.get_frames() * synth.get_frame_samples() * 5)
+
+
+# a repeating tune is cut to one iteration, and the encoded ULA files end with the same loop marker
+# as the .ula.bin
+def test_loop_marker(convert, tmp_path):
+
+	src = str(tmp_path / "repeated.vgm")
+	write_repeated_synth(src)
+	dst = convert(src, [ "-l", "-z", "-r", "-p" ])
+	ula_data = read_file(dst + ".ula.bin")
+	marker, loop_frame = struct.unpack('<BH', ula_data[-3:])
+	assert marker == 0x01
+
+	from modules.ulacodecs import CODECS
+	for name in [ 'lz', 'rle', 'pat' ]:
+		codec = CODECS[name]()
+		encoded = read_file(dst + codec.EXTENSION)
+		assert encoded[-3:] == ula_data[-3:]
+		assert codec.decompress(encoded) == ula_data[:-3]
+
+
+# played in a loop, the cut output matches the whole tune converted without loop detection, byte for byte
+@pytest.mark.parametrize("technique", [ "1", "2" ])
+def test_cut_output_loops_exactly(convert, tmp_path, technique):
+
+	src = str(tmp_path / "repeated.vgm")
+	write_repeated_synth(src)
+	whole = read_file(convert(src, [ "-q", technique ], "whole.electron.vgm") + ".ula.bin")
+	assert whole[-3:] == b'\x01\xff\xff'
+	whole = whole[:-3]
+	cut = read_file(convert(src, [ "-q", technique, "-l" ], "cut.electron.vgm") + ".ula.bin")
+
+	marker, loop_frame = struct.unpack('<BH', cut[-3:])
+	assert marker == 0x01
+	cut = cut[:-3]
+	period = len(cut) - loop_frame
+	assert period % 6 == 0 or (technique == "1" and period % 2 == 0)
+	assert period % 100 == 0
+
+	played = bytearray(cut)
+	while len(played) < len(whole):
+		played.extend(cut[loop_frame:])
+	assert played[:len(whole)] == whole
@@ -0,0 +1,40 @@
+# test_packetcompress.py
+# Packet dictionary compressor round trips
+
+import os
+
+import pytest
+
+from conftest import EXAMPLES
+from modules.packetcompress import PacketCompressor
+from modules.vgmparser import VgmStream
+
+
+@pytest.mark.parametrize("window_size", [ 64, 2048 ])
+def test_round_trip(window_size):
+
+	data_block = VgmStream(os.path.join(EXAMPLES, "Repton-ingame.electron.vgm"), True).as_binary(False)
+	compressor = PacketCompressor(window_size)
+	output_stream = compressor.compress(data_block)
+	assert len(output_stream) < len(data_block)
+	assert compressor.decompress(output_stream) == data_block
+
+
+# long packets, repeats of every length and an empty stream
+def test_round_trip_edge_cases():
+
+	compressor = PacketCompressor(32)
+	for packets in [ [], [ bytes(range(127)) ], [ bytes([n]) * n for n in range(20) ] * 3 ]:
+		data_block = bytearray()
+		for packet in packets:
+			data_block.append(len(packet))
+			data_block.extend(packet)
+		data_block.append(0xff)
+		assert compressor.decompress(compressor.compress(data_block)) == data_block
+
+
+@pytest.mark.parametrize("window_size", [ 16, 100, 4096 ])
+def test_bad_window(window_size):
+
+	with pytest.raises(ValueError):
+		PacketCompressor(window_size)
@@ -0,0 +1,38 @@
+# test_ulabench.py
+# Encoder benchmark results and failures
+
+import os
+
+from conftest import EXAMPLES
+from modules.ulabench import UlaBenchmark
+from modules.ulacodecs import CODECS
+
+
+FILENAME = os.path.join(EXAMPLES, "Repton-ingame.electron.vgm.ula.bin")
+
+
+def test_run_file():
+
+	results = UlaBenchmark(repeats = 1).run_file(FILENAME)
+	assert [ r['codec'] for r in results ] == list(CODECS.keys())
+	assert all(r['verified'] and r['error'] is None for r in results)
+
+
+# an encoder that can't encode a file is reported as failed, and the other encoders still run
+def test_failed_encoder(monkeypatch):
+
+	def compress(self, ula_data):
+		raise ValueError("Can't encode")
+	monkeypatch.setattr(CODECS['lz'], "compress", compress)
+
+	benchmark = UlaBenchmark([ 'raw', 'lz', 'rle' ], 1)
+	results = benchmark.run([ FILENAME, FILENAME ], 1)
+	assert [ r['codec'] for r in results ] == [ 'raw', 'lz', 'rle' ] * 2
+	failed = [ r for r in results if r['codec'] == 'lz' ]
+	assert all(r['error'] == "Can't encode" and not r['verified'] for r in failed)
+	assert all(r['verified'] for r in results if r['codec'] != 'lz')
+
+	totals = { t['codec'] : t for t in benchmark.totals(results) }
+	assert totals['lz']['failed'] == 2 and not totals['lz']['verified']
+	assert totals['rle']['failed'] == 0 and totals['rle']['verified']
+	assert "failed: Can't encode" in benchmark.markdown(results)
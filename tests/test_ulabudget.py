@@ -0,0 +1,80 @@
+# test_ulabudget.py
+# Budget selection costs and fallbacks
+
+from conftest import load_example
+from modules.ulabudget import UlaBudgetSelector
+from modules.ulaplayers import UlaPlayerSimulator
+
+
+ULA_DATA = load_example("Repton-ingame.electron.vgm.ula.bin")
+
+
+def test_lz_charges_history_page():
+
+	selector = UlaBudgetSelector()
+	result = selector.trial('lz', { 'WINDOW_SIZE' : 256 }, ULA_DATA)
+	player_size = len(selector.simulator.assemble('lz')[0])
+	assert result['ram'] == result['encoded_size'] + player_size + 256
+	assert result['exact_cycles']
+
+
+def test_selection_fits_budgets():
+
+	selector = UlaBudgetSelector()
+	best, fits, results = selector.select(ULA_DATA, 2048, 400)
+	assert fits
+	assert best['ram'] <= 2048 and best['cycles'] <= 400
+	assert best['ram'] == min([ r['ram'] for r in results if r['ram'] <= 2048 and r['cycles'] <= 400 ])
+
+
+def test_unsimulated_cycles_do_not_fit(monkeypatch):
+
+	# as if every encoding were too big to simulate
+	def run(self, name, data):
+		raise ValueError("Encoded stream is too big to simulate")
+	monkeypatch.setattr(UlaPlayerSimulator, "run", run)
+
+	selector = UlaBudgetSelector()
+	best, fits, results = selector.select(ULA_DATA, None, 10000)
+	assert not any(r['exact_cycles'] for r in results)
+	assert not fits
+
+	# without a cycle budget the modelled cycles don't matter
+	best, fits, results = selector.select(ULA_DATA, 1000000, None)
+	assert fits
+
+
+def test_failed_candidate_is_skipped(monkeypatch):
+
+	selector = UlaBudgetSelector()
+	codec_class = type(selector.get_codec('rle', {}))
+	def compress(self, ula_data):
+		raise ValueError("Can't encode")
+	monkeypatch.setattr(codec_class, "compress", compress)
+
+	best, fits, results = selector.select(ULA_DATA, 1000000, None)
+	assert fits
+	assert 'rle' not in [ r['codec'] for r in results ]
+
+
+# the wider palette modes and raw mode are bigger, but each takes fewer cycles in the worst frame
+def test_palette_modes_trade_size_for_cycles():
+
+	selector = UlaBudgetSelector()
+	palette, wide, raw = [ selector.trial('rle', params, ULA_DATA) for params in [ {}, { 'MODE' : 'wide' }, { 'MODE' : 'raw' } ] ]
+	assert palette['ram'] < wide['ram'] and palette['ram'] < raw['ram']
+	assert palette['cycles'] > wide['cycles'] > raw['cycles']
+
+	best, fits, results = selector.select(ULA_DATA, None, raw['cycles'])
+	assert fits
+	assert best['cycles'] <= raw['cycles']
+
+
+# a mode that the palette doesn't fit can't be a candidate
+def test_palette_mode_too_small():
+
+	selector = UlaBudgetSelector()
+	assert selector.trial('rle', { 'MODE' : 'nibble' }, ULA_DATA) is None
+	small = bytearray([ 0x80, 0x80, 0x90 ]) * 100
+	for mode in [ 'nibble', 'byte', 'wide', 'raw' ]:
+		assert selector.trial('rle', { 'MODE' : mode }, small) is not None
@@ -0,0 +1,43 @@
+# test_ulacodecs.py
+# The raw codec, the common encoder interface and the cycle models
+# (each encoder's own round trips are in its test file)
+
+import pytest
+
+from conftest import load_example, ula_edge_cases, ula_examples
+from modules.ulacodecs import CODECS
+from modules.ulaplayers import UlaPlayerSimulator
+
+
+EXAMPLES = [ "Repton-ingame.electron.vgm.ula.bin", "Firetrack-loader.electron.vgm.ula.bin" ]
+
+
+@pytest.mark.parametrize("example", ula_examples())
+def test_raw_round_trip(example):
+
+	codec = CODECS['raw']()
+	ula_data = load_example(example)
+	assert codec.decompress(codec.compress(ula_data)) == ula_data
+
+
+# every encoder gives the same frames through decode_frames as through decompress
+@pytest.mark.parametrize("name", sorted(CODECS.keys()))
+def test_decode_frames(name):
+
+	codec = CODECS[name]()
+	for ula_data in ula_edge_cases():
+		encoded = codec.compress(ula_data)
+		frames = codec.decode_frames(encoded)[0]
+		assert frames == codec.decompress(encoded) == ula_data
+
+
+# the static models are worst case figures, so they must not be below what the reference players
+# measure, and should be close to them
+@pytest.mark.parametrize("example", EXAMPLES)
+@pytest.mark.parametrize("name", sorted(CODECS.keys()))
+def test_cycle_model_bounds_players(name, example):
+
+	result = UlaPlayerSimulator().measure(name, load_example(example))
+	measured = result['worst_case_cycles_per_frame']
+	modelled = result['modelled_worst_case_cycles_per_frame']
+	assert measured <= modelled <= measured * 1.1
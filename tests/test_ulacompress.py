@@ -0,0 +1,34 @@
+# test_ulacompress.py
+# LZ encoder round trips
+
+import random
+
+import pytest
+
+from conftest import load_example, random_ula, ula_edge_cases, ula_examples
+from modules.ulacompress import UlaCompressor
+
+
+@pytest.mark.parametrize("example", ula_examples())
+def test_round_trip(example):
+
+	ula_data = load_example(example)
+	assert UlaCompressor().decompress(UlaCompressor().compress(ula_data)) == ula_data
+
+
+def test_round_trip_edge_cases():
+
+	for ula_data in ula_edge_cases():
+		compressor = UlaCompressor()
+		assert compressor.decompress(compressor.compress(ula_data)) == ula_data
+
+
+# repeats either side of the edge of the 256 byte history page
+def test_window():
+
+	compressor = UlaCompressor()
+	rng = random.Random(2)
+	for distance in [ 255, 256, 257 ]:
+		block = random_ula(rng, 16)
+		ula_data = block + random_ula(rng, distance - 16) + block
+		assert compressor.decompress(compressor.compress(ula_data)) == ula_data
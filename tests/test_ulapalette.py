@@ -0,0 +1,45 @@
+# test_ulapalette.py
+# Palette and run length encoder round trips, and its raw mode
+
+import pytest
+
+from conftest import load_example, ula_edge_cases, ula_examples
+from modules.ulapalette import UlaPaletteCompressor
+from modules.ulaplayers import UlaPlayerSimulator
+
+
+@pytest.mark.parametrize("example", ula_examples())
+def test_round_trip(example):
+
+	ula_data = load_example(example)
+	assert UlaPaletteCompressor().decompress(UlaPaletteCompressor().compress(ula_data)) == ula_data
+
+
+def test_round_trip_edge_cases():
+
+	for ula_data in ula_edge_cases():
+		encoder = UlaPaletteCompressor()
+		assert encoder.decompress(encoder.compress(ula_data)) == ula_data
+
+
+# a stream of every ULA value can't have a palette, so it is stored in raw mode
+def test_full_palette():
+
+	encoder = UlaPaletteCompressor()
+	ula_data = bytearray(v for v in range(256) if v != 1) * 4
+	encoded = encoder.compress(ula_data)
+	assert encoded[0] == encoder.RAW_MODE
+	assert len(encoded) == len(ula_data) + 2
+	assert encoder.decompress(encoded) == ula_data
+	assert UlaPlayerSimulator().measure('rle', ula_data)['verified']
+
+
+# tunes that the palette encoding makes bigger fall back to raw mode
+def test_never_expands():
+
+	encoder = UlaPaletteCompressor()
+	ula_data = load_example("ODYSSEY.electron.vgm.ula.bin")
+	encoded = encoder.compress(ula_data)
+	assert len(encoded) <= len(ula_data) + 2
+	assert encoder.decompress(encoded) == ula_data
+	assert UlaPlayerSimulator().measure('rle', ula_data)['verified']
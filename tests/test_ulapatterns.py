@@ -0,0 +1,52 @@
+# test_ulapatterns.py
+# Pattern table and order list encoder round trips
+
+import random
+
+import pytest
+
+from conftest import load_example, random_ula, ula_edge_cases, ula_examples
+from modules.ulapatterns import UlaPatternCompressor
+from modules.ulaplayers import UlaPlayerSimulator
+
+
+@pytest.mark.parametrize("example", ula_examples())
+def test_round_trip(example):
+
+	ula_data = load_example(example)
+	assert UlaPatternCompressor().decompress(UlaPatternCompressor().compress(ula_data)) == ula_data
+
+
+def test_round_trip_edge_cases():
+
+	for ula_data in ula_edge_cases():
+		compressor = UlaPatternCompressor()
+		assert compressor.decompress(compressor.compress(ula_data)) == ula_data
+
+
+# more than 253 patterns need the extended order list entries
+def test_extended_patterns():
+
+	compressor = UlaPatternCompressor()
+	rng = random.Random(1)
+	segments = [ random_ula(rng, 8) for n in range(400) ]
+	ula_data = bytearray()
+	for repeat in range(4):
+		rng.shuffle(segments)
+		for segment in segments:
+			ula_data += segment
+	encoded = compressor.compress(ula_data)
+	assert 0xfd in compressor.pack_order(compressor.segment([ ula_data ])[1][0])
+	assert compressor.decompress(encoded) == ula_data
+	assert UlaPlayerSimulator().run('pat', encoded)[0] == ula_data
+
+
+# each tune plays back from the shared bank with its own order list, in less than their separate encodings
+def test_shared_bank():
+
+	compressor = UlaPatternCompressor()
+	streams = [ load_example(example) for example in [ "Repton-ingame.electron.vgm.ula.bin", "Firetrack-loader.electron.vgm.ula.bin" ] ]
+	bank, orders = compressor.compress_shared(streams)
+	for ula_data, order_data in zip(streams, orders):
+		assert compressor.decode_frames(bank, order_data)[0] == ula_data
+	assert len(bank) + sum(len(order_data) for order_data in orders) < sum(len(compressor.compress(ula_data)) for ula_data in streams)
@@ -0,0 +1,26 @@
+# test_ulaplayers.py
+# Each reference player reproduces the ULA data when run on the simulated 6502
+
+import pytest
+
+from conftest import load_example
+from modules.ulaplayers import PLAYERS, UlaPlayerSimulator
+
+
+EXAMPLES = [ "Repton-ingame.electron.vgm.ula.bin", "SONG_091.electron.vgm.ula.bin" ]
+
+
+@pytest.mark.parametrize("example", EXAMPLES)
+@pytest.mark.parametrize("name", sorted(PLAYERS.keys()))
+def test_player_reproduces_ula_data(name, example):
+
+	ula_data = load_example(example)
+	result = UlaPlayerSimulator().measure(name, ula_data)
+	assert result['verified']
+	assert result['worst_case_cycles_per_frame'] < UlaPlayerSimulator.MAX_FRAME_CYCLES
+
+
+def test_empty_stream():
+
+	for name in PLAYERS:
+		assert UlaPlayerSimulator().measure(name, bytearray())['verified']
@@ -0,0 +1,350 @@
+# test_vgm2electron.py
+# Converter output checks
+
+import asyncio
+import gzip
+import os
+import struct
+import subprocess
+import sys
+import time
+
+import pytest
+
+from conftest import EXAMPLES, count_packets, load_example
+from modules.vgmparser import VgmStream
+
+
+# returns the wait of each wait command in an Electron VGM, in samples
+def get_waits(filename):
+
+	waits = []
+	vgm = VgmStream(filename)
+	for q in vgm.command_list:
+		command = q['command'][0]
+		if command == 0x61:
+			waits.append(struct.unpack('<H', q['data'])[0])
+		elif command == 0x62:
+			waits.append(735)
+		elif command == 0x63:
+			waits.append(882)
+		elif 0x70 <= command <= 0x7f:
+			waits.append((command & 15) + 1)
+	return waits
+
+
+def test_long_waits_stay_frame_aligned(convert):
+
+	# CrazeeRider has silences longer than a 0x61 wait can hold
+	src_filename = os.path.join(EXAMPLES, "CrazeeRider-title.vgm")
+	dst_filename = convert(src_filename)
+
+	waits = get_waits(dst_filename)
+	assert max(waits) > 65535 // 2
+	assert all(wait % 882 == 0 for wait in waits)
+
+	# the output has a wait for every frame of the source, so it parses to the same frames
+	# plus the end of data and end of file packets that the parser always adds
+	assert count_packets(dst_filename) == count_packets(src_filename) + 2
+
+
+def read_outputs(dst_filename):
+
+	outputs = {}
+	directory = os.path.dirname(dst_filename)
+	for name in sorted(os.listdir(directory)):
+		if name.startswith(os.path.basename(dst_filename)):
+			output_file = open(os.path.join(directory, name), 'rb')
+			outputs[name[len(os.path.basename(dst_filename)):]] = output_file.read()
+			output_file.close()
+	return outputs
+
+
+def test_memoised_conversion_matches(convert, tmp_path):
+
+	src_filename = os.path.join(EXAMPLES, "Repton-ingame.vgm")
+	options = [ "-z", "-r", "-p" ]
+	expected = read_outputs(convert(src_filename, options, "plain.electron.vgm"))
+
+	cache_dir = str(tmp_path / "cache")
+	first = read_outputs(convert(src_filename, options + [ "--cache", cache_dir ], "first.electron.vgm"))
+	entries = sorted(os.listdir(cache_dir))
+	second = read_outputs(convert(src_filename, options + [ "--cache", cache_dir ], "second.electron.vgm"))
+
+	assert first == expected
+	assert second == expected
+	assert sorted(os.listdir(cache_dir)) == entries
+
+	# a different technique makes new stage entries rather than reusing the old ones
+	convert(src_filename, options + [ "--cache", cache_dir, "-q", "1" ], "technique1.electron.vgm")
+	assert len(os.listdir(cache_dir)) > len(entries)
+
+
+# the cached stages run serially, so -j is ignored with a warning
+def test_cache_ignores_jobs(convert, tmp_path, capsys):
+
+	src = os.path.join(EXAMPLES, "Repton-ingame.vgm")
+	dst = convert(src, [ "--cache", str(tmp_path / "cache"), "-j", "2" ])
+	assert "WARNING: -j is ignored with --cache" in capsys.readouterr().out
+	assert read_outputs(dst)[".ula.bin"][:-3] == load_example("Repton-ingame.electron.vgm.ula.bin")
+
+
+# watching a directory with -o would write every tune to the same output
+def test_watch_directory_rejects_output(tmp_path):
+
+	script = os.path.join(os.path.dirname(EXAMPLES), "vgm2electron.py")
+	result = subprocess.run([ sys.executable, script, EXAMPLES, "-w", "-o", str(tmp_path / "out.vgm") ], capture_output = True, text = True, timeout = 60)
+	assert "ERROR: -o can't be used when watching a directory" in result.stdout
+	assert os.listdir(str(tmp_path)) == []
+
+
+# every tune ends with the end of stream marker, which can't be mistaken for note data
+def test_end_marker(convert):
+
+	dst = convert(os.path.join(EXAMPLES, "Repton-ingame.vgm"), [ "-z" ])
+	outputs = read_outputs(dst)
+	assert outputs[".ula.bin"][-3:] == b'\x01\xff\xff'
+	assert 0x01 not in outputs[".ula.bin"][:-3]
+	assert outputs[".ula.bin"][:-3] == load_example("Repton-ingame.electron.vgm.ula.bin")
+	assert outputs[".ula.lz"][-3:] == b'\x01\xff\xff'
+
+	from modules.ulacodecs import CODECS
+	assert CODECS['raw']().split_marker(outputs[".ula.bin"]) == (outputs[".ula.bin"][:-3], None)
+
+
+# a tone that would need ULA value 1 is silenced
+def test_reserved_ula_value():
+
+	from vgm2electron import VgmElectron
+
+	class Clock:
+		vgm_source_clock = 4000000
+
+	# 4MHz / (32 * 8) = 15.6KHz, which is ULA value 1
+	assert VgmElectron().sn_to_electron(Clock(), 8) == 0
+	assert [ VgmElectron().sn_to_electron(Clock(), tone) for tone in range(1, 1024) ].count(1) == 0
+
+
+# with the default settings the conversion streams, so its peak memory doesn't depend on the length of the tune
+def test_memory_bounded(tmp_path):
+
+	import contextlib
+	import tracemalloc
+	from modules.vgmsynth import VgmSynth
+	from vgm2electron import VgmElectron
+
+	peaks = []
+	for duration in [ 20.0, 200.0 ]:
+		synth = VgmSynth()
+		synth.DURATION = duration
+		src = str(tmp_path / ("synth" + str(int(duration)) + ".vgm"))
+		synth.write(src)
+
+		with contextlib.redirect_stdout(open(os.devnull, 'w')) as log:
+			tracemalloc.start()
+			assert VgmElectron().process(src, src + ".electron.vgm") is None
+			peaks.append(tracemalloc.get_traced_memory()[1])
+			tracemalloc.stop()
+		log.close()
+
+	assert peaks[1] < peaks[0] * 1.5
+
+
+#----------------------------------------------------------
+# Trimming silence
+#----------------------------------------------------------
+
+def read_trim(dst_filename):
+
+	import json
+	trim_file = open(dst_filename + ".trim.json", 'r')
+	trim = json.load(trim_file)
+	trim_file.close()
+	return trim
+
+
+# Firetrack-ingame has 95 silent frames at the start and 18 at the end
+def test_trim(convert):
+
+	src = os.path.join(EXAMPLES, "Firetrack-ingame.vgm")
+	whole = read_outputs(convert(src))[".ula.bin"][:-3]
+	dst = convert(src, [ "-x" ], "trimmed.electron.vgm")
+	trimmed = read_outputs(dst)[".ula.bin"][:-3]
+
+	trim = read_trim(dst)
+	assert trim == { 'source_frames': len(whole), 'leading_frames': 95, 'trailing_frames': 18, 'frames': len(trimmed), 'sample_interval': 882 }
+	assert trimmed == whole[95:len(whole) - 18]
+	assert whole[:95] == bytes(95) and whole[len(whole) - 18:] == bytes(18)
+	assert trimmed[0] != 0 and trimmed[-1] != 0
+
+	# the electron VGM is cut to match
+	assert count_packets(dst) == len(trimmed) + 2
+	assert VgmStream(dst).metadata['total_samples'] == len(trimmed) * 882
+
+
+# only the silence before the loop start of a looping tune is trimmed
+def test_trim_loop(convert, tmp_path):
+
+	from modules.vgmsynth import VgmSynth
+	synth = VgmSynth()
+	synth.DURATION = 2.0
+	synth.NOISE = 0.0
+	chunks = list(synth.iter_chunks())
+	silence = [ (synth.wait_command(882), 882) ] * 30
+	src = str(tmp_path / "repeated.vgm")
+	synth.write_vgm_chunks([ chunks[0] ] + silence + chunks[1:-1] * 5 + [ chunks[-1] ], src, (30 + synth.get_frames() * 5) * 882)
+
+	cut = read_outputs(convert(src, [ "-l" ], "cut.electron.vgm"))[".ula.bin"]
+	dst = convert(src, [ "-l", "-x" ], "trimmed.electron.vgm")
+	trimmed = read_outputs(dst)[".ula.bin"]
+
+	# and the loop can't start in the trimmed silence
+	loop_frame = struct.unpack('<H', cut[-2:])[0]
+	leading = min(len(cut[:-3]) - len(cut[:-3].lstrip(b'\x00')), loop_frame)
+	assert leading >= 30
+	trim = read_trim(dst)
+	assert trim['leading_frames'] == leading and trim['trailing_frames'] == 0
+	assert trimmed[:-3] == cut[leading:-3]
+	assert struct.unpack('<H', trimmed[-2:])[0] == loop_frame - leading
+
+
+#----------------------------------------------------------
+# Pipes
+#----------------------------------------------------------
+
+# runs vgm2electron.py with input on stdin, returns what it writes to stdout
+def run_piped(options, input_data):
+
+	script = os.path.join(os.path.dirname(EXAMPLES), "vgm2electron.py")
+	result = subprocess.run([ sys.executable, script ] + options, input = input_data, capture_output = True, timeout = 60)
+	assert result.returncode == 0
+	return result.stdout
+
+
+# a VGM (or gzipped VGZ) on stdin gives the same ULA data on stdout as converting the file
+@pytest.mark.parametrize("compress", [ False, True ])
+def test_stdin(convert, compress):
+
+	src = os.path.join(EXAMPLES, "Repton-ingame.vgm")
+	input_data = load_example("Repton-ingame.vgm")
+	if compress:
+		input_data = gzip.compress(input_data)
+	assert run_piped([ "-" ], input_data) == read_outputs(convert(src))[".ula.bin"]
+
+
+# stdout can't seek back to patch the VGM header, so the electron VGM is held back until the end
+def test_vgm_to_stdout(convert):
+
+	src = os.path.join(EXAMPLES, "Repton-ingame.vgm")
+	assert run_piped([ src, "-o", "-", "-f", "vgm" ], b'') == read_outputs(convert(src))[""]
+
+
+#----------------------------------------------------------
+# asyncio API
+#----------------------------------------------------------
+
+# a tune that takes a few seconds to convert, long enough to time out or cancel part way through
+@pytest.fixture(scope = "module")
+def long_vgm(tmp_path_factory):
+
+	from modules.vgmsynth import VgmSynth
+	synth = VgmSynth()
+	synth.DURATION = 1200.0
+	filename = str(tmp_path_factory.mktemp("long") / "long.vgm")
+	synth.write(filename)
+	return filename
+
+
+# a fresh process pool for each test, with a single worker and only 2 conversions in flight
+@pytest.fixture
+def async_api(monkeypatch):
+
+	import vgm2electron
+	monkeypatch.setattr(vgm2electron, "async_pool", None)
+	monkeypatch.setattr(vgm2electron, "ASYNC_JOBS", 1)
+	monkeypatch.setattr(vgm2electron, "ASYNC_SLOTS", 2)
+	yield vgm2electron
+	if vgm2electron.async_pool is not None:
+		vgm2electron.async_pool.shutdown()
+
+
+# waits for the worker to finish with every conversion, which frees their slots
+def wait_for_slots(vgm2electron, timeout = 30.0):
+
+	end_time = time.time() + timeout
+	while len(vgm2electron.async_free_slots) < vgm2electron.ASYNC_SLOTS:
+		assert time.time() < end_time, "conversion slots not freed"
+		time.sleep(0.05)
+
+
+def test_async_convert(async_api, tmp_path):
+
+	src = os.path.join(EXAMPLES, "Repton-ingame.vgm")
+	dst = str(tmp_path / "file.electron.vgm")
+	result = asyncio.run(async_api.convert(src, dst))
+	assert result['output'] == dst
+	assert read_outputs(dst)[".ula.bin"][:-3] == load_example("Repton-ingame.electron.vgm.ula.bin")
+
+	# the same from the file contents
+	input_file = open(src, 'rb')
+	input_data = input_file.read()
+	input_file.close()
+	data_dst = str(tmp_path / "data.electron.vgm")
+	asyncio.run(async_api.convert(input_data = input_data, output = data_dst, settings = { 'rle': True }))
+	assert read_outputs(data_dst)[".ula.bin"] == read_outputs(dst)[".ula.bin"]
+	assert ".ula.rle" in read_outputs(data_dst)
+	wait_for_slots(async_api)
+
+
+def test_async_slot_limit(async_api, long_vgm, tmp_path):
+
+	async def run():
+		tasks = [ asyncio.ensure_future(async_api.convert(long_vgm, str(tmp_path / (str(n) + ".electron.vgm")))) for n in range(2) ]
+		await asyncio.sleep(0)
+		with pytest.raises(RuntimeError):
+			await async_api.convert(long_vgm, str(tmp_path / "extra.electron.vgm"))
+		for task in tasks:
+			task.cancel()
+		await asyncio.gather(*tasks, return_exceptions = True)
+
+	asyncio.run(run())
+	wait_for_slots(async_api)
+
+
+def test_async_timeout(async_api, long_vgm, tmp_path):
+
+	dst = str(tmp_path / "timeout.electron.vgm")
+	with pytest.raises(asyncio.TimeoutError):
+		asyncio.run(async_api.convert(long_vgm, dst, timeout = 0.5))
+	# the worker stops at its deadline and deletes the partial outputs
+	wait_for_slots(async_api)
+	assert read_outputs(dst) == {}
+
+
+def test_async_cancel(async_api, long_vgm, tmp_path):
+
+	dst = str(tmp_path / "cancel.electron.vgm")
+
+	async def run():
+		task = asyncio.ensure_future(async_api.convert(long_vgm, dst))
+		await asyncio.sleep(1.0)
+		task.cancel()
+		with pytest.raises(asyncio.CancelledError):
+			await task
+
+	asyncio.run(run())
+	wait_for_slots(async_api)
+	assert read_outputs(dst) == {}
+
+
+# a failed conversion frees its slot, so later conversions still run
+def test_async_failure_frees_slot(async_api, tmp_path):
+
+	for n in range(3):
+		with pytest.raises(ValueError):
+			asyncio.run(async_api.convert(str(tmp_path / "missing.vgm"), str(tmp_path / "out.electron.vgm")))
+	wait_for_slots(async_api)
+
+	dst = str(tmp_path / "out.electron.vgm")
+	asyncio.run(async_api.convert(os.path.join(EXAMPLES, "Repton-ingame.vgm"), dst))
+	assert ".ula.bin" in read_outputs(dst)
@@ -0,0 +1,108 @@
+# test_vgmcache.py
+# Parse and stage cache entries round trip, and bad or missing entries are misses
+
+import os
+import zlib
+
+from modules.vgmcache import VgmCache
+
+
+REGISTERS = bytes(range(11 * 3))
+
+
+def test_round_trip(tmp_path):
+
+	cache = VgmCache(str(tmp_path))
+	cache.store("abc", REGISTERS, 1)
+	assert cache.load("abc") == (REGISTERS, 1)
+	cache.store("def", REGISTERS, None)
+	assert cache.load("def")[1] is None
+
+	cache.store_stage("stage", b'output')
+	assert cache.load_stage("stage") == b'output'
+
+	# no temporary files are left behind
+	assert sorted(os.listdir(str(tmp_path))) == [ "abc.vgmc", "def.vgmc", "stage.stage" ]
+
+
+def test_key_depends_on_contents(tmp_path):
+
+	a = tmp_path / "a.vgm"
+	b = tmp_path / "b.vgm"
+	a.write_bytes(b'Vgm one')
+	b.write_bytes(b'Vgm two')
+	cache = VgmCache(str(tmp_path / "cache"))
+	assert cache.key(str(a)) != cache.key(str(b))
+	b.write_bytes(b'Vgm one')
+	assert cache.key(str(a)) == cache.key(str(b))
+
+
+def test_missing_entry(tmp_path):
+
+	cache = VgmCache(str(tmp_path))
+	assert cache.load("missing") is None
+	assert cache.load_stage("missing") is None
+
+
+# entries in an older format are misses rather than being misread
+def test_old_format_is_a_miss(tmp_path):
+
+	cache = VgmCache(str(tmp_path))
+	cache.store("abc", REGISTERS, 1)
+	path = tmp_path / "abc.vgmc"
+	data = bytearray(zlib.decompress(path.read_bytes()[4:]))
+	data[0] = VgmCache.FORMAT_VERSION - 1
+	path.write_bytes(VgmCache.MAGIC + zlib.compress(bytes(data)))
+	assert cache.load("abc") is None
+
+
+def test_corrupt_entries_are_misses(tmp_path, capsys):
+
+	cache = VgmCache(str(tmp_path))
+	cache.store("abc", REGISTERS, 1)
+	cache.store_stage("stage", b'output')
+
+	# truncated
+	path = tmp_path / "abc.vgmc"
+	data = path.read_bytes()
+	path.write_bytes(data[:len(data) // 2])
+	assert cache.load("abc") is None
+
+	# valid zlib data that is too short for the header
+	path.write_bytes(VgmCache.MAGIC + zlib.compress(b'\x01\x00'))
+	assert cache.load("abc") is None
+
+	# frame count bigger than the data
+	cache.store("abc", REGISTERS, 1)
+	data = bytearray(zlib.decompress(path.read_bytes()[4:]))
+	data[2] = 100
+	path.write_bytes(VgmCache.MAGIC + zlib.compress(bytes(data)))
+	assert cache.load("abc") is None
+
+	(tmp_path / "stage.stage").write_bytes(b'not zlib')
+	assert cache.load_stage("stage") is None
+
+	assert "WARNING" in capsys.readouterr().out
+
+
+def test_evict(tmp_path):
+
+	cache = VgmCache(str(tmp_path), 100)
+	for n in range(4):
+		cache.store_stage("stage" + str(n), os.urandom(60))
+		os.utime(str(tmp_path / ("stage" + str(n) + ".stage")), (n, n))
+	cache.evict()
+	assert os.listdir(str(tmp_path)) == [ "stage3.stage" ]
+
+
+def test_evict_tolerates_deleted_files(tmp_path, monkeypatch):
+
+	cache = VgmCache(str(tmp_path), 0)
+	cache.store_stage("a", b'output')
+	cache.store_stage("b", b'output')
+
+	# another process deletes an entry between listing the directory and using it
+	listdir = os.listdir
+	monkeypatch.setattr(os, "listdir", lambda path: listdir(path) + [ "gone.stage", "gone.vgmc" ])
+	cache.evict()
+	assert len(listdir(str(tmp_path))) <= 1
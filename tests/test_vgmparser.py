@@ -0,0 +1,89 @@
+# test_vgmparser.py
+# Reading VGMs from pipes and writing them to streams that can't seek
+
+import io
+
+import pytest
+
+from modules.vgmparser import PipeReader
+from modules.vgmsynth import VgmSynth
+
+
+# a stream that can only be read or written in order, like a pipe
+class Pipe(io.RawIOBase):
+
+	def __init__(self, data = b''):
+		self.data = bytearray(data)
+		self.position = 0
+
+	def readable(self):
+		return True
+
+	def writable(self):
+		return True
+
+	def seekable(self):
+		return False
+
+	def read(self, size = -1):
+		if size < 0:
+			size = len(self.data) - self.position
+		data = bytes(self.data[self.position:self.position+size])
+		self.position += len(data)
+		return data
+
+	def write(self, data):
+		self.data.extend(data)
+		return len(data)
+
+
+def test_pipe_reader():
+
+	data = bytes(range(256)) * 4
+	reader = PipeReader(Pipe(data))
+
+	# the header can be read again
+	assert reader.read(4) == data[:4]
+	reader.seek(0x40)
+	assert reader.read(8) == data[0x40:0x48]
+	reader.seek(0)
+	assert reader.read(0x10) == data[:0x10]
+
+	# reads past the header come from the pipe, and seeks forward skip over it
+	reader.seek(0xfe)
+	assert reader.read(4) == data[0xfe:0x102]
+	assert reader.tell() == 0x102
+	reader.seek(0x200)
+	assert reader.read(2) == data[0x200:0x202]
+	reader.seek(2, 1)
+	assert reader.read() == data[0x204:]
+
+	with pytest.raises(IOError):
+		reader.seek(0x10)
+
+
+# the header is patched in place when the output can seek, and the commands are held back until the end
+# when it can't, but the bytes written are the same
+def test_write_vgm_stream_to_pipe(tmp_path):
+
+	synth = VgmSynth()
+	synth.DURATION = 5.0
+	total_samples = synth.get_frames() * synth.get_frame_samples()
+	# with a loop point, which is written to the header
+	chunks = list(synth.iter_chunks())
+	chunks.insert(10, (None, 0))
+
+	filename = str(tmp_path / "synth.vgm")
+	synth.write_vgm_chunks(chunks, filename, total_samples)
+	vgm_file = open(filename, 'rb')
+	expected = vgm_file.read()
+	vgm_file.close()
+
+	seekable = io.BytesIO()
+	synth.write_vgm_stream(chunks, seekable, total_samples)
+	assert seekable.getvalue() == expected
+	assert expected[0x1c:0x20] != bytes(4)
+
+	pipe = Pipe()
+	synth.write_vgm_stream(chunks, pipe, total_samples)
+	assert bytes(pipe.data) == expected
@@ -0,0 +1,47 @@
+# test_vgmprofile.py
+# Per stage memory accounting of the stage profiler
+
+import json
+import os
+
+from conftest import EXAMPLES
+from modules.vgmprofile import StageProfiler
+
+
+ITEMS = 200
+ITEM_SIZE = 4096
+
+
+def produce():
+	for i in range(ITEMS):
+		yield bytearray(ITEM_SIZE)
+
+
+# a stage that streams items to a consumer that drops them retains nothing, however many it made,
+# and a stage that keeps what it made retains all of it
+def test_retained():
+
+	profiler = StageProfiler("test", memory = True)
+	for item in profiler.iter("stream", produce()):
+		pass
+	with profiler.stage("keep"):
+		kept = [ bytearray(ITEM_SIZE) for i in range(16) ]
+	report = profiler.memory_report()
+
+	stages = { stage['name'] : stage for stage in report['stages'] }
+	assert abs(stages['stream']['retained']) < ITEM_SIZE
+	assert ITEM_SIZE < stages['stream']['peak'] < ITEM_SIZE * 4
+	assert 16 * ITEM_SIZE <= stages['keep']['retained'] < 17 * ITEM_SIZE
+	assert stages['keep']['retained_sites'][0]['size'] >= 16 * ITEM_SIZE
+	assert "kept = " in stages['keep']['retained_sites'][0]['code']
+	assert len(kept) == 16
+
+
+# every stage of a conversion retains less than the largest heap
+def test_conversion(convert):
+
+	dst_filename = convert(os.path.join(EXAMPLES, "Repton-ingame.vgm"), [ "--memory" ])
+	report = json.load(open(dst_filename + ".memory.json"))
+	for stage in report['stages']:
+		assert abs(stage['retained']) < report['peak'], stage['name']
+		assert stage['peak'] <= report['peak']
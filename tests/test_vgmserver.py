@@ -0,0 +1,79 @@
+# test_vgmserver.py
+# JSON-lines conversion server
+
+import io
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import EXAMPLES, ROOT, load_example
+from modules.vgmserver import JsonLinesServer
+
+
+# a server running vgm2electron conversions on one worker process
+@pytest.fixture(scope = "module")
+def server():
+
+	import vgm2electron
+	server = JsonLinesServer(vgm2electron.server_convert, 1, vgm2electron.server_init)
+	yield server
+	server.close()
+
+
+# returns the replies to a list of request lines, by id
+def serve(server, lines):
+
+	outfile = io.StringIO()
+	server.serve_stream(io.StringIO("\n".join(lines) + "\n"), outfile)
+	replies = [ json.loads(line) for line in outfile.getvalue().splitlines() ]
+	assert len(replies) == len([ line for line in lines if len(line.strip()) ])
+	return { reply['id'] : reply for reply in replies }
+
+
+def test_bad_requests(server):
+
+	replies = serve(server, [ "not json" ])
+	assert replies[None]['ok'] == False and replies[None]['error'].startswith("Bad request")
+	replies = serve(server, [ "[1, 2]", "" ])
+	assert replies[None]['ok'] == False and "JSON object" in replies[None]['error']
+
+
+def test_failed_requests(server, tmp_path):
+
+	missing = str(tmp_path / "missing.vgm")
+	replies = serve(server, [
+		json.dumps({ 'id': "missing", 'input': missing }),
+		json.dumps({ 'id': "setting", 'input': os.path.join(EXAMPLES, "Repton-ingame.vgm"), 'output': str(tmp_path / "out.vgm"), 'settings': { 'colour': 1 } }),
+		json.dumps({ 'id': "noinput" }),
+	])
+	assert replies["missing"] == { 'id': "missing", 'ok': False, 'error': "File '" + missing + "' not found", 'total_ms': replies["missing"]['total_ms'] }
+	assert replies["setting"]['ok'] == False and replies["setting"]['error'] == "Unknown setting 'colour'"
+	assert replies["noinput"]['ok'] == False
+	assert os.listdir(str(tmp_path)) == []
+
+
+def test_round_trip(server, tmp_path):
+
+	dst = str(tmp_path / "out.electron.vgm")
+	replies = serve(server, [ json.dumps({ 'id': 7, 'input': os.path.join(EXAMPLES, "Repton-ingame.vgm"), 'output': dst, 'settings': { 'compress': True } }) ])
+	reply = replies[7]
+	assert reply['ok'] == True and reply['output'] == dst
+	assert reply['total_ms'] >= reply['convert_ms'] >= 0
+	ula_file = open(dst + ".ula.bin", 'rb')
+	assert ula_file.read()[:-3] == load_example("Repton-ingame.electron.vgm.ula.bin")
+	ula_file.close()
+	assert os.path.isfile(dst + ".ula.lz")
+
+
+# with --server, stdout only has the replies
+def test_command_line(tmp_path):
+
+	dst = str(tmp_path / "out.electron.vgm")
+	request = json.dumps({ 'id': 1, 'input': os.path.join(EXAMPLES, "Repton-ingame.vgm"), 'output': dst })
+	result = subprocess.run([ sys.executable, os.path.join(ROOT, "vgm2electron.py"), "--server", "-j", "1" ], input = request + "\n", capture_output = True, text = True, timeout = 60)
+	replies = [ json.loads(line) for line in result.stdout.splitlines() ]
+	assert len(replies) == 1 and replies[0]['id'] == 1 and replies[0]['ok'] == True
+	assert os.path.isfile(dst)
@@ -0,0 +1,49 @@
+# test_vgmwatch.py
+# Changed VGMs are found from their modification time and size, and only hashed when those change
+
+import hashlib
+import os
+
+from modules.vgmwatch import VgmWatcher
+
+
+def write(path, data, mtime):
+	path.write_bytes(data)
+	os.utime(str(path), (mtime, mtime))
+
+
+def test_changed(tmp_path, monkeypatch):
+
+	tune = tmp_path / "tune.vgm"
+	write(tune, b'Vgm one', 1000)
+	write(tmp_path / "tune.electron.vgm", b'output', 1000)
+	watcher = VgmWatcher([ str(tmp_path) ])
+	assert watcher.changed() == [ str(tune) ]
+
+	# files whose modification time and size are unchanged aren't read at all
+	hashed = []
+	digest = watcher.digest
+	monkeypatch.setattr(watcher, "digest", lambda filename: hashed.append(filename) or digest(filename))
+	assert watcher.changed() == []
+	assert hashed == []
+
+	# touched, so hashed, but the contents are the same
+	write(tune, b'Vgm one', 2000)
+	assert watcher.changed() == []
+	assert hashed == [ str(tune) ]
+
+	# edited
+	write(tune, b'Vgm two', 3000)
+	assert watcher.changed() == [ str(tune) ]
+	assert watcher.changed() == []
+
+
+# a file bigger than a block hashes the same as all at once
+def test_digest_in_blocks(tmp_path):
+
+	tune = tmp_path / "tune.vgm"
+	data = os.urandom(1000)
+	tune.write_bytes(data)
+	watcher = VgmWatcher([ str(tune) ])
+	watcher.BLOCK_SIZE = 64
+	assert watcher.digest(str(tune)) == hashlib.sha1(data).hexdigest()
@@ -27,6 +27,7 @@
 
 
 
+import contextlib
 import functools
 import itertools
 import struct
@@ -37,6 +38,8 @@ import math
 import operator
 import os
 
+# the encoders, cache, profiler, process pools, server and watcher are imported where they are used,
+# so that a plain conversion (and importing this module) doesn't pay for them
 from modules.vgmparser import VgmStream
 
 class VgmElectron:
@@ -59,105 +62,158 @@ class VgmElectron:
 	ENABLE_CHANNEL3 = True
 
 	USE_TECHNIQUE = 2
+	ENABLE_DOWNMIX = True # mix the 3 tone channels down to channel 1
+
+	COMPRESS_ULA = False # also output an LZ compressed version of the ULA data as <filename>.ula.lz
+	ENCODE_ULA_RLE = False # also output a palette + run length encoded version of the ULA data as <filename>.ula.rle
+	ENCODE_ULA_PATTERNS = False # also output a pattern table + order list version of the ULA data as <filename>.ula.pat
+
+	TRIM_SILENCE = False # cut silent frames from the start and end of the output, and note the offsets in <filename>.trim.json
+	DETECT_LOOPS = False # find loops in tunes that have no loop metadata, and cut the output to one iteration
+	LOOP_TOLERANCE = 0 # number of mismatching frames allowed when detecting loops
+
+	ARPEGGIO_CYCLE = { 1: 2, 2: 6 } # frames after which the arpeggiator repeats for each technique, loops must be a multiple of this
+	ULA_LOOP_MARKER = 0x01 # .ula.bin end of stream marker, followed by the 16-bit loop frame
+	ULA_NO_LOOP = 0xffff # loop frame in the end of stream marker of tunes that don't loop
+
+	RAM_BUDGET = None # if either budget is set, choose the smallest ULA encoding that fits and output it as well
+	CYCLE_BUDGET = None # max 6502 cycles per frame for the player
+	BUDGET_CACHE = None # JSON file to keep budget trial encodes in between runs
+
+	KEEP_ULA_DATA = False # return the ULA data from process(), otherwise it is only written to file as it is converted
+
+	PIPE_FORMAT = 'ula' # which output is written to stdout when the output filename is '-', 'ula' or 'vgm'
+
+	CACHE_DIR = None # directory to cache parsed VGM register data in, so repeat conversions skip the parsing
+	CACHE_SIZE = None # max size of the cache in bytes, None for the VgmCache default
+	PROFILE = False # time each stage of the conversion, writing '[output].profile.json' and '[output].trace.json'
+	PROFILE_MEMORY = False # trace the memory used by each stage of the conversion, writing '[output].memory.json'
+
+	JOBS = 1 # worker processes to convert the frames of a tune on, in chunks of CHUNK_FRAMES
+	CHUNK_FRAMES = 4096
+
+	PROFILE_STAGES = { 'ula': 'ula_map', 'vgm': 'vgm_emit' } # profiler names of the cached stages
+
+	STAGE_VERSION = 2 # bump when a change to a conversion stage changes its output, so cached stage outputs are not reused
 
 
 	def __init__(self):
 		print("init")
+		self.deadline = None # time.time() after which process() gives up with a TimeoutError
+		self.cancelled = None # function returning True if process() should give up
+		self.profiler = None # StageProfiler of the running conversion, if PROFILE is set
+
+
+	# give up on a conversion that has run out of time or been cancelled, checked every frame
+	def check_stop(self):
+		if self.deadline is not None and time.time() > self.deadline:
+			raise TimeoutError("Conversion deadline passed")
+		if self.cancelled is not None and self.cancelled():
+			raise RuntimeError("Conversion cancelled")
 
 			
 	#----------------------------------------------------------
 	# Utilities
 	#----------------------------------------------------------
 
+	# returns a context manager that times a stage of the conversion, if it is being profiled
+	def profile_stage(self, name):
+		if self.profiler is None:
+			return contextlib.nullcontext()
+		return self.profiler.stage(name)
 
-	# split the packed raw data into 11 separate streams
-	# returns array of 11 bytearrays
-	def split_raw(self, rawData, stripCommands = True):
 
-		registers = [ 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
-		registers_opt = [ 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+	# given an array of data points, serialize it to a bytearray
+	# size is the number of bytes to be used to represent each element in the source array.
+	def toByteArray(self, array, size = 1):
+		r = bytearray()
+		for v in array:
+			if size < 2:
+				r.append(v & 255)
+			else:
+				r.append(v & 255)
+				r.append(v >> 8)
+		return r
 
-		latched_channel = -1
 
-		output_block = bytearray()
-		output_blocks = []
+	#----------------------------------------------------------
+	# Pipeline stages
+	# The conversion runs as a chain of generators, a frame at a time, so the memory used
+	# doesn't grow with the length of the tune and output is written as the input is read.
+	#----------------------------------------------------------
 
-		for o in range(11):
-			output_blocks.append( bytearray() )
+	# generator for the packets in a raw data block as returned by VgmStream.as_binary(), without the header
+	# yields a bytearray of the PSG writes for each packet
+	def iter_raw_packets(self, rawData):
+
+		n = 0
+		while rawData[n] != 255:
+			packet_size = rawData[n]
+			n += 1
+			yield rawData[n:n+packet_size]
+			n += packet_size
+
+
+	# generator for the state of the 11 registers after each packet
+	# yields a new bytearray of 11 register values per packet, which the later stages are free to modify
+	def iter_register_frames(self, packets, stripCommands = True):
+
+		registers = [ 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+
+		latched_channel = -1
 
 		if stripCommands:
 			register_mask = 15
 		else:
 			register_mask = 255
 
-		# unpack the raw binary data in 11 arrays of register data without any deltas between them
-		# eg. the raw chip writes to all 11 registers every frame
-		n = 0
-		Packet = True
 		verbose = False
 
-		while (Packet):
-			packet_size = rawData[n]
+		for packet in packets:
 			if verbose:
-				print("packet_size=" + str(packet_size))
-			n += 1
-			if packet_size == 255:
-				Packet = False
-			else:
-				for x in range(packet_size):
-					d = rawData[n+x]
-					#if verbose:
-					#   print "  frame byte number=" +str(x)
-					#   print "    frame byte=" +str(d)
-					if d & 128:
-						# latch
-						c = (d>>5)&3
-						latched_channel = c
-						if d & 16:
-							# volume
-							if verbose:
-								print(" volume on channel " + str(c))
-							registers[c+7] = d & register_mask
-
-						else:
-							# tone
-							if verbose:
-								print(" tone on channel " + str(c))
-
-							registers[c*2+0] = d & register_mask                    
+				print("packet_size=" + str(len(packet)))
+			for d in packet:
+				if d & 128:
+					# latch
+					c = (d>>5)&3
+					latched_channel = c
+					if d & 16:
+						# volume
+						if verbose:
+							print(" volume on channel " + str(c))
+						registers[c+7] = d & register_mask
 
 					else:
+						# tone
 						if verbose:
-							print(" tone data on latched channel " + str(latched_channel))
-						registers[latched_channel*2+1] = d # we no longer do any masking here # d & 63 # tone data only contains 6 bits of info anyway, so no need for mask
-						if latched_channel == 3:
-							print("ERROR CHANNEL")
+							print(" tone on channel " + str(c))
 
+						registers[c*2+0] = d & register_mask                    
 
+				else:
+					if verbose:
+						print(" tone data on latched channel " + str(latched_channel))
+					registers[latched_channel*2+1] = d # we no longer do any masking here # d & 63 # tone data only contains 6 bits of info anyway, so no need for mask
+					if latched_channel == 3:
+						print("ERROR CHANNEL")
 
+			# emit current state of each of the 11 registers
+			yield bytearray(registers)
 
 
-				# emit current state of each of the 11 registers to 11 different bytearrays
-				for x in range(11):
-					output_blocks[x].append( registers[x] )
-
-				# next packet                
-				n += packet_size
-
-		#print(output_blocks[6])
+	# split the packed raw data into 11 separate streams
+	# returns array of 11 bytearrays
+	def split_raw(self, rawData, stripCommands = True):
 
-		#IGNORE we no longer do this - let the decoder do it instead.
-		if False:
-			# make sure we only emit tone3 when it changes, or 15 for no-change
-			# this prevents the LFSR from being reset
-			lastTone3 = 255  
-			for x in range(len(output_blocks[6])):
-				t = output_blocks[6][x]
-				if t == lastTone3:
-					output_blocks[6][x] = 15
-				lastTone3 = t
+		output_blocks = []
+		for o in range(11):
+			output_blocks.append( bytearray() )
 
-		#    print(output_blocks[6])
+		# unpack the raw binary data in 11 arrays of register data without any deltas between them
+		# eg. the raw chip writes to all 11 registers every frame
+		for frame in self.iter_register_frames(self.iter_raw_packets(rawData), stripCommands):
+			for x in range(11):
+				output_blocks[x].append( frame[x] )
 
 		# Add EOF marker (0x08) to tone3 byte stream
 		output_blocks[6].append(0x08)	# 0x08 is an invalid noise tone.
@@ -166,480 +222,994 @@ class VgmElectron:
 		return output_blocks
 
 
-	# given an array of data points, serialize it to a bytearray
-	# size is the number of bytes to be used to represent each element in the source array.
-	def toByteArray(self, array, size = 1):
-		r = bytearray()
-		for v in array:
-			if size < 2:
-				r.append(v & 255)
-			else:
-				r.append(v & 255)
-				r.append(v >> 8)
-		return r
+	# given an SN76489 tone register value, return the equivalent Electron ULA register setting
+	def sn_to_electron(self, vgm, tone_value):
+		
+		# hack to protect against divbyzero
+		if (tone_value == 0):
+			tone_value = 1
+
+		hz = float(vgm.vgm_source_clock) / ( 2.0 * float(tone_value) * 16.0)
+		print("   sn_to_electron freq " + str(hz) + "hz")
+		# electron 
+		# Sound frequency = 1 MHz / [32 * (S + 1)]
+		# f * 32*(S+1) = 1Mhz
+		# 32*(S+1) = 1Mhz / f
+		# (S+1) = 1Mhz / f*32
+
+		#print ("SN freq is " + str(hz))
+
+		ula6 = int( 1000000.0 / (hz * 32.0) ) - 1
+
+		# check we are within range
+		if ula6 < 0:
+			print("  WARNING: Electron freqency '" + str(ula6) + "' too high (" + str(hz) + ")")
+			ula6 = 0
+
+		if ula6 > 255:
+			print("  WARNING: Electron frequency '" + str(ula6) + "' too low (" + str(hz) + ")") 
+			ula6 = 255
+
+		# 1 is reserved for the end of stream marker in .ula.bin, and is inaudible anyway (15.6KHz)
+		if ula6 == 1:
+			print("  WARNING: Electron frequency '1' is reserved for the end of stream marker, silenced (" + str(hz) + ")")
+			ula6 = 0
+		
+		return ula6
 
 
 	#----------------------------------------------------------
-	# Process(filename)
-	# Convert the given VGM file to an electron VGM file
 	#----------------------------------------------------------
-	def process(self, src_filename, dst_filename):
+	# Conversion stages
+	# Each stage converts the 11 register values of frame number i in place
+	#----------------------------------------------------------
 
-		# load the VGM file, or alternatively interpret as a binary
-		if src_filename.lower()[-4:] != ".vgm":
-			print("ERROR: Not a VGM source")
-			return
+	def threshold_frame(self, frame):
 
-		vgm = VgmStream(src_filename)
-		data_block = vgm.as_binary()
+		#--------------------------------------------------------------
+		# step 1- map volumes to 1-bit precision
+		#--------------------------------------------------------------
+		# 11 registers per frame
+		# Tone 0 HL Tone 1 HL Tone 2 HL Tone 3 Vol 0123
+		for r in range(11):
 
-		data_offset = 0
+			if r > 6:
+				register_data = frame[r]
+				# apply the threshold for each channel
+				threshold = VgmElectron.ATTENTUATION_THRESHOLD1
+				if r == 8:
+					threshold = VgmElectron.ATTENTUATION_THRESHOLD2
+				if r == 9:
+					threshold = VgmElectron.ATTENTUATION_THRESHOLD3
 
-		# parse the header
-		header_size = data_block[0]       # header size
-		play_rate = data_block[1]       # play rate
+				# if its a volume, map to loudest volume or no volume (using logarithmic scale)
+				if register_data < threshold:
+					register_data = 0 # full volume
+				else:
+					register_data = 15 # zero volume
 
-		if header_size == 5 and play_rate == 50:
-			packet_count = data_block[2] + data_block[3]*256       # packet count LO
-			duration_mm = data_block[4]       # duration mm
-			duration_ss = data_block[5]       # duration ss
-			
-			data_offset = header_size+1
-			data_offset += data_block[data_offset]+1
-			data_offset += data_block[data_offset]+1
 
+				if r == 7 and VgmElectron.ENABLE_CHANNEL1 == False:
+					register_data = 15 # zero volume
+				if r == 8 and VgmElectron.ENABLE_CHANNEL2 == False:
+					register_data = 15 # zero volume
+				if r == 9 and VgmElectron.ENABLE_CHANNEL3 == False:
+					register_data = 15 # zero volume
 
-			print("header_size=" +str(header_size))
-			print("play_rate="+str(play_rate))
-			print("packet_count="+str(packet_count))
-			print("duration_mm="+str(duration_mm))
-			print("duration_ss="+str(duration_ss))
-			print("data_offset="+str(data_offset))
-		else:
-			print("No header.")
+				frame[r] = register_data
 
-		print("")
 
-		# Trim off the header data. The rest is raw data.
-		data_block = data_block[data_offset:]
+	def retune_frame(self, frame, i, vgm):
 
+		#--------------------------------------------------------------
+		# step 2 - transpose to fit frequency range
+		#--------------------------------------------------------------
 
-		#----------------------------------------------------------
-		# Unpack the register data into 11 separate data streams
-		#----------------------------------------------------------
-		registers = self.split_raw(data_block, True)
+		# final step - bring tone1 into the frequency range of the electron
+		# if the frequency goes below the range of the ULA capabilities, add an octave
 
-		#----------------------------------------------------------
-		# Begin VGM conversion to Electron
-		#----------------------------------------------------------
+		def retune(octaves, l,h,v):
 
-        # Filter out channels we do not need
-        # Modify all volumes to full or none
-        # Interleave sound to a single channel
-        # output final VGM
-        
+			#if (octaves == 0):
+			#	print("  No transpose performed, octaves set to 0")
+			#	return
+				
+			print( "  tonehi=" + str(frame[h]) + ", tonelo=" + str(frame[l]))
 
+			tone_value = (frame[h] << 4) + frame[l] 
+			if tone_value > 0:
+				tone_freq = float(vgm.vgm_source_clock) / ( 2.0 * float(tone_value) * 16.0)
+				print("  Retune, Channel " + str(int(l/2)) + " tone=" + str(tone_value) + ", freq=" + str(tone_freq))
+				
+				# electron baseline is 122Hz not 244Hz as the AUG states.
+				baseline_freq = 1000000.0 / (32.0*256.0)
+				target_freq = tone_freq
+				retuned = 0
 
 
+				transpose = abs(octaves)
+				while retuned != transpose: # target_freq < baseline_freq:
+					if (octaves < 0):
+						target_freq /= 2.0
+					else:
+						target_freq *= 2.0
+					retuned += 1
 
 
-		vgm_stream = bytearray()
-		vgm_time = 0
-		
-		electron_data = bytearray()
+				# if cant reach baseline freq, transpose once, then silence if still too low :(
+				if target_freq < baseline_freq:
+					print("  WARNING: Freq too low - Added " + str(1) + " octave(s) - from " + str(target_freq) + " to " + str(target_freq*2.0) + "Hz")
+					# better to just clamp low frequencies at the bottom, and risk tuning issues rather than transposition jumps
+					target_freq = baseline_freq #*= 2.0
+					retuned = 1
+					if target_freq < baseline_freq:
+						frame[v] = 15
+						print("   Tone " + str(i) + " silenced because frequency too low - " + str(target_freq))
+						#target_freq *= 2.0
+						#retuned += 1
 
-		# given an SN76489 tone register value, return the equivalent Electron ULA register setting
-		def sn_to_electron(tone_value):
-			
-			# hack to protect against divbyzero
-			if (tone_value == 0):
-				tone_value = 1
-
-			hz = float(vgm.vgm_source_clock) / ( 2.0 * float(tone_value) * 16.0)
-			print("   sn_to_electron freq " + str(hz) + "hz")
-			# electron 
-			# Sound frequency = 1 MHz / [32 * (S + 1)]
-			# f * 32*(S+1) = 1Mhz
-			# 32*(S+1) = 1Mhz / f
-			# (S+1) = 1Mhz / f*32
-
-			#print ("SN freq is " + str(hz))
-
-			ula6 = int( 1000000.0 / (hz * 32.0) ) - 1
-
-			# check we are within range
-			if ula6 < 0:
-				print("  WARNING: Electron freqency '" + str(ula6) + "' too high (" + str(hz) + ")")
-				ula6 = 0
-
-			if ula6 > 255:
-				print("  WARNING: Electron frequency '" + str(ula6) + "' too low (" + str(hz) + ")") 
-				ula6 = 255
-			
-			return ula6
 
-		#--------------------------------------------------------------
-		# conversion settings
-		#--------------------------------------------------------------
 
+				if retuned:
+					#print("  WARNING: Freq too low - Added " + str(retuned) + " octave(s) - from " + str(tone_freq) + " to " + str(target_freq) + "Hz")
+					tone_value = int( round( float(vgm.vgm_source_clock) / (2.0 * target_freq * 16.0 ) ) )
+					frame[h] = tone_value >> 4
+					frame[l] = tone_value & 15
 
-		# convert the register data to a vgm stream
-		sample_interval = int(44100 / vgm.metadata['rate']) # 882 # 50hz - TODO: use frame rate
-		print("sample_interval=" + str(sample_interval))
+		# transpose
+		#if TRANSPOSE_OCTAVES > 0:
+		print(" Transposing ")
+		retune(VgmElectron.TRANSPOSE_OCTAVES1, 0,1,7)
+		retune(VgmElectron.TRANSPOSE_OCTAVES2, 2,3,8)
+		retune(VgmElectron.TRANSPOSE_OCTAVES3, 4,5,9)
 
-		USE_TONE3 = VgmElectron.ENABLE_CHANNEL3 # True
 
-		# TODO: make these all parameters
-		# Add channel filter option
-		# Add mix type options
-		# --attentuation 468 --filter 123 --transpose 00F --mix 123 --arpeggio 2 --rate 50 
-		# Add option to clamp or transpose out of range frequencies
-		# Make the .ula output file filename.electron.ula
-		# Add 0x01 as a terminating byte in the output ULA
+	def downmix_frame(self, frame, i):
 
+		USE_TONE3 = VgmElectron.ENABLE_CHANNEL3 # True
 		MIX_RATE = 2 # modulo 2 for interleaving channels
-
-		# other options
-		# bias for channels
-		# transpose or silence out of range notes
-
 		channel_mix = 0
 
 		#--------------------------------------------------------------
-		# pre-process music to suit Electron capabilities
+		# Step 3 - mix the 2 primary channels down to 1 channel
 		#--------------------------------------------------------------
-		for i in range(len(registers[0])):
+		# map channel 2 to channel 1
+		# noise channel is completely ignored
 
-			print("Frame " + str(i))
+		if VgmElectron.ENABLE_DOWNMIX:
+			print(" Downmix channels ")
+			#print("Frame " + str(i))
 
-			#--------------------------------------------------------------
-			# step 1- map volumes to 1-bit precision
-			#--------------------------------------------------------------
-			# 11 registers per frame
-			# Tone 0 HL Tone 1 HL Tone 2 HL Tone 3 Vol 0123
-			for r in range(11):
+			vol1 = frame[7]
+			vol2 = frame[8]
+			vol3 = frame[9]
 
-				if r > 6:
-					register_data = registers[r][i]
-					# apply the threshold for each channel
-					threshold = VgmElectron.ATTENTUATION_THRESHOLD1
-					if r == 8:
-						threshold = VgmElectron.ATTENTUATION_THRESHOLD2
-					if r == 9:
-						threshold = VgmElectron.ATTENTUATION_THRESHOLD3
-
-					# if its a volume, map to loudest volume or no volume (using logarithmic scale)
-					if register_data < threshold:
-						register_data = 0 # full volume
-					else:
-						register_data = 15 # zero volume
+			tone1_active = vol1 != 15
+			tone2_active = vol2 != 15
+			tone3_active = vol3 != 15
 
+			tone_active = tone1_active or tone2_active or tone3_active
 
-					if r == 7 and VgmElectron.ENABLE_CHANNEL1 == False:
-						register_data = 15 # zero volume
-					if r == 8 and VgmElectron.ENABLE_CHANNEL2 == False:
-						register_data = 15 # zero volume
-					if r == 9 and VgmElectron.ENABLE_CHANNEL3 == False:
-						register_data = 15 # zero volume
+			if tone_active:
 
-					registers[r][i] = register_data
 
-			#--------------------------------------------------------------
-			# step 2 - transpose to fit frequency range
-			#--------------------------------------------------------------
+				print("  Tone active, mixing")
+				
+				output_tone = 1
+				
 
-			# final step - bring tone1 into the frequency range of the electron
-			# if the frequency goes below the range of the ULA capabilities, add an octave
+				if self.USE_TECHNIQUE == 2:
+
+					c1f = (frame[1] << 4) + frame[0] 
+					c2f = (frame[3] << 4) + frame[2] 
+					c3f = (frame[5] << 4) + frame[4] 
+
+					active_channels = [ False, False, False ]
+					if tone1_active:
+						active_channels[0] = True
+						print("Channel 1 is active volume")
+					if tone2_active:
+						active_channels[1] = True
+						print("Channel 2 is active volume")
+					if tone3_active:
+						active_channels[2] = True
+						print("Channel 3 is active volume")
+
+					# any channels playing the same frequency are filtered out
+					if tone1_active and tone2_active and c2f == c1f:
+						active_channels[1] = False
+						print("Channel 2 is same freq as Channel 1, filtered")
+					if tone1_active and tone3_active and c3f == c1f:
+						active_channels[2] = False
+						print("Channel 3 is same freq as Channel 1, filtered")
+					if tone2_active and tone3_active and c2f == c3f:
+						active_channels[2] = False
+						print("Channel 3 is same freq as Channel 2, filtered")
+
+					channel_count = 0
+					if active_channels[0]: channel_count += 1
+					if active_channels[1]: channel_count += 1
+					if active_channels[2]: channel_count += 1
+
+					print("channel_count=" + str(channel_count))
+					output_mix = []
+					if active_channels[0]: output_mix.append(1)
+					if active_channels[1]: output_mix.append(2)
+					if active_channels[2]: output_mix.append(3)
+
+					mix = (i % channel_count)
+					output_tone = output_mix[mix]
+				
+				
+				if self.USE_TECHNIQUE == 1:
+					# interleaving of channels 1+2 is done on odd/even frames for a consistent effect
+					mix = (i % MIX_RATE) == 0 #(i & 1) == 0
+					# random is no good, thought it might average out but it sounds , well random
+					#mix = random.random() < 0.5 
 
-			def retune(octaves, l,h,v):
+					# test code to see if modulo 3 any good, it wasn't
+					if False:
 
-				#if (octaves == 0):
-				#	print("  No transpose performed, octaves set to 0")
-				#	return
-					
-				print( "  tonehi=" + str(registers[h][i]) + ", tonelo=" + str(registers[l][i]))
+						if channel_mix == 0 and vol1 != 0:
+							channel_mix = (channel_mix + 1) % 3
 
-				tone_value = (registers[h][i] << 4) + registers[l][i] 
-				if tone_value > 0:
-					tone_freq = float(vgm.vgm_source_clock) / ( 2.0 * float(tone_value) * 16.0)
-					print("  Retune, Channel " + str(int(l/2)) + " tone=" + str(tone_value) + ", freq=" + str(tone_freq))
-					
-					# electron baseline is 122Hz not 244Hz as the AUG states.
-					baseline_freq = 1000000.0 / (32.0*256.0)
-					target_freq = tone_freq
-					retuned = 0
+						if channel_mix == 1 and vol2 != 0:
+							channel_mix = (channel_mix + 1) % 3
 
+						if channel_mix == 1 and vol3 != 0:
+							channel_mix = (channel_mix + 1) % 3
 
-					transpose = abs(octaves)
-					while retuned != transpose: # target_freq < baseline_freq:
-						if (octaves < 0):
-							target_freq /= 2.0
-						else:
-							target_freq *= 2.0
-						retuned += 1
+						
 
+						output_tone = (channel_mix % 3) + 1
+						print("output tone=" + str(output_tone))
+						channel_mix = (channel_mix + 1) % 3
+							
 
-					# if cant reach baseline freq, transpose once, then silence if still too low :(
-					if target_freq < baseline_freq:
-						print("  WARNING: Freq too low - Added " + str(1) + " octave(s) - from " + str(target_freq) + " to " + str(target_freq*2.0) + "Hz")
-						# better to just clamp low frequencies at the bottom, and risk tuning issues rather than transposition jumps
-						target_freq = baseline_freq #*= 2.0
-						retuned = 1
-						if target_freq < baseline_freq:
-							registers[v][i] = 15
-							print("   Tone " + str(i) + " silenced because frequency too low - " + str(target_freq))
-							#target_freq *= 2.0
-							#retuned += 1
+					if True:
 
+						# detect if channel 1 needs priority this frame
+						# - its volume is on, and the alternative frame mix flag is good
+						c1p = vol1 == 0 and mix
 
+						# don't give channel 2 priority if tone is the same and channel1 is playing
+						c1f = (frame[1] << 4) + frame[0] 
+						c2f = (frame[3] << 4) + frame[2] 
+						sametone = (c1f == c2f/2) or (c1f == c2f * 2) or (c1f == c2f)
+						sametone = sametone and (vol1 == vol2) and (vol1 == 0)
 
-					if retuned:
-						#print("  WARNING: Freq too low - Added " + str(retuned) + " octave(s) - from " + str(tone_freq) + " to " + str(target_freq) + "Hz")
-						tone_value = int( round( float(vgm.vgm_source_clock) / (2.0 * target_freq * 16.0 ) ) )
-						registers[h][i] = tone_value >> 4
-						registers[l][i] = tone_value & 15
+						if vol1 == 0 and sametone: #diff < 100: #frame[0] == frame[2] and frame[1] == frame[2] and vol1 == 0:
+							c1p = True
+							print("  NOTE: channel 1 & channel 2 have same tone")
 
-			# transpose
-			#if TRANSPOSE_OCTAVES > 0:
-			print(" Transposing ")
-			retune(VgmElectron.TRANSPOSE_OCTAVES1, 0,1,7)
-			retune(VgmElectron.TRANSPOSE_OCTAVES2, 2,3,8)
-			retune(VgmElectron.TRANSPOSE_OCTAVES3, 4,5,9)
+						
 
-			#--------------------------------------------------------------
-			# Step 3 - mix the 2 primary channels down to 1 channel
-			#--------------------------------------------------------------
-			# map channel 2 to channel 1
-			# noise channel is completely ignored
+						# replace channel 1 data with channel 2 data
+						# if, channel2 is active, but c1 doesn't have priority this frame
+						if vol2 == 0 and not c1p:# and vol1 != 0:
+							output_tone = 2
 
-			ENABLE_DOWNMIX = True
-			if ENABLE_DOWNMIX:
-				print(" Downmix channels ")
-				#print("Frame " + str(i))
+						# if no volume on tone1, we can look at channel 3 too
+						if USE_TONE3:
+							#if frame[7] == 15:
+							if vol1 == 15 and vol2 == 15 and vol3 == 0 and not mix:# and not c1p and output_tone != 2:
+								print("tone3 active")
+								output_tone = 3
 
-				vol1 = registers[7][i]
-				vol2 = registers[8][i]
-				vol3 = registers[9][i]
+				# pick which tone to output
+				if output_tone == 1:
+					# do nothing, because tone1 register frequency already setup
+					output_tone = 1
+				elif output_tone == 2:
+					# replace tone 1 frequency with tone 2 frequency
+					frame[0] = frame[2]
+					frame[1] = frame[3]
+					frame[7] = frame[8]
+				elif output_tone == 3:
+					# replace tone 1 frequency with tone 3 frequency
+					frame[0] = frame[4]
+					frame[1] = frame[5]
+					frame[7] = frame[9]
+				else:
+					print("UNHANDLED CASE - output_tone not set")
+
+
+	# returns the ULA byte for the frame
+	def ula_frame(self, frame, vgm):
+
+		# output ULA data
+		final_volume = frame[7]
+		ula_tone = 0 # zero is highest freq. so inaudible, so thats how we handle volume
+		if final_volume == 0:
+			final_tone1 = (frame[1] << 4) + frame[0] 
+			ula_tone = self.sn_to_electron(vgm, final_tone1)
+		return ula_tone
 
-				tone1_active = vol1 != 15
-				tone2_active = vol2 != 15
-				tone3_active = vol3 != 15
 
-				tone_active = tone1_active or tone2_active or tone3_active
+	#----------------------------------------------------------
+	# convert_frame(frame, i, vgm)
+	# Convert the 11 register values of frame number i to suit the Electron, in place
+	# returns the ULA byte for the frame
+	#----------------------------------------------------------
+	def convert_frame(self, frame, i, vgm):
 
-				if tone_active:
+		print("Frame " + str(i))
 
+		self.threshold_frame(frame)
+		self.retune_frame(frame, i, vgm)
+		self.downmix_frame(frame, i)
+		return self.ula_frame(frame, vgm)
 
-					print("  Tone active, mixing")
-					
-					output_tone = 1
-					
-
-					if self.USE_TECHNIQUE == 2:
-
-						c1f = (registers[1][i] << 4) + registers[0][i] 
-						c2f = (registers[3][i] << 4) + registers[2][i] 
-						c3f = (registers[5][i] << 4) + registers[4][i] 
-
-						active_channels = [ False, False, False ]
-						if tone1_active:
-							active_channels[0] = True
-							print("Channel 1 is active volume")
-						if tone2_active:
-							active_channels[1] = True
-							print("Channel 2 is active volume")
-						if tone3_active:
-							active_channels[2] = True
-							print("Channel 3 is active volume")
-
-						# any channels playing the same frequency are filtered out
-						if tone1_active and tone2_active and c2f == c1f:
-							active_channels[1] = False
-							print("Channel 2 is same freq as Channel 1, filtered")
-						if tone1_active and tone3_active and c3f == c1f:
-							active_channels[2] = False
-							print("Channel 3 is same freq as Channel 1, filtered")
-						if tone2_active and tone3_active and c2f == c3f:
-							active_channels[2] = False
-							print("Channel 3 is same freq as Channel 2, filtered")
-
-						channel_count = 0
-						if active_channels[0]: channel_count += 1
-						if active_channels[1]: channel_count += 1
-						if active_channels[2]: channel_count += 1
-
-						print("channel_count=" + str(channel_count))
-						output_mix = []
-						if active_channels[0]: output_mix.append(1)
-						if active_channels[1]: output_mix.append(2)
-						if active_channels[2]: output_mix.append(3)
-
-						mix = (i % channel_count)
-						output_tone = output_mix[mix]
-					
-					
-					if self.USE_TECHNIQUE == 1:
-						# interleaving of channels 1+2 is done on odd/even frames for a consistent effect
-						mix = (i % MIX_RATE) == 0 #(i & 1) == 0
-						# random is no good, thought it might average out but it sounds , well random
-						#mix = random.random() < 0.5 
-
-						# test code to see if modulo 3 any good, it wasn't
-						if False:
-
-							if channel_mix == 0 and vol1 != 0:
-								channel_mix = (channel_mix + 1) % 3
-
-							if channel_mix == 1 and vol2 != 0:
-								channel_mix = (channel_mix + 1) % 3
-
-							if channel_mix == 1 and vol3 != 0:
-								channel_mix = (channel_mix + 1) % 3
 
-							
+	# convert_frame() with each stage timed by the profiler
+	# kept apart from convert_frame() so that the conversion costs nothing extra when it isn't profiled
+	def convert_frame_profiled(self, frame, i, vgm):
 
-							output_tone = (channel_mix % 3) + 1
-							print("output tone=" + str(output_tone))
-							channel_mix = (channel_mix + 1) % 3
-								
+		print("Frame " + str(i))
 
-						if True:
+		profiler = self.profiler
+		profiler.begin("threshold")
+		self.threshold_frame(frame)
+		profiler.end(11, 11)
+		profiler.begin("retune")
+		self.retune_frame(frame, i, vgm)
+		profiler.end(11, 11)
+		profiler.begin("downmix")
+		self.downmix_frame(frame, i)
+		profiler.end(11, 11)
+		profiler.begin("ula_map")
+		ula_tone = self.ula_frame(frame, vgm)
+		profiler.end(11, 1)
+		return ula_tone
 
-							# detect if channel 1 needs priority this frame
-							# - its volume is on, and the alternative frame mix flag is good
-							c1p = vol1 == 0 and mix
 
-							# don't give channel 2 priority if tone is the same and channel1 is playing
-							c1f = (registers[1][i] << 4) + registers[0][i] 
-							c2f = (registers[3][i] << 4) + registers[2][i] 
-							sametone = (c1f == c2f/2) or (c1f == c2f * 2) or (c1f == c2f)
-							sametone = sametone and (vol1 == vol2) and (vol1 == 0)
+	#----------------------------------------------------------
+	# Memoised conversion
+	# With a cache, the whole tune is run through one stage at a time and the output of each stage is
+	# cached, keyed on a digest of its input and only the settings that stage uses. So changing the
+	# technique reuses the thresholded and retuned registers, and changing the output reuses all of
+	# the conversion.
+	#----------------------------------------------------------
 
-							if vol1 == 0 and sametone: #diff < 100: #registers[0][i] == registers[2][i] and registers[1][i] == registers[2][i] and vol1 == 0:
-								c1p = True
-								print("  NOTE: channel 1 & channel 2 have same tone")
+	# run a stage, or fetch its output from the cache
+	# convert(input_data) returns the stage output
+	def run_stage(self, cache, stage, settings, input_data, convert):
+
+		settings = dict(settings)
+		settings['version'] = VgmElectron.STAGE_VERSION
+		with self.profile_stage(VgmElectron.PROFILE_STAGES.get(stage, stage)):
+			key = cache.stage_key(stage, settings, input_data)
+			output = cache.load_stage(key)
+			if output is None:
+				print("Stage " + stage + " : cache miss")
+				output = convert(input_data)
+				cache.store_stage(key, output)
+			else:
+				print("Stage " + stage + " : cache hit")
+		if self.profiler is not None:
+			self.profiler.add(VgmElectron.PROFILE_STAGES.get(stage, stage), len(input_data), len(output))
+		return output
 
-							
 
-							# replace channel 1 data with channel 2 data
-							# if, channel2 is active, but c1 doesn't have priority this frame
-							if vol2 == 0 and not c1p:# and vol1 != 0:
-								output_tone = 2
-
-							# if no volume on tone1, we can look at channel 3 too
-							if USE_TONE3:
-								#if registers[7][i] == 15:
-								if vol1 == 15 and vol2 == 15 and vol3 == 0 and not mix:# and not c1p and output_tone != 2:
-									print("tone3 active")
-									output_tone = 3
-
-					# pick which tone to output
-					if output_tone == 1:
-						# do nothing, because tone1 register frequency already setup
-						output_tone = 1
-					elif output_tone == 2:
-						# replace tone 1 frequency with tone 2 frequency
-						registers[0][i] = registers[2][i]
-						registers[1][i] = registers[3][i]
-						registers[7][i] = registers[8][i]
-					elif output_tone == 3:
-						# replace tone 1 frequency with tone 3 frequency
-						registers[0][i] = registers[4][i]
-						registers[1][i] = registers[5][i]
-						registers[7][i] = registers[9][i]
-					else:
-						print("UNHANDLED CASE - output_tone not set")
+	# apply a conversion stage to each frame of a register matrix of 11 bytes per frame
+	# stage(frame, i) converts frame number i in place
+	# returns the converted matrix
+	def map_frames(self, registers, stage):
 
+		output = bytearray()
+		for n in range(0, len(registers), 11):
+			frame = bytearray(registers[n:n+11])
+			self.check_stop()
+			stage(frame, n // 11)
+			output.extend(frame)
+		return output
 
 
+	# convert a register matrix of 11 bytes per frame, a stage at a time
+	# returns (registers, ula_data)
+	def convert_memoised(self, cache, registers, vgm):
 
-			# output ULA data
-			final_volume = registers[7][i]
-			ula_tone = 0 # zero is highest freq. so inaudible, so thats how we handle volume
-			if final_volume == 0:
-				final_tone1 = (registers[1][i] << 4) + registers[0][i] 
-				ula_tone = sn_to_electron(final_tone1)
-			electron_data.append( ula_tone )
-				
+		clock = vgm.vgm_source_clock
 
-		# write to output ULA file
-		ula_file = open(dst_filename + ".ula.bin", 'wb')
-		ula_file.write(electron_data)
-		ula_file.close()
+		settings = {
+			'attenuation': [ VgmElectron.ATTENTUATION_THRESHOLD1, VgmElectron.ATTENTUATION_THRESHOLD2, VgmElectron.ATTENTUATION_THRESHOLD3 ],
+			'channels': [ VgmElectron.ENABLE_CHANNEL1, VgmElectron.ENABLE_CHANNEL2, VgmElectron.ENABLE_CHANNEL3 ],
+		}
+		registers = self.run_stage(cache, "threshold", settings, registers, lambda data: self.map_frames(data, lambda frame, i: self.threshold_frame(frame)))
 
+		settings = {
+			'transpose': [ VgmElectron.TRANSPOSE_OCTAVES1, VgmElectron.TRANSPOSE_OCTAVES2, VgmElectron.TRANSPOSE_OCTAVES3 ],
+			'clock': clock,
+		}
+		registers = self.run_stage(cache, "retune", settings, registers, lambda data: self.map_frames(data, lambda frame, i: self.retune_frame(frame, i, vgm)))
 
+		settings = {
+			'technique': self.USE_TECHNIQUE,
+			'downmix': VgmElectron.ENABLE_DOWNMIX,
+			'tone3': VgmElectron.ENABLE_CHANNEL3,
+		}
+		registers = self.run_stage(cache, "downmix", settings, registers, lambda data: self.map_frames(data, self.downmix_frame))
+
+		settings = {
+			'clock': clock,
+		}
+		ula_data = self.run_stage(cache, "ula", settings, registers, lambda data: bytearray([ self.ula_frame(bytearray(data[n:n+11]), vgm) for n in range(0, len(data), 11) ]))
+
+		return registers, ula_data
+
+
+	#----------------------------------------------------------
+	# Parallel conversion
+	# Apart from the frame number driving the arpeggiator in the downmix, the conversion of a frame
+	# only depends on its own registers. The register state of every frame comes from the serial
+	# unpacking of the VGM, so each chunk of frames can be converted on its own, given the number of
+	# its first frame, and the results are the same as a serial conversion.
+	#----------------------------------------------------------
+
+	# convert a register matrix of 11 bytes per frame on JOBS processes
+	# returns (registers, ula_data)
+	def convert_parallel(self, registers, vgm):
+
+		# the workers need the conversion options, which may have been changed from the class defaults
+		settings = { k : getattr(VgmElectron, k) for k in dir(VgmElectron) if k.isupper() }
+
+		chunk_size = VgmElectron.CHUNK_FRAMES * 11
+		chunks = [ registers[n:n+chunk_size] for n in range(0, len(registers), chunk_size) ]
+		first_frames = [ n * VgmElectron.CHUNK_FRAMES for n in range(len(chunks)) ]
+
+		print("Converting " + str(len(registers) // 11) + " frames in " + str(len(chunks)) + " chunks on " + str(VgmElectron.JOBS) + " processes")
+
+		output_registers = bytearray()
+		ula_data = bytearray()
+		from concurrent.futures import ProcessPoolExecutor
+		with ProcessPoolExecutor(max_workers = VgmElectron.JOBS) as executor:
+			n = len(chunks)
+			for chunk_registers, chunk_ula in executor.map(convert_chunk, [ settings ] * n, [ vgm.vgm_source_clock ] * n, first_frames, chunks):
+				output_registers.extend(chunk_registers)
+				ula_data.extend(chunk_ula)
+
+		return output_registers, ula_data
+
+
+	# returns the emit_vgm() chunks for a list of (registers, loop_start) frames, cached as a stage
+	def emit_memoised(self, cache, frames, sample_interval):
+
+		input_data = bytearray()
+		for registers, loop_start in frames:
+			input_data.extend(registers)
+			input_data.append(loop_start)
+
+		# chunks are merged up to the loop start, and stored as [length][samples][dd] * length, with length -1 for the loop start
+		def emit(input_data):
+			output = bytearray()
+			data = bytearray()
+			samples = 0
+			for chunk, chunk_samples in self.emit_vgm(frames, sample_interval):
+				if chunk is None:
+					output.extend(struct.pack('<iI', len(data), samples))
+					output.extend(data)
+					output.extend(struct.pack('<iI', -1, 0))
+					data = bytearray()
+					samples = 0
+				else:
+					data.extend(chunk)
+					samples += chunk_samples
+			output.extend(struct.pack('<iI', len(data), samples))
+			output.extend(data)
+			return output
+
+		settings = {
+			'downmix': VgmElectron.ENABLE_DOWNMIX,
+			'sample_interval': sample_interval,
+		}
+		output = self.run_stage(cache, "vgm", settings, input_data, emit)
+
+		chunks = []
+		n = 0
+		while n < len(output):
+			length, samples = struct.unpack_from('<iI', output, n)
+			n += 8
+			if length < 0:
+				chunks.append( (None, 0) )
+			else:
+				chunks.append( (output[n:n+length], samples) )
+				n += length
+		return chunks
+
+
+	#----------------------------------------------------------
+	# emit_vgm(frames, sample_interval)
+	# Generator for the Electron VGM commands, given (registers, loop_start) for each converted frame
+	# yields (bytes, samples) chunks, where samples is the wait time in the chunk, and (None, 0) at the loop start
+	#----------------------------------------------------------
+	def emit_vgm(self, frames, sample_interval):
 
-		#--------------------------------------------------------------
-		# Final stage - output to vgm
-		#--------------------------------------------------------------
-		
 		#           Tone1-----  Tone2-----  Tone3-----  Tone4 Vol1  Vol2  Vol3  Vol4
 		control = [ 0x80, 0x00, 0xa0, 0x00, 0xc0, 0x00, 0xe0, 0x90, 0xb0, 0xd0, 0xf0 ]
 		#filter = [ 0,1,2,3,7,8 ]
 		#filter = [ 2,3,8 ]
 		#filter = [ 0,1,2,3,4,5,6,7,8,9,10 ]
 		filter = [ 0,1,2,3,4,5,7,8,9 ]
-		if ENABLE_DOWNMIX:
+		if VgmElectron.ENABLE_DOWNMIX:
 			filter = [ 0,1,7 ]
-		
 
-
-		last_tone3 = 255
-		for i in range(len(registers[0])):
+		# latched register state of the chip, so that only changed registers are written
+		# None means unknown, so everything gets written on the first frame
+		latched = [ None ] * 11
+		pending_wait = 0
+		for registers, loop_start in frames:
+
+			vgm_stream = bytearray()
+			samples = 0
+
+			# the loop can be entered from the end of the tune, so every register is written again at the loop start
+			if loop_start:
+				samples += pending_wait
+				pending_wait = self.write_wait(vgm_stream, pending_wait, sample_interval)
+				yield vgm_stream, samples
+				yield None, 0
+				vgm_stream = bytearray()
+				samples = 0
+				latched = [ None ] * 11
 
 			# 11 registers per frame
 			# Tone 0 HL Tone 1 HL Tone 2 HL Tone 3 Vol 0123
 			for r in range(11):
-				register_data = registers[r][i]
-				
-				# dont update noise register unless different
 
-				update = True
-				if r == 6:
-					if register_data == last_tone3:
-						update = False
-					else:
-						last_tone3 = register_data
+				if not r in filter:
+					continue
+
+				register_data = registers[r]
+
+				# tone high bits are written as a data byte after the latch byte for the low bits
+				if r in [1,3,5]:
+					continue
+
+				if r in [0,2,4]:
+					hi = registers[r+1]
+					update_hi = (r+1) in filter and hi != latched[r+1]
+					if register_data != latched[r] or update_hi:
+						samples += pending_wait
+						pending_wait = self.write_wait(vgm_stream, pending_wait, sample_interval)
+						# latch byte sets the low 4 bits, the high 6 bits are left as they are
+						vgm_stream.extend( struct.pack('B', 0x50) ) # COMMAND
+						vgm_stream.extend( struct.pack('B', register_data | control[r]) ) # DATA
+						latched[r] = register_data
+						if update_hi:
+							vgm_stream.extend( struct.pack('B', 0x50) ) # COMMAND
+							vgm_stream.extend( struct.pack('B', hi | control[r+1]) ) # DATA
+							latched[r+1] = hi
+					continue
+
+				# noise and volume registers are a single latch byte
+				if register_data != latched[r]:
+					samples += pending_wait
+					pending_wait = self.write_wait(vgm_stream, pending_wait, sample_interval)
+					vgm_stream.extend( struct.pack('B', 0x50) ) # COMMAND
+					vgm_stream.extend( struct.pack('B', register_data | control[r]) ) # DATA
+					latched[r] = register_data
 
-			
+			if len(vgm_stream):
+				yield vgm_stream, samples
 
-				if not r in filter:
-					update = False
+			# next frame, waits are held back and merged until the next register write
+			pending_wait += sample_interval
 
-				if update:
-					register_data |= control[r]
-					vgm_stream.extend( struct.pack('B', 0x50) ) # COMMAND
-					vgm_stream.extend( struct.pack('B', register_data) ) # DATA
+		vgm_stream = bytearray()
+		samples = pending_wait
+		self.write_wait(vgm_stream, pending_wait, sample_interval)
 
-			# next frame
-			if sample_interval == 882: # wait 50
-				vgm_stream.extend( struct.pack('B', 0x63) ) 
-			elif sample_interval == 735: # wait 60
-				vgm_stream.extend( struct.pack('B', 0x62) ) 
-			else:
-				vgm_stream.extend( struct.pack('B', 0x61) ) 
-				vgm_stream.extend( struct.pack('B', int(sample_interval % 256)) ) 
-				vgm_stream.extend( struct.pack('B', int(sample_interval / 256)) )                         
-	
-		
 		# END command
 		vgm_stream.extend( struct.pack('B', 0x66) ) 
+		yield vgm_stream, samples
 
 
+	#----------------------------------------------------------
+	# Process(filename)
+	# Convert the given VGM file to an electron VGM file
+	# src_filename '-' reads the VGM (or VGZ) from stdin, and dst_filename '-' writes
+	# just the ULA data or the electron VGM (see PIPE_FORMAT) to stdout
+	#----------------------------------------------------------
+	def process(self, src_filename, dst_filename):
+
+		# load the VGM file, or alternatively interpret as a binary
+		if src_filename != '-' and src_filename.lower()[-4:] not in [".vgm", ".vgz"]:
+			print("ERROR: Not a VGM source")
+			return
 
+		# time each stage of the conversion, or trace its memory use
+		# (a conversion that failed may have left its profiler running)
+		if self.profiler is not None:
+			self.profiler.finish()
+		profiler = None
+		if VgmElectron.PROFILE or VgmElectron.PROFILE_MEMORY:
+			from modules.vgmprofile import StageProfiler
+			profiler = StageProfiler(src_filename, VgmElectron.PROFILE_MEMORY)
+		self.profiler = profiler
+
+		# the VGM is read a command at a time as the conversion runs
+		with self.profile_stage("load"):
+			vgm = VgmStream(src_filename, True)
+		if profiler is not None and src_filename != '-':
+			profiler.add("load", os.path.getsize(src_filename), 0)
+
+		play_rate = vgm.metadata['rate']
+		print("play_rate="+str(play_rate))
 
+		# convert the register data to a vgm stream
+		sample_interval = int(44100 / play_rate) # 882 # 50hz - TODO: use frame rate
+		print("sample_interval=" + str(sample_interval))
 
+		#----------------------------------------------------------
+		# Unpack the register data into 11 register values per frame
+		#----------------------------------------------------------
+
+		# reuse the register data from the parse cache if this VGM has been converted before
+		cache = None
+		cache_entry = None
+		if VgmElectron.CACHE_DIR != None and src_filename != '-':
+			with self.profile_stage("cache"):
+				from modules.vgmcache import VgmCache
+				cache = VgmCache(VgmElectron.CACHE_DIR, VgmElectron.CACHE_SIZE)
+				cache.VERBOSE = self.VERBOSE
+				cache_key = cache.key(src_filename)
+				cache_entry = cache.load(cache_key)
+
+		# the parsing generators, timed by the profiler if there is one
+		def iter_packets():
+			if profiler is None:
+				return vgm.iter_packets()
+			command_size = lambda q: 1 + len(q['data'] or b'')
+			commands = profiler.iter("parse_commands", vgm.iter_commands(), command_size, size_in = command_size)
+			return profiler.iter("as_binary", vgm.iter_packets(commands), lambda packet: 1 + len(packet), "parse_commands")
+		def iter_register_frames(packets):
+			if profiler is None:
+				return self.iter_register_frames(packets, True)
+			return profiler.iter("split_raw", self.iter_register_frames(packets, True), lambda frame: 11, "as_binary")
+
+		if cache_entry is not None:
+			print("Using cached register data")
+			registers, vgm.loop_frame = cache_entry
+			frames = cache.iter_register_frames(registers)
+			if profiler is not None:
+				frames = profiler.iter("cache", frames, lambda frame: 11)
+		elif cache is not None:
+			# note the registers as they go by, to add to the cache once the conversion is done
+			cache_registers = bytearray()
+			def record_registers(frames):
+				for frame in frames:
+					cache_registers.extend(frame)
+					yield frame
+			frames = record_registers(iter_register_frames(iter_packets()))
+		else:
+			frames = iter_register_frames(iter_packets())
+
+		# frame to loop back to at the end of the tune, or None if it doesn't loop
+		# the loop frame in the VGM metadata is only known once the conversion has read that far
+		loop_frame = None
+
+		# output length in samples if it is cut short of the source, otherwise None
+		total_samples = None
+
+		# find a repeating tail in the source register data of tunes without loop metadata, and cut them to one iteration
+		# the arpeggiator is driven by the frame number, so the converted output only repeats exactly when the loop length
+		# is a multiple of its cycle - 2 frames for technique 1 and the active channel count for technique 2, so the
+		# detector only takes multiples of 6 frames for technique 2
+		# the whole tune has to be read in to do this
+		if VgmElectron.DETECT_LOOPS and vgm.loop_position is None:
+			rows = list(frames)
+			frames = len(rows)
+			with self.profile_stage("loop_detect"):
+				from modules.loopdetect import LoopDetector
+				detector = LoopDetector()
+				detector.TOLERANCE = VgmElectron.LOOP_TOLERANCE
+				detector.PERIOD_STEP = VgmElectron.ARPEGGIO_CYCLE.get(self.USE_TECHNIQUE, 6)
+				detector.VERBOSE = self.VERBOSE
+				loop = detector.detect(rows)
+			if loop is None:
+				print("No loop found")
+			else:
+				end, loop_frame = loop
+				print("Loop found, " + str(frames) + " frames cut to " + str(end) + " looping back to frame " + str(loop_frame))
+				rows = rows[:end]
+				total_samples = end * sample_interval
+			frames = iter(rows)
+
+		#----------------------------------------------------------
+		# Begin VGM conversion to Electron
+		#----------------------------------------------------------
+
+        # Filter out channels we do not need
+        # Modify all volumes to full or none
+        # Interleave sound to a single channel
+        # output final VGM
+
+		# yields (registers, ula_tone, loop_start) for each converted frame
+		convert_frame = self.convert_frame if profiler is None else self.convert_frame_profiled
+		def convert(frames):
+			nonlocal loop_frame
+			for i, frame in enumerate(frames):
+				if loop_frame is None and vgm.loop_frame == i:
+					loop_frame = i
+					print("loop_frame=" + str(loop_frame))
+				self.check_stop()
+				ula_tone = convert_frame(frame, i, vgm)
+				yield frame, ula_tone, i == loop_frame
+
+		if cache is not None or VgmElectron.JOBS > 1:
+			# the whole tune is unpacked first, then goes through each stage in turn so that the stage outputs
+			# can be cached, or is converted in chunks on several processes
+			registers = bytearray()
+			for frame in frames:
+				registers.extend(frame)
+			if loop_frame is None and vgm.loop_frame is not None:
+				loop_frame = vgm.loop_frame
+				print("loop_frame=" + str(loop_frame))
+			if cache is not None:
+				# the stages are cached over the whole tune, so they aren't split into chunks
+				if VgmElectron.JOBS > 1:
+					print("WARNING: -j is ignored with --cache, the conversion stages run in this process")
+				registers, ula_data = self.convert_memoised(cache, registers, vgm)
+			else:
+				with self.profile_stage("parallel_convert"):
+					registers, ula_data = self.convert_parallel(registers, vgm)
+				if profiler is not None:
+					profiler.add("parallel_convert", len(registers), len(registers) + len(ula_data))
+			converted = [ (registers[i*11:i*11+11], ula_data[i], i == loop_frame) for i in range(len(ula_data)) ]
+		else:
+			converted = convert(frames)
+			if profiler is not None:
+				# the frame loop and conversion log
+				converted = profiler.iter("convert", converted)
+
+		# trim silent frames from the start and end of the tune
+		# the whole tune has to be converted before the end can be trimmed
+		if VgmElectron.TRIM_SILENCE:
+			converted = list(converted)
+			electron_data = bytearray([ c[1] for c in converted ])
+			frames = len(electron_data)
+			first = frames - len(electron_data.lstrip(b'\x00'))
+			last = len(electron_data.rstrip(b'\x00'))
+			if loop_frame is not None:
+				# silence at the end of a looping tune is part of the loop, and the loop can't start in the cut
+				last = frames
+				first = min(first, loop_frame)
+			if last <= first:
+				print("Tune is silent, nothing to trim")
+			elif first > 0 or last < frames:
+				print("Trimmed " + str(first) + " silent frames from the start and " + str(frames - last) + " from the end")
+				converted = converted[first:last]
+				if loop_frame is not None:
+					loop_frame -= first
+					converted = [ (c[0], c[1], i == loop_frame) for i, c in enumerate(converted) ]
+				total_samples = len(converted) * sample_interval
+
+			# sidecar file so that events in the original tune can still be synced to the trimmed one
+			trim = {
+				'source_frames': frames,
+				'leading_frames': first if last > first else 0,
+				'trailing_frames': frames - last if last > first else 0,
+				'frames': len(converted),
+				'sample_interval': sample_interval,
+			}
+			import json
+			if dst_filename != '-':
+				trim_file = open(dst_filename + ".trim.json", 'w')
+				json.dump(trim, trim_file, indent = 1, sort_keys = True)
+				trim_file.close()
+			else:
+				print("Trim offsets " + json.dumps(trim, sort_keys = True))
+
+		# the ULA data is only kept in memory if something needs the whole stream
+		keep_ula_data = VgmElectron.KEEP_ULA_DATA or VgmElectron.COMPRESS_ULA or VgmElectron.ENCODE_ULA_RLE or VgmElectron.ENCODE_ULA_PATTERNS
+		keep_ula_data = keep_ula_data or VgmElectron.RAM_BUDGET != None or VgmElectron.CYCLE_BUDGET != None
+		electron_data = None
+		if keep_ula_data:
+			electron_data = bytearray()
+
+		# when piping, only one of the outputs goes to stdout
+		# (the original stdout, since the log is sent to stderr so that it doesn't mix with the data)
+		pipe_file = None
+		write_ula_file = True
+		write_vgm_file = True
+		if dst_filename == '-':
+			pipe_file = sys.__stdout__.buffer
+			write_ula_file = VgmElectron.PIPE_FORMAT == 'ula'
+			write_vgm_file = VgmElectron.PIPE_FORMAT == 'vgm'
+
+		# write to output ULA file as the frames are converted, passing the registers on to the VGM output
+		ula_file = None
+		if write_ula_file:
+			ula_file = pipe_file if pipe_file else open(dst_filename + ".ula.bin", 'wb')
+		def write_ula(converted):
+			for registers, ula_tone, loop_start in converted:
+				if ula_file:
+					ula_file.write( struct.pack('B', ula_tone) )
+				if electron_data is not None:
+					electron_data.append( ula_tone )
+				yield registers, loop_start
+
+		#--------------------------------------------------------------
+		# Final stage - output to vgm
+		#--------------------------------------------------------------
+		frames = write_ula(converted)
+		if profiler is not None:
+			# the ULA data, and the VGM data if it is written
+			frames = profiler.iter("write", frames, source = "vgm_emit", size_in = lambda frame: 1)
+
+		if not write_vgm_file:
+			for frame in frames:
+				pass
+		else:
+			if cache is not None:
+				chunks = self.emit_memoised(cache, list(frames), sample_interval)
+			else:
+				chunks = self.emit_vgm(frames, sample_interval)
+				if profiler is not None:
+					chunks = profiler.iter("vgm_emit", chunks, lambda chunk: len(chunk[0]) if chunk[0] is not None else 0, "downmix")
+
+			with self.profile_stage("write"):
+				if pipe_file:
+					vgm.write_vgm_stream(chunks, pipe_file, total_samples)
+				else:
+					vgm.write_vgm_chunks(chunks, dst_filename, total_samples)
+
+		# [0x01][lo][hi] end of stream marker, telling the player which frame to loop back to, or 0xffff to stop
+		# the encoded ULA files carry it after their own end of data
+		loop_marker = struct.pack('<BH', VgmElectron.ULA_LOOP_MARKER, loop_frame if loop_frame is not None else VgmElectron.ULA_NO_LOOP)
+
+		if ula_file:
+			ula_file.write(loop_marker)
+			if not pipe_file:
+				ula_file.close()
+
+		if pipe_file:
+			pipe_file.flush()
+
+		if profiler is not None and not pipe_file:
+			profiler.add("write", 0, os.path.getsize(dst_filename) + os.path.getsize(dst_filename + ".ula.bin"))
+
+		if cache is not None and cache_entry is None:
+			with self.profile_stage("cache"):
+				cache.store(cache_key, cache_registers, vgm.loop_frame)
+
+		# write compressed ULA file
+		if VgmElectron.COMPRESS_ULA:
+			with self.profile_stage("lz"):
+				from modules.ulacompress import UlaCompressor
+				compressor = UlaCompressor()
+				ula_lz = compressor.compress(electron_data)
+				compressor.report(electron_data, ula_lz)
+				lz_file = open(dst_filename + ".ula.lz", 'wb')
+				lz_file.write(ula_lz)
+				lz_file.write(loop_marker)
+				lz_file.close()
+			if profiler is not None:
+				profiler.add("lz", len(electron_data), len(ula_lz))
+
+		# write palette run length encoded ULA file
+		if VgmElectron.ENCODE_ULA_RLE:
+			with self.profile_stage("rle"):
+				from modules.ulapalette import UlaPaletteCompressor
+				encoder = UlaPaletteCompressor()
+				ula_rle = encoder.compress(electron_data)
+				encoder.report(electron_data, ula_rle)
+				rle_file = open(dst_filename + ".ula.rle", 'wb')
+				rle_file.write(ula_rle)
+				rle_file.write(loop_marker)
+				rle_file.close()
+			if profiler is not None:
+				profiler.add("rle", len(electron_data), len(ula_rle))
+
+		# write pattern table + order list ULA file
+		if VgmElectron.ENCODE_ULA_PATTERNS:
+			with self.profile_stage("patterns"):
+				from modules.ulapatterns import UlaPatternCompressor
+				encoder = UlaPatternCompressor()
+				ula_pat = encoder.compress(electron_data)
+				encoder.report(electron_data, ula_pat)
+				pat_file = open(dst_filename + ".ula.pat", 'wb')
+				pat_file.write(ula_pat)
+				pat_file.write(loop_marker)
+				pat_file.close()
+			if profiler is not None:
+				profiler.add("patterns", len(electron_data), len(ula_pat))
+
+		# write the smallest ULA encoding that fits the RAM and cycle budgets
+		if VgmElectron.RAM_BUDGET != None or VgmElectron.CYCLE_BUDGET != None:
+			with self.profile_stage("budget"):
+				from modules.ulabudget import UlaBudgetSelector
+				selector = UlaBudgetSelector(VgmElectron.BUDGET_CACHE)
+				selector.VERBOSE = self.VERBOSE
+				best, fits, ula_best = selector.report(electron_data, VgmElectron.RAM_BUDGET, VgmElectron.CYCLE_BUDGET)
+				if best['codec'] != 'raw':
+					best_file = open(dst_filename + selector.get_codec(best['codec'], best['params']).EXTENSION, 'wb')
+					best_file.write(ula_best)
+					best_file.write(loop_marker)
+					best_file.close()
+
+		# stage timings and memory use, alongside the outputs
+		if profiler is not None:
+			self.profiler = None
+			profiler.frames = profiler.items("write")
+			profiler.finish()
+			if VgmElectron.PROFILE:
+				profiler.print_report()
+				profiler.write_report(dst_filename + ".profile.json")
+				profiler.write_trace(dst_filename + ".trace.json")
+			if VgmElectron.PROFILE_MEMORY:
+				profiler.print_memory_report()
+				profiler.write_memory_report(dst_filename + ".memory.json")
+
+		return electron_data
+
+
+
+	#----------------------------------------------------------
+	# write_wait(vgm_stream, samples, sample_interval)
+	# Append the shortest run of VGM wait commands for the given number of samples
+	# 0x62/0x63 for a single 60Hz/50Hz frame, 0x7n for 1-16 samples, otherwise 0x61 nnnn for up to 65535
+	# waits longer than 65535 samples are split on a frame boundary, so that the frames stay aligned when parsed
+	# returns 0, the number of samples still to wait
+	#----------------------------------------------------------
+
+	def write_wait(self, vgm_stream, samples, sample_interval):
+
+		max_wait = (65535 // sample_interval) * sample_interval
+
+		while samples > 0:
+			if samples == 735: # wait 60
+				vgm_stream.extend( struct.pack('B', 0x62) )
+				samples = 0
+			elif samples == 882: # wait 50
+				vgm_stream.extend( struct.pack('B', 0x63) )
+				samples = 0
+			elif samples <= 16:
+				vgm_stream.extend( struct.pack('B', 0x70 + samples - 1) )
+				samples = 0
+			else:
+				wait = min(samples, max_wait)
+				vgm_stream.extend( struct.pack('B', 0x61) )
+				vgm_stream.extend( struct.pack('<H', wait) )
+				samples -= wait
+		return 0
+
+
+	#----------------------------------------------------------
+	# write_shared(tunes, bank_filename)
+	# Build one pattern bank shared by several converted tunes
+	# tunes is a list of (dst_filename, electron_data) pairs as returned by process()
+	# Writes the bank to bank_filename and an order list for each tune to <dst_filename>.ula.ord
+	#----------------------------------------------------------
+	def write_shared(self, tunes, bank_filename):
 
+		from modules.ulapatterns import UlaPatternCompressor
+		encoder = UlaPatternCompressor()
+		bank, orders = encoder.compress_shared([ t[1] for t in tunes ])
 
+		bank_file = open(bank_filename, 'wb')
+		bank_file.write(bank)
+		bank_file.close()
+		print("Shared pattern bank '" + bank_filename + "' is " + str(len(bank)) + " bytes, " + str(bank[0] | (bank[1] << 8)) + " patterns")
 
+		shared_size = len(bank)
+		separate_size = 0
+		for (dst_filename, electron_data), order in zip(tunes, orders):
 
+			if encoder.decode_frames(bank, order)[0] != electron_data:
+				print("ERROR: Shared pattern bank verify failed for '" + dst_filename + "'")
 
-		vgm.write_vgm(vgm_stream, dst_filename)
+			order_file = open(dst_filename + ".ula.ord", 'wb')
+			order_file.write(order)
+			order_file.close()
 
-		#output = bytearray()
+			separate = len(encoder.compress(electron_data))
+			print("  '" + dst_filename + ".ula.ord' is " + str(len(order)) + " bytes (" + str(separate) + " bytes as a separate .ula.pat)")
 
-		# write the electron vgm file
-		#open(dst_filename, "wb").write( output )
+			shared_size += len(order)
+			separate_size += separate
+
+		print("Shared total " + str(shared_size) + " bytes, separate total " + str(separate_size) + " bytes")
 
 
 #------------------------------------------------------------------------
@@ -650,12 +1220,8 @@ import argparse
 
 
 
-# Determine if running as a script
-if __name__ == '__main__':
-
-	print("Vgm2Electron.py : VGM music converter for Acorn Electron")
-	print("Written in 2019 by Simon Morris, https://github.com/simondotm/vgm-packer")
-	print("")
+# returns the command line parser
+def get_parser():
 
 	epilog_string = ""
 
@@ -663,27 +1229,44 @@ if __name__ == '__main__':
 		formatter_class=argparse.RawDescriptionHelpFormatter,
 		epilog=epilog_string)
 
-	parser.add_argument("input", help="VGM source file (must be single SN76489 PSG format) [input]")
-	parser.add_argument("-o", "--output", metavar="<output>", help="write VGC file <output> (default is '[input].vgc')")
+	parser.add_argument("input", nargs="*", help="VGM source file(s) (must be single SN76489 PSG format) [input], or '-' to read a VGM or VGZ from stdin")
+	parser.add_argument("-o", "--output", metavar="<output>", help="write VGC file <output> (default is '[input].vgc'), only valid with a single input. '-' writes to stdout (the default for stdin)")
+	parser.add_argument("-f", "--format", default="ula", choices=["ula", "vgm"], help="Output written to stdout with '-o -', the ULA data or the electron VGM, default: ula")
 	parser.add_argument("-v", "--verbose", help="Enable verbose mode", action="store_true")
-	parser.add_argument("-a", "--attenuation", default="444", metavar="<nnn>", help="Set attenuation threshold for each channel, 3 character string where each character is 0-F and 0 is loudest, 4 is 50%, F is quietest, default: 444")
+	parser.add_argument("-a", "--attenuation", default="444", metavar="<nnn>", help="Set attenuation threshold for each channel, 3 character string where each character is 0-F and 0 is loudest, 4 is 50%%, F is quietest, default: 444")
 	parser.add_argument("-t", "--transpose", default="000", metavar="<nnn>", help="Set octaves to transpose for each channel, where 1 is +1 octave and F is -1 octave.")
 	parser.add_argument("-c", "--channels", default="123", metavar="[1][2][3]", help="Set which channels will be included in the conversion, default 123, which means all 3 channels")
 	parser.add_argument("-q", "--technique", default=2, metavar="<n>", help="Set which downmix technique to use 1 or 2.")
-
-	args = parser.parse_args()
-
-
-	src = args.input
-	dst = args.output
-	if dst == None:
-		dst = os.path.splitext(src)[0] + ".electron.vgm"
+	parser.add_argument("-z", "--compress", help="Also output an LZ compressed ULA data file '[output].ula.lz'", action="store_true")
+	parser.add_argument("-r", "--rle", help="Also output a palette + run length encoded ULA data file '[output].ula.rle'", action="store_true")
+	parser.add_argument("-p", "--patterns", help="Also output a pattern table + order list ULA data file '[output].ula.pat'", action="store_true")
+	parser.add_argument("-x", "--trim", help="Trim silence from the start and end of the output, writing the frame offsets to '[output].trim.json'", action="store_true")
+	parser.add_argument("-l", "--loop", help="Detect loops in tunes without loop metadata and only output one iteration", action="store_true")
+	parser.add_argument("--loop-tolerance", type=int, default=0, metavar="<n>", help="Allow <n> mismatching frames when detecting loops, default: 0")
+	parser.add_argument("-m", "--ram", type=lambda x: int(x, 0), metavar="<bytes>", help="RAM budget for the ULA data and player, output the smallest encoding that fits")
+	parser.add_argument("-b", "--cycles", type=int, metavar="<n>", help="Budget of 6502 cycles per frame for the player, output the smallest encoding that fits")
+	parser.add_argument("--budget-cache", metavar="<file>", help="Keep budget trial encodes in JSON file <file> between runs")
+	parser.add_argument("--cache", metavar="<dir>", help="Cache parsed VGM data in directory <dir>, so converting the same VGM again with new settings skips the parsing")
+	parser.add_argument("--cache-size", type=int, default=64, metavar="<MB>", help="Max size of the parse cache, least recently used entries are deleted first, default: 64")
+	parser.add_argument("-w", "--watch", help="Keep running, and convert each input (or VGM in an input directory) again whenever it changes", action="store_true")
+	parser.add_argument("--server", help="Handle JSON-lines conversion requests from stdin (or the socket set by --socket) on a pool of worker processes", action="store_true")
+	parser.add_argument("--socket", metavar="<path>", help="Listen for --server requests on Unix socket <path> instead of stdin")
+	parser.add_argument("-j", "--jobs", type=int, metavar="<n>", help="Number of worker processes, to convert each tune in chunks in parallel (default: 1), or for --server (default: one per CPU)")
+	parser.add_argument("--profile", help="Time each stage of the conversion, writing a report to '[output].profile.json' and a Chrome trace to '[output].trace.json'", action="store_true")
+	parser.add_argument("--memory", help="Trace the memory used by each stage of the conversion, writing a report to '[output].memory.json'", action="store_true")
+	parser.add_argument("-s", "--shared", metavar="<bank>", help="Build one pattern bank <bank> shared by all the inputs, plus an order list '[output].ula.ord' for each")
+
+	return parser
+
+
+# set the VgmElectron options from parsed command line args (or a Namespace with the same fields)
+# raises ValueError if an option is invalid
+def apply_args(args):
 
 	# attenuation options
 	attenuation = args.attenuation
 	if (len(attenuation) != 3):
-		print("ERROR: attenuation must be 3 values eg. '444'")
-		sys.exit()
+		raise ValueError("attenuation must be 3 values eg. '444'")
 	#print("attenuation=" + attenuation)
 	VgmElectron.ATTENTUATION_THRESHOLD1 = int(attenuation[0],16)
 	VgmElectron.ATTENTUATION_THRESHOLD2 = int(attenuation[1],16)
@@ -692,8 +1275,7 @@ if __name__ == '__main__':
 	# transpose options
 	transpose = args.transpose
 	if (len(transpose) != 3):
-		print("ERROR: transpose must be 3 values eg. '000'")
-		sys.exit()
+		raise ValueError("transpose must be 3 values eg. '000'")
 	#print("transpose=" + transpose)
 	#         0 1 2 3 4 5 6 7  8  9  a  b  c  d  e  f
 	ttable = [0,1,2,3,4,5,6,7,-8,-7,-6,-5,-4,-3,-2,-1]
@@ -715,14 +1297,323 @@ if __name__ == '__main__':
 	VgmElectron.USE_TECHNIQUE = int(args.technique)
 	print("Using technique " + str(VgmElectron.USE_TECHNIQUE))
 
-	# check for missing files
-	if not os.path.isfile(src):
-		print("ERROR: File '" + src + "' not found")
+	# compression
+	VgmElectron.COMPRESS_ULA = args.compress
+	VgmElectron.ENCODE_ULA_RLE = args.rle
+	VgmElectron.ENCODE_ULA_PATTERNS = args.patterns
+	VgmElectron.TRIM_SILENCE = args.trim
+	VgmElectron.DETECT_LOOPS = args.loop
+	VgmElectron.LOOP_TOLERANCE = args.loop_tolerance
+	VgmElectron.RAM_BUDGET = args.ram
+	VgmElectron.CYCLE_BUDGET = args.cycles
+	VgmElectron.BUDGET_CACHE = args.budget_cache
+	VgmElectron.KEEP_ULA_DATA = args.shared != None
+	VgmElectron.PIPE_FORMAT = args.format
+	VgmElectron.CACHE_DIR = args.cache
+	VgmElectron.CACHE_SIZE = args.cache_size * 1024 * 1024
+	VgmElectron.JOBS = args.jobs if args.jobs != None else 1
+	VgmElectron.PROFILE = args.profile
+	VgmElectron.PROFILE_MEMORY = args.memory
+
+
+#------------------------------------------------------------------------
+# Chunk worker
+#------------------------------------------------------------------------
+
+# the conversion only needs the clock from the source VGM
+class ChunkSource:
+	def __init__(self, clock):
+		self.vgm_source_clock = clock
+
+
+# convert a chunk of a register matrix for VgmElectron.convert_parallel(), in a worker process
+# settings is a dict of the VgmElectron class options, first_frame the frame number of the start of the chunk
+# returns (registers, ula_data)
+def convert_chunk(settings, clock, first_frame, registers):
+
+	# the per frame conversion log from several processes at once would just be noise
+	log = sys.stdout
+	sys.stdout = open(os.devnull, 'w')
+	try:
+		for k, v in settings.items():
+			setattr(VgmElectron, k, v)
+		packer = VgmElectron()
+		vgm = ChunkSource(clock)
+		output = bytearray(registers)
+		ula_data = bytearray()
+		for n in range(0, len(output), 11):
+			frame = output[n:n+11]
+			ula_data.append( packer.convert_frame(frame, first_frame + n // 11, vgm) )
+			output[n:n+11] = frame
+	finally:
+		sys.stdout.close()
+		sys.stdout = log
+	return output, ula_data
+
+
+#------------------------------------------------------------------------
+# Server workers
+# Each worker process keeps one converter for the requests it handles
+#------------------------------------------------------------------------
+
+# the options that a server request can set, by their long command line names
+SERVER_SETTINGS = [ 'attenuation', 'transpose', 'channels', 'technique', 'compress', 'rle', 'patterns', 'trim', 'loop', 'loop_tolerance', 'ram', 'cycles', 'budget_cache', 'cache', 'cache_size', 'profile', 'memory' ]
+
+server_packer = None
+server_cancel_flags = None
+
+# cancel_flags is an optional shared array of flags, one per "cancel_slot" a request can name,
+# which the parent sets to stop a request that is already running
+def server_init(cancel_flags = None):
+	global server_packer, server_cancel_flags
+	# the conversion log would be mixed in with the replies
+	sys.stdout = open(os.devnull, 'w')
+	server_packer = VgmElectron()
+	server_cancel_flags = cancel_flags
+
+
+# handle one conversion request
+#  { "input": "<vgm file>", "output": "<electron vgm file>", "settings": { "attenuation": "444", "compress": true, ... } }
+# "input_data" can give the VGM (or VGZ) file contents as base64 instead of "input", in which case "output" must be set
+# "deadline" is an optional time.time() to give up at, and "cancel_slot" the index of the request's cancel flag
+# returns dict of results
+def server_convert(request):
+
+	start_time = time.time()
+
+	# every request starts from the default options
+	args = get_parser().parse_args([])
+	settings = request.get('settings', {})
+	for k, v in settings.items():
+		k = k.replace('-', '_')
+		if k not in SERVER_SETTINGS:
+			raise ValueError("Unknown setting '" + k + "'")
+		setattr(args, k, v)
+	apply_args(args)
+	VgmElectron.KEEP_ULA_DATA = False
+
+	src = request.get('input')
+	dst = request.get('output')
+	temp_filename = None
+	if 'input_data' in request:
+		if dst == None:
+			raise ValueError("output must be set with input_data")
+		import base64
+		import tempfile
+		temp_file = tempfile.NamedTemporaryFile(suffix = ".vgm", delete = False)
+		temp_file.write(base64.b64decode(request['input_data']))
+		temp_file.close()
+		src = temp_filename = temp_file.name
+	elif src == None:
+		raise ValueError("input or input_data must be set")
+	elif not os.path.isfile(src):
+		raise ValueError("File '" + src + "' not found")
+	elif src.lower()[-4:] not in [".vgm", ".vgz"]:
+		raise ValueError("Not a VGM source '" + src + "'")
+
+	if dst == None:
+		dst = os.path.splitext(src)[0] + ".electron.vgm"
+
+	server_packer.deadline = request.get('deadline')
+	server_packer.cancelled = None
+	slot = request.get('cancel_slot')
+	if slot != None and server_cancel_flags != None:
+		server_packer.cancelled = lambda: server_cancel_flags[slot] != 0
+
+	try:
+		server_packer.process(src, dst)
+	except:
+		# don't leave half written outputs behind
+		for filename in [ dst, dst + ".ula.bin" ]:
+			if os.path.isfile(filename):
+				os.remove(filename)
+		raise
+	finally:
+		if temp_filename != None:
+			os.remove(temp_filename)
+
+	return { 'output': dst, 'convert_ms': int((time.time() - start_time) * 1000) }
+
+
+#------------------------------------------------------------------------
+# asyncio API
+# eg. result = await convert("tune.vgm", settings = { 'attenuation': '444' }, timeout = 5.0)
+# Conversions run on a process pool shared by every caller, so the event loop is never blocked by the
+# conversion or its file reads and writes, and many conversions can be in flight from one loop.
+# Cancelling the awaiting task, or its timeout running out, removes a queued conversion from the pool
+# or stops a running one at its next frame, and its partial outputs are deleted.
+#------------------------------------------------------------------------
+
+ASYNC_JOBS = None # processes in the shared pool, default one per CPU
+ASYNC_SLOTS = 1024 # max conversions in flight at once
+
+async_pool = None
+async_cancel_flags = None
+async_free_slots = None
+
+def get_async_pool():
+	global async_pool, async_cancel_flags, async_free_slots
+	if async_pool is None:
+		import multiprocessing
+		from concurrent.futures import ProcessPoolExecutor
+		async_cancel_flags = multiprocessing.Array('b', ASYNC_SLOTS, lock = False)
+		async_free_slots = list(range(ASYNC_SLOTS))
+		async_pool = ProcessPoolExecutor(max_workers = ASYNC_JOBS, initializer = server_init, initargs = (async_cancel_flags,))
+	return async_pool
+
+
+# convert a VGM file, or VGM file contents given as input_data bytes (output must then be set)
+# settings is a dict of options as for server requests, timeout is the deadline in seconds from now
+# returns dict of results as for server requests
+async def convert(input = None, output = None, input_data = None, settings = None, timeout = None):
+
+	import asyncio
+	import base64
+
+	pool = get_async_pool()
+	if len(async_free_slots) == 0:
+		raise RuntimeError("Too many conversions in flight")
+	slot = async_free_slots.pop()
+	async_cancel_flags[slot] = 0
+
+	request = { 'settings': settings or {}, 'cancel_slot': slot }
+	if input is not None:
+		request['input'] = input
+	if output is not None:
+		request['output'] = output
+	if input_data is not None:
+		request['input_data'] = base64.b64encode(input_data).decode('ascii')
+	if timeout is not None:
+		request['deadline'] = time.time() + timeout
+
+	job = pool.submit(server_convert, request)
+	# the slot is only free for reuse once the worker is done with it
+	job.add_done_callback(lambda job: async_free_slots.append(slot))
+
+	try:
+		return await asyncio.wait_for(asyncio.wrap_future(job), timeout)
+	except (asyncio.CancelledError, asyncio.TimeoutError):
+		async_cancel_flags[slot] = 1
+		raise
+
+
+# Determine if running as a script
+if __name__ == '__main__':
+
+	parser = get_parser()
+
+	args = parser.parse_args()
+
+	# conversion server, replies go to stdout so the log goes to stderr
+	if args.server:
+		sys.stdout = sys.stderr
+		from modules.vgmserver import JsonLinesServer
+		server = JsonLinesServer(server_convert, args.jobs, server_init)
+		server.VERBOSE = args.verbose
+		try:
+			if args.socket != None:
+				server.serve_unix(args.socket)
+			else:
+				server.serve_stream(sys.stdin, sys.__stdout__)
+		except KeyboardInterrupt:
+			print("")
+		server.close()
 		sys.exit()
 
+	if len(args.input) == 0:
+		parser.error("the following arguments are required: input")
+
+	# an input from stdin is written to stdout unless an output is given
+	if args.output == None and args.input == ['-']:
+		args.output = '-'
+
+	# when writing to stdout, the log goes to stderr so that only the converted data is piped on
+	if args.output == '-':
+		sys.stdout = sys.stderr
+		if args.compress or args.rle or args.patterns or args.ram != None or args.cycles != None or args.shared != None or args.profile or args.memory:
+			print("ERROR: -z, -r, -p, -m, -b, -s, --profile and --memory write extra files, so can't be used with output to stdout")
+			sys.exit()
+
+	print("Vgm2Electron.py : VGM music converter for Acorn Electron")
+	print("Written in 2019 by Simon Morris, https://github.com/simondotm/vgm-packer")
+	print("")
+
+	if args.output != None and len(args.input) > 1:
+		print("ERROR: -o can only be used with a single input file")
+		sys.exit()
+
+	if '-' in args.input and len(args.input) > 1:
+		print("ERROR: stdin can only be used as a single input")
+		sys.exit()
+
+	if args.watch and ('-' in args.input or args.output == '-' or args.shared != None):
+		print("ERROR: --watch can't be used with stdin, stdout or -s")
+		sys.exit()
+
+	# every tune found in a directory would be written to the same output
+	if args.watch and args.output != None and any(os.path.isdir(src) for src in args.input):
+		print("ERROR: -o can't be used when watching a directory")
+		sys.exit()
+
+	try:
+		apply_args(args)
+	except ValueError as e:
+		print("ERROR: " + str(e))
+		sys.exit()
+
+	# check for missing files
+	for src in args.input:
+		if src != '-' and not os.path.isfile(src) and not (args.watch and os.path.isdir(src)):
+			print("ERROR: File '" + src + "' not found")
+			sys.exit()
+
 	packer = VgmElectron()
 	packer.VERBOSE = args.verbose
-	packer.process(src, dst)
+
+	# reconvert inputs as they change, in this one process
+	# the conversion log is only shown in verbose mode, since it would bury the one line report for each file
+	if args.watch:
+		def watch_convert(src):
+			dst = args.output
+			if dst == None:
+				dst = os.path.splitext(src)[0] + ".electron.vgm"
+			start_time = time.time()
+			log = sys.stdout
+			if not args.verbose:
+				sys.stdout = open(os.devnull, 'w')
+			try:
+				packer.process(src, dst)
+				result = "converted to '" + dst + "'"
+			except Exception as e:
+				result = "FAILED - " + str(e)
+			finally:
+				if not args.verbose:
+					sys.stdout.close()
+					sys.stdout = log
+			print("'" + src + "' " + result + " in " + str(int((time.time() - start_time) * 1000)) + "ms")
+
+		from modules.vgmwatch import VgmWatcher
+		watcher = VgmWatcher(args.input)
+		watcher.VERBOSE = args.verbose
+		try:
+			watcher.watch(watch_convert)
+		except KeyboardInterrupt:
+			print("")
+		sys.exit()
+
+	tunes = []
+	for src in args.input:
+		dst = args.output
+		if dst == None:
+			dst = os.path.splitext(src)[0] + ".electron.vgm"
+
+		electron_data = packer.process(src, dst)
+		if electron_data is not None:
+			tunes.append( (dst, electron_data) )
+
+	# shared pattern bank for a set of tunes
+	if args.shared != None:
+		packer.write_shared(tunes, args.shared)
 
 
 